@@ -173,6 +173,46 @@ Q_CLUSTER = {
     }
 } 
 
+# IMAP IDLE Worker
+# ------------------------------------------------------------------------------
+# Mit IMAP_IDLE_SHARDING=True laufen die IDLE-Verbindungen in separaten Workern
+# (`manage.py run_idle_worker`), die sich die Konten per Consistent Hashing und
+# Redis-Leases aufteilen. Ohne Sharding startet ImapConfig.ready() den Manager-Thread.
+IMAP_IDLE_SHARDING = env.bool("IMAP_IDLE_SHARDING", default=False)
+IMAP_IDLE_REDIS_URL = env(
+    "IMAP_IDLE_REDIS_URL",
+    default=f"redis://{env('REDIS_HOST', default='redis')}:{env.int('REDIS_PORT', default=6379)}/{env.int('REDIS_DB_IDLE', default=2)}",
+)
+
+# Embedding-Server
+# ------------------------------------------------------------------------------
+# Ist AI_EMBEDDING_SERVER_URL gesetzt (z.B. "http://127.0.0.1:8765" oder
+# "unix:///tmp/mailmind-embeddings.sock"), laden die Worker kein eigenes
+# SentenceTransformer-Modell, sondern nutzen `manage.py run_embedding_server`.
+AI_EMBEDDING_SERVER_URL = env("AI_EMBEDDING_SERVER_URL", default="")
+
+# AI-Antwort-Cache
+# ------------------------------------------------------------------------------
+# Pro PromptTemplate aktivierbar (response_cache_enabled); siehe mailmind/ai/response_cache.py.
+AI_RESPONSE_CACHE_ENABLED = env.bool("AI_RESPONSE_CACHE_ENABLED", default=True)
+AI_RESPONSE_CACHE_REDIS_URL = env(
+    "AI_RESPONSE_CACHE_REDIS_URL",
+    default=f"redis://{env('REDIS_HOST', default='redis')}:{env.int('REDIS_PORT', default=6379)}/{env.int('REDIS_DB_AI_CACHE', default=3)}",
+)
+AI_RESPONSE_CACHE_TTL = env.int("AI_RESPONSE_CACHE_TTL", default=24 * 3600)
+AI_RESPONSE_CACHE_MAX_ENTRIES = env.int("AI_RESPONSE_CACHE_MAX_ENTRIES", default=10000)
+
+# AI-Rate-Limiter
+# ------------------------------------------------------------------------------
+# Token-Bucket (Requests/min, Tokens/min) und Concurrency-Slots pro Provider/API-Key/Modell,
+# gemeinsam für alle Worker; siehe mailmind/ai/rate_limiter.py. AI_RATE_LIMITS als JSON, z.B.
+# {"groq": {"rpm": 30, "tpm": 6000, "concurrency": 4}, "groq:llama3-70b-8192": {"tpm": 6000}}
+AI_RATE_LIMIT_ENABLED = env.bool("AI_RATE_LIMIT_ENABLED", default=True)
+AI_RATE_LIMIT_REDIS_URL = env("AI_RATE_LIMIT_REDIS_URL", default=AI_RESPONSE_CACHE_REDIS_URL)
+AI_RATE_LIMITS = env.json("AI_RATE_LIMITS", default={})
+AI_RATE_LIMIT_DEADLINE = env.int("AI_RATE_LIMIT_DEADLINE", default=60)  # interaktive Aufrufe
+AI_RATE_LIMIT_TASK_DEADLINE = env.int("AI_RATE_LIMIT_TASK_DEADLINE", default=300)  # Hintergrund-Tasks (< Q_CLUSTER timeout)
+
 # URLs
 # ------------------------------------------------------------------------------
 ROOT_URLCONF = "config.urls"
@@ -1,5 +1,6 @@
 import logging
 import json
+from typing import Any, Awaitable, Callable, Optional, Tuple
 # Move imports inside the function to delay loading
 # import google.generativeai as genai # Now imported inside
 # from google.api_core import exceptions as google_exceptions # Now imported inside
@@ -12,23 +13,62 @@ import json
 
 logger = logging.getLogger(__name__)
 
+
+async def _stream_groq_completion(client, prompt: str, model_name: str, on_delta) -> Tuple[str, Any, str, Any]:
+    """Streamt eine Groq-Chat-Completion; liefert (content, usage, raw_response_str, headers)."""
+    stream = await client.chat.completions.create(
+        messages=[{"role": "user", "content": prompt}],
+        model=model_name,
+        stream=True,
+    )
+    parts = []
+    usage = None
+    chunk_count = 0
+    finish_reason = None
+    async for chunk in stream:
+        chunk_count += 1
+        if chunk.choices:
+            delta = chunk.choices[0].delta.content
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if delta:
+                parts.append(delta)
+                await on_delta(delta)
+        x_groq = getattr(chunk, 'x_groq', None)
+        if x_groq is not None and getattr(x_groq, 'usage', None):
+            usage = x_groq.usage # Groq liefert die Usage im letzten Chunk
+    raw_response_str = json.dumps({"streamed": True, "chunks": chunk_count, "finish_reason": finish_reason})
+    headers = getattr(getattr(stream, 'response', None), 'headers', None) # x-ratelimit-* für den Rate-Limiter
+    return ''.join(parts), usage, raw_response_str, headers
+
 # Make the function async
-async def call_ai_api(prompt: str, user, provider: str, model_name: str, triggering_source: str = "unknown") -> str:
+async def call_ai_api(prompt: str, user, provider: str, model_name: str, triggering_source: str = "unknown",
+                      on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                      cache_options: Optional[dict] = None,
+                      rate_limit_deadline: Optional[float] = None) -> str:
     """Generic function to call different AI provider APIs.
     Handles logging, API key retrieval, client instantiation, and basic error handling.
     Returns the AI response content as a string, or an error JSON string.
+    If on_delta is given, the response is streamed and every text delta is awaited with on_delta(delta)
+    (see streaming.SuggestionDeltaRelay); the return value is still the complete content.
+    cache_options (response_cache.response_cache_options) enables the response cache for this call;
+    a cache hit is returned without an API call and without an AIRequestLog entry.
+    Every call waits for the distributed rate limiter (rate_limiter.py) for at most rate_limit_deadline
+    seconds (default AI_RATE_LIMIT_DEADLINE); otherwise an error JSON with "rate_limited": true and
+    "retry_after" is returned, as for a 429 from the provider.
     """
     # Import necessary modules here
     import time
     from django.utils import timezone
-    from asgiref.sync import sync_to_async
     from mailmind.core.models import User, AIRequestLog, APICredential # Moved model import here
+    from .api_keys import aget_api_key
+    from .request_log import log_ai_request
+    from . import rate_limiter
     # Import provider specific libraries here to avoid loading everything always
     client = None
     model = None # Variable for Gemini model
+    from .provider_clients import registry as client_registry, get_gemini_model, GEMINI_SAFETY_SETTINGS
     if provider == 'groq':
-        from .clients import get_groq_client # Moved client import
-        from groq import Groq, APIError as GroqAPIError # Moved Groq imports
+        from groq import APIError as GroqAPIError # Moved Groq imports
     elif provider == 'google_gemini':
         try:
             import google.generativeai as genai
@@ -39,92 +79,103 @@ async def call_ai_api(prompt: str, user, provider: str, model_name: str, trigger
              return json.dumps({"error": "Google Generative AI library not installed."})
     # Add other provider imports here if needed
 
+    cache_lookup = None
+    if cache_options:
+        from . import response_cache
+        cache_lookup = await response_cache.alookup(user.id, provider, model_name, prompt, cache_options)
+        if cache_lookup.response is not None:
+            logger.info(f"AI response cache hit ({cache_lookup.kind}) for template '{cache_options['template']}' ({provider}/{model_name}).")
+            if on_delta is not None:
+                await on_delta(cache_lookup.response)
+            return cache_lookup.response
+
     log_entry = None
     start_time = time.time()
     
     # Type hint user properly if possible (needs User model imported)
     typed_user: User = user
 
-    # Create initial log entry (using sync_to_async)
-    try:
-        log_entry = await sync_to_async(AIRequestLog.objects.create)(
-            user=typed_user,
-            provider=provider,
-            model_name=model_name,
-            triggering_source=triggering_source,
-            prompt_text=prompt, # Log the potentially long prompt
-            is_success=False # Default to False
-        )
-        # Log prompt length for debugging context issues
-        logger.debug(f"Created initial AIRequestLog entry {log_entry.id} for {provider}/{model_name}. Prompt length: {len(prompt)} chars.")
-    except Exception as e_log_create:
-        logger.error(f"Failed to create initial AIRequestLog: {e_log_create}", exc_info=True)
-
-    # Get API Key by fetching the credential object first
+    # Log entry is only built in memory; the buffered writer persists it after the call (bulk_create)
+    log_entry = AIRequestLog(
+        user=typed_user,
+        provider=provider,
+        model_name=model_name,
+        triggering_source=triggering_source,
+        prompt_text=prompt, # Log the potentially long prompt
+        is_success=False # Default to False
+    )
+    # Log prompt length for debugging context issues
+    logger.debug(f"Prepared AIRequestLog entry for {provider}/{model_name}. Prompt length: {len(prompt)} chars.")
+
+    # Get API Key from the per-process cache (DB + decrypt only on a miss)
     api_key = None
-    credential = None
     try:
-        credential = await sync_to_async(APICredential.objects.get)(user=typed_user, provider=provider)
-        api_key = await sync_to_async(credential.get_api_key)()
-        if not api_key:
-             raise ValueError(f"API key for {provider} could not be retrieved or decrypted.")
+        api_key = await aget_api_key(typed_user.id, provider)
     except APICredential.DoesNotExist:
         error_msg = f"API credential for {provider} not found for User {typed_user.id}."
         logger.error(error_msg)
-        if log_entry:
-            log_entry.is_success = False
-            log_entry.error_message = error_msg
-            log_entry.duration_ms = int((time.time() - start_time) * 1000)
-            await sync_to_async(log_entry.save)()
+        log_entry.is_success = False
+        log_entry.error_message = error_msg
+        log_entry.duration_ms = int((time.time() - start_time) * 1000)
+        log_ai_request(log_entry)
         return json.dumps({"error": error_msg})
     except Exception as e_key:
         error_msg = f"Error retrieving API credential or key for {provider}, User {typed_user.id}: {e_key}"
         logger.error(error_msg, exc_info=True)
-        if log_entry:
-            log_entry.is_success = False
-            log_entry.error_message = f"API Key Retrieval Error: {error_msg}"
-            log_entry.duration_ms = int((time.time() - start_time) * 1000)
-            await sync_to_async(log_entry.save)()
+        log_entry.is_success = False
+        log_entry.error_message = f"API Key Retrieval Error: {error_msg}"
+        log_entry.duration_ms = int((time.time() - start_time) * 1000)
+        log_ai_request(log_entry)
         return json.dumps({"error": f"Error retrieving API key: {e_key}"})
 
+    # Freigabe des verteilten Rate-Limiters (Slot + Token-Bucket); wartet höchstens bis zur Deadline
+    try:
+        rate_lease = await rate_limiter.aacquire(provider, api_key, model_name, prompt, deadline=rate_limit_deadline)
+    except rate_limiter.RateLimitExceeded as e_limit:
+        logger.warning(f"{e_limit} User {typed_user.id}, source '{triggering_source}'.")
+        log_entry.is_success = False
+        log_entry.error_message = str(e_limit)
+        log_entry.duration_ms = int((time.time() - start_time) * 1000)
+        log_ai_request(log_entry)
+        return json.dumps({"error": str(e_limit), "rate_limited": True, "retry_after": round(e_limit.retry_after, 1)})
+
     # --- API Call Logic ---
     response = None
     response_content = None
     raw_response_str = None
+    stream_usage = None
+    rate_headers = None
     try:
         # --- Groq ---
         if provider == 'groq':
-            client = get_groq_client(api_key=api_key)
-            if not client:
-                raise Exception(f"Failed to initialize Groq client.")
+            # Gepoolter AsyncGroq-Client (HTTP/2, Keep-Alive); blockiert den Event-Loop nicht
+            client = await client_registry.get_async('groq', api_key)
 
-            logger.debug(f"Calling Groq client chat completions with model '{model_name}'")
-            response = client.chat.completions.create(
-                 messages=[{"role": "user", "content": prompt}],
-                 model=model_name,
-            )
-            response_content = response.choices[0].message.content
-            # Serialize raw Groq response
-            try:
-                raw_response_str = response.model_dump_json()
-            except Exception as e_dump:
-                logger.warning(f"Could not serialize raw Groq response object: {e_dump}")
-                raw_response_str = repr(response)
+            logger.debug(f"Calling Groq client chat completions with model '{model_name}' (stream: {on_delta is not None})")
+            if on_delta is not None:
+                response_content, stream_usage, raw_response_str, rate_headers = await _stream_groq_completion(client, prompt, model_name, on_delta)
+            else:
+                # with_raw_response liefert zusätzlich die x-ratelimit-*-Header
+                raw_http_response = await client.chat.completions.with_raw_response.create(
+                     messages=[{"role": "user", "content": prompt}],
+                     model=model_name,
+                )
+                rate_headers = raw_http_response.headers
+                response = raw_http_response.parse()
+                response_content = response.choices[0].message.content
+                # Serialize raw Groq response
+                try:
+                    raw_response_str = response.model_dump_json()
+                except Exception as e_dump:
+                    logger.warning(f"Could not serialize raw Groq response object: {e_dump}")
+                    raw_response_str = repr(response)
 
         # --- Google Gemini ---
         elif provider == 'google_gemini':
-            logger.debug(f"Configuring Google Gemini API key...")
-            genai.configure(api_key=api_key)
-            logger.debug(f"Instantiating Google Gemini model '{model_name}'")
-            model = genai.GenerativeModel(model_name)
-
-            # Safety settings example (adjust as needed)
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
+            # Gepoolter gRPC-Client pro API-Key statt globalem genai.configure()
+            service_client = await client_registry.get_async('google_gemini', api_key)
+            model = get_gemini_model(model_name, service_client, is_async=True)
+            safety_settings = GEMINI_SAFETY_SETTINGS
             # Generation config example (adjust as needed)
             generation_config = genai.types.GenerationConfig(
                 # temperature=0.7, # Example setting
@@ -136,8 +187,18 @@ async def call_ai_api(prompt: str, user, provider: str, model_name: str, trigger
             response = await model.generate_content_async(
                 prompt,
                 generation_config=generation_config,
-                safety_settings=safety_settings
+                safety_settings=safety_settings,
+                stream=on_delta is not None,
                 )
+            if on_delta is not None:
+                # Iteration aggregiert die Chunks im Response-Objekt; danach gelten die Prüfungen unten unverändert
+                async for chunk in response:
+                    try:
+                        delta = chunk.text
+                    except ValueError: # Chunk ohne Text (z.B. nur finish_reason)
+                        delta = ''
+                    if delta:
+                        await on_delta(delta)
 
             # Handle potential blocks or errors in response
             if not response.candidates:
@@ -179,10 +240,11 @@ async def call_ai_api(prompt: str, user, provider: str, model_name: str, trigger
             log_entry.is_success = True
             log_entry.duration_ms = int((time.time() - start_time) * 1000)
             # Add provider-specific token counts if available
-            if provider == 'groq' and hasattr(response, 'usage'):
-                log_entry.completion_tokens = response.usage.completion_tokens
-                log_entry.prompt_tokens = response.usage.prompt_tokens
-                log_entry.total_tokens = response.usage.total_tokens
+            groq_usage = stream_usage or getattr(response, 'usage', None)
+            if provider == 'groq' and groq_usage:
+                log_entry.completion_tokens = groq_usage.completion_tokens
+                log_entry.prompt_tokens = groq_usage.prompt_tokens
+                log_entry.total_tokens = groq_usage.total_tokens
             elif provider == 'google_gemini' and hasattr(response, 'usage_metadata'):
                 # Gemini's usage_metadata structure might differ
                  log_entry.completion_tokens = getattr(response.usage_metadata, 'candidates_token_count', None)
@@ -190,9 +252,13 @@ async def call_ai_api(prompt: str, user, provider: str, model_name: str, trigger
                  log_entry.total_tokens = getattr(response.usage_metadata, 'total_token_count', None)
             # Add other providers here
             
-            logger.debug(f"Saving successful AIRequestLog entry {log_entry.id}. Value for raw_response_text: {repr(log_entry.raw_response_text)}")
-            await sync_to_async(log_entry.save)()
-            logger.debug(f"Updated AIRequestLog entry {log_entry.id}. Success: True, Duration: {log_entry.duration_ms}ms")
+            log_ai_request(log_entry)
+            logger.debug(f"Queued AIRequestLog entry for {provider}/{model_name}. Success: True, Duration: {log_entry.duration_ms}ms")
+
+        await rate_limiter.afinish(rate_lease, total_tokens=log_entry.total_tokens, headers=rate_headers)
+
+        if cache_lookup is not None and response_content:
+            await response_cache.astore(provider, model_name, cache_options, cache_lookup, response_content)
 
         return response_content # Return the extracted content
 
@@ -200,6 +266,9 @@ async def call_ai_api(prompt: str, user, provider: str, model_name: str, trigger
     except Exception as e:
         # Default error message
         error_msg = f"Error calling {provider} API: {str(e)}"
+        # 429/ResourceExhausted sperrt den Bucket bis zum Reset, damit andere Worker nicht nachlegen
+        retry_after = rate_limiter.rate_limit_retry_after(provider, e)
+        await rate_limiter.afinish(rate_lease, retry_after=retry_after)
         
         # Refine error message based on exception type
         if provider == 'groq':
@@ -236,11 +305,12 @@ async def call_ai_api(prompt: str, user, provider: str, model_name: str, trigger
             # Save the exception details as raw response on error
             log_entry.raw_response_text = json.dumps({"error": str(e), "detail": error_msg, "type": type(e).__name__}) 
             log_entry.duration_ms = int((time.time() - start_time) * 1000)
-            logger.debug(f"Saving AIRequestLog entry {log_entry.id} on error. Value for raw_response_text: {repr(log_entry.raw_response_text)}")
-            await sync_to_async(log_entry.save)()
-            logger.debug(f"Updated AIRequestLog entry {log_entry.id} on error. Success: False, Duration: {log_entry.duration_ms}ms")
+            log_ai_request(log_entry)
+            logger.debug(f"Queued AIRequestLog entry for {provider}/{model_name} on error. Success: False, Duration: {log_entry.duration_ms}ms")
             
         # Return JSON error string
+        if retry_after:
+            return json.dumps({"error": error_msg, "rate_limited": True, "retry_after": round(retry_after, 1)})
         return json.dumps({"error": error_msg}) 
 
 # NEUE SYNCHRONE VERSION
@@ -249,25 +319,31 @@ def call_ai_api_sync(
     user, # Typ hier explizit setzen, falls möglich: from mailmind.core.models import User
     provider: str, 
     model_name: str, 
-    triggering_source: str = "unknown"
+    triggering_source: str = "unknown",
+    cache_options: Optional[dict] = None,
+    rate_limit_deadline: Optional[float] = None
 ) -> str:
     """Synchronous version to call different AI provider APIs.
     Handles logging, API key retrieval, client instantiation, and basic error handling.
     Returns the AI response content as a string, or an error JSON string.
     WARNING: This function will BLOCK until the AI API call completes.
+    cache_options, rate_limit_deadline: see call_ai_api.
     """
     # Import necessary modules here (synchronous versions if needed)
     import time
     from django.utils import timezone
     # from asgiref.sync import sync_to_async # Not needed here
     from mailmind.core.models import User, AIRequestLog, APICredential # Import models
+    from .api_keys import get_api_key
+    from .request_log import log_ai_request
+    from . import rate_limiter
     
     # Import provider specific libraries (can stay here)
     client = None
     model = None # Variable for Gemini model
+    from .provider_clients import registry as client_registry, get_gemini_model, GEMINI_SAFETY_SETTINGS
     if provider == 'groq':
-        from .clients import get_groq_client
-        from groq import Groq, APIError as GroqAPIError
+        from groq import APIError as GroqAPIError
     elif provider == 'google_gemini':
         try:
             import google.generativeai as genai
@@ -277,68 +353,78 @@ def call_ai_api_sync(
              return json.dumps({"error": "Google Generative AI library not installed."})
     # Add other provider imports here if needed
 
+    cache_lookup = None
+    if cache_options:
+        from . import response_cache
+        cache_lookup = response_cache.lookup(user.id, provider, model_name, prompt, cache_options)
+        if cache_lookup.response is not None:
+            logger.info(f"AI response cache hit ({cache_lookup.kind}, sync) for template '{cache_options['template']}' ({provider}/{model_name}).")
+            return cache_lookup.response
+
     log_entry = None
     start_time = time.time()
     typed_user: User = user
 
-    # Create initial log entry (SYNCHRONOUS)
-    try:
-        log_entry = AIRequestLog.objects.create(
-            user=typed_user,
-            provider=provider,
-            model_name=model_name,
-            triggering_source=triggering_source,
-            prompt_text=prompt,
-            is_success=False
-        )
-        logger.debug(f"Created initial AIRequestLog entry (sync) {log_entry.id} for {provider}/{model_name}. Prompt length: {len(prompt)} chars.")
-    except Exception as e_log_create:
-        logger.error(f"Failed to create initial AIRequestLog (sync): {e_log_create}", exc_info=True)
-
-    # Get API Key (SYNCHRONOUS)
+    # In-memory log entry, persisted by the buffered writer
+    log_entry = AIRequestLog(
+        user=typed_user,
+        provider=provider,
+        model_name=model_name,
+        triggering_source=triggering_source,
+        prompt_text=prompt,
+        is_success=False
+    )
+    logger.debug(f"Prepared AIRequestLog entry (sync) for {provider}/{model_name}. Prompt length: {len(prompt)} chars.")
+
+    # Get API Key (cached per process)
     api_key = None
-    credential = None
     try:
-        credential = APICredential.objects.get(user=typed_user, provider=provider)
-        api_key = credential.get_api_key()
-        if not api_key:
-             raise ValueError(f"API key for {provider} could not be retrieved or decrypted.")
+        api_key = get_api_key(typed_user.id, provider)
     except APICredential.DoesNotExist:
         error_msg = f"API credential for {provider} not found for User {typed_user.id}."
         logger.error(error_msg)
-        if log_entry:
-            log_entry.is_success = False
-            log_entry.error_message = error_msg
-            log_entry.duration_ms = int((time.time() - start_time) * 1000)
-            log_entry.save() # Synchronous save
+        log_entry.is_success = False
+        log_entry.error_message = error_msg
+        log_entry.duration_ms = int((time.time() - start_time) * 1000)
+        log_ai_request(log_entry)
         return json.dumps({"error": error_msg})
     except Exception as e_key:
         error_msg = f"Error retrieving API credential or key (sync) for {provider}, User {typed_user.id}: {e_key}"
         logger.error(error_msg, exc_info=True)
-        if log_entry:
-            log_entry.is_success = False
-            log_entry.error_message = f"API Key Retrieval Error: {error_msg}"
-            log_entry.duration_ms = int((time.time() - start_time) * 1000)
-            log_entry.save() # Synchronous save
+        log_entry.is_success = False
+        log_entry.error_message = f"API Key Retrieval Error: {error_msg}"
+        log_entry.duration_ms = int((time.time() - start_time) * 1000)
+        log_ai_request(log_entry)
         return json.dumps({"error": f"Error retrieving API key: {e_key}"})
 
+    # Freigabe des verteilten Rate-Limiters (blockiert höchstens bis zur Deadline)
+    try:
+        rate_lease = rate_limiter.acquire(provider, api_key, model_name, prompt, deadline=rate_limit_deadline)
+    except rate_limiter.RateLimitExceeded as e_limit:
+        logger.warning(f"{e_limit} User {typed_user.id}, source '{triggering_source}' (sync).")
+        log_entry.is_success = False
+        log_entry.error_message = str(e_limit)
+        log_entry.duration_ms = int((time.time() - start_time) * 1000)
+        log_ai_request(log_entry)
+        return json.dumps({"error": str(e_limit), "rate_limited": True, "retry_after": round(e_limit.retry_after, 1)})
+
     # --- API Call Logic (SYNCHRONOUS) ---
     response = None
     response_content = None
     raw_response_str = None
+    rate_headers = None
     try:
         # --- Groq ---
         if provider == 'groq':
-            client = get_groq_client(api_key=api_key)
-            if not client:
-                raise Exception(f"Failed to initialize Groq client.")
+            client = client_registry.get_sync('groq', api_key)
 
             logger.debug(f"Calling Groq client chat completions (sync) with model '{model_name}'")
-            # Groq SDK is likely synchronous by default
-            response = client.chat.completions.create(
+            raw_http_response = client.chat.completions.with_raw_response.create(
                  messages=[{"role": "user", "content": prompt}],
                  model=model_name,
             )
+            rate_headers = raw_http_response.headers
+            response = raw_http_response.parse()
             response_content = response.choices[0].message.content
             try:
                 raw_response_str = response.model_dump_json()
@@ -348,16 +434,9 @@ def call_ai_api_sync(
 
         # --- Google Gemini ---
         elif provider == 'google_gemini':
-            logger.debug(f"Configuring Google Gemini API key (sync)...")
-            genai.configure(api_key=api_key)
-            logger.debug(f"Instantiating Google Gemini model (sync) '{model_name}'")
-            model = genai.GenerativeModel(model_name)
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
+            service_client = client_registry.get_sync('google_gemini', api_key)
+            model = get_gemini_model(model_name, service_client, is_async=False)
+            safety_settings = GEMINI_SAFETY_SETTINGS
             generation_config = genai.types.GenerationConfig()
 
             logger.debug(f"Calling Google Gemini generate_content (sync) with model '{model_name}'")
@@ -409,9 +488,13 @@ def call_ai_api_sync(
                  log_entry.prompt_tokens = getattr(response.usage_metadata, 'prompt_token_count', None)
                  log_entry.total_tokens = getattr(response.usage_metadata, 'total_token_count', None)
             
-            logger.debug(f"Saving successful AIRequestLog entry {log_entry.id} (sync). Value for raw_response_text: {repr(log_entry.raw_response_text)}")
-            log_entry.save() # Synchronous save
-            logger.debug(f"Updated AIRequestLog entry {log_entry.id} (sync). Success: True, Duration: {log_entry.duration_ms}ms")
+            log_ai_request(log_entry)
+            logger.debug(f"Queued AIRequestLog entry (sync) for {provider}/{model_name}. Success: True, Duration: {log_entry.duration_ms}ms")
+
+        rate_limiter.finish(rate_lease, total_tokens=log_entry.total_tokens, headers=rate_headers)
+
+        if cache_lookup is not None and response_content:
+            response_cache.store(provider, model_name, cache_options, cache_lookup, response_content)
 
         return response_content # Return the extracted content
 
@@ -419,18 +502,18 @@ def call_ai_api_sync(
     except Exception as e:
         error_msg = f"Error during AI API call (sync) for {provider}/{model_name}, User {typed_user.id}: {e}"
         logger.error(error_msg, exc_info=True)
+        retry_after = rate_limiter.rate_limit_retry_after(provider, e)
+        rate_limiter.finish(rate_lease, retry_after=retry_after)
         if log_entry:
             log_entry.is_success = False
             log_entry.error_message = str(e) # Log the error message
             log_entry.duration_ms = int((time.time() - start_time) * 1000)
-            # Try to save the log entry even on error
-            try:
-                 log_entry.save() # Synchronous save
-            except Exception as e_log_save:
-                 logger.error(f"Failed to save error details to AIRequestLog {log_entry.id}: {e_log_save}")
+            log_ai_request(log_entry)
         # Return error JSON
         # Check for specific provider errors if needed (e.g., GroqAPIError, google_exceptions.GoogleAPIError)
         status_code = 500 # Default internal server error
+        if retry_after:
+            return json.dumps({"error": f"AI API Error: {str(e)}", "status_code": 429, "rate_limited": True, "retry_after": round(retry_after, 1)})
         # Add specific error mapping here if needed
         # if isinstance(e, GroqAPIError): ...
         # if isinstance(e, google_exceptions.GoogleAPIError): ...
@@ -0,0 +1,73 @@
+"""
+Prozesslokaler Cache für entschlüsselte Provider-API-Keys.
+
+Statt pro LLM-Aufruf APICredential zu laden und per Fernet zu entschlüsseln, wird der Klartext-Key
+pro (user_id, provider) im Speicher gehalten. Das post_save/post_delete-Signal von APICredential
+invalidiert den Eintrag (mailmind.core.signals); da Signale nur im speichernden Prozess ankommen,
+begrenzt AI_API_KEY_CACHE_TTL die Gültigkeit in den übrigen Prozessen (Worker, ASGI).
+"""
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+API_KEY_CACHE_TTL = getattr(settings, 'AI_API_KEY_CACHE_TTL', 300) # Sekunden
+
+_api_keys: Dict[Tuple[int, str], Tuple[str, float]] = {}
+_lock = threading.Lock()
+
+
+def _load_api_key(user_id: int, provider: str) -> str:
+    from mailmind.core.models import APICredential
+
+    credential = APICredential.objects.get(user_id=user_id, provider=provider) # DoesNotExist an den Aufrufer
+    api_key = credential.get_api_key()
+    if not api_key:
+        raise ValueError(f"API key for {provider} could not be retrieved or decrypted.")
+    return api_key
+
+
+def _cached_api_key(user_id: int, provider: str):
+    with _lock:
+        cached = _api_keys.get((user_id, provider))
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    return None
+
+
+def _store_api_key(user_id: int, provider: str, api_key: str):
+    with _lock:
+        _api_keys[(user_id, provider)] = (api_key, time.monotonic() + API_KEY_CACHE_TTL)
+
+
+def get_api_key(user_id: int, provider: str) -> str:
+    """Entschlüsselter API-Key; wirft APICredential.DoesNotExist bzw. ValueError wie zuvor."""
+    api_key = _cached_api_key(user_id, provider)
+    if api_key is None:
+        api_key = _load_api_key(user_id, provider)
+        _store_api_key(user_id, provider, api_key)
+    return api_key
+
+
+async def aget_api_key(user_id: int, provider: str) -> str:
+    """Async-Variante; nur bei einem Cache-Miss wird in einen Thread (DB + Fernet) gewechselt."""
+    api_key = _cached_api_key(user_id, provider)
+    if api_key is None:
+        api_key = await sync_to_async(_load_api_key)(user_id, provider)
+        _store_api_key(user_id, provider, api_key)
+    return api_key
+
+
+def invalidate_api_key(user_id: int, provider: str):
+    """Entfernt den Key aus dem Cache und verwirft die zugehörigen gepoolten Provider-Clients."""
+    with _lock:
+        cached = _api_keys.pop((user_id, provider), None)
+    if cached:
+        from .provider_clients import registry
+        registry.invalidate(provider, cached[0])
+        logger.debug(f"Invalidated cached {provider} API key for user {user_id}.")
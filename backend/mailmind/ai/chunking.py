@@ -0,0 +1,104 @@
+"""
+Zerlegung langer E-Mails in überlappende, token-basierte Fenster für Embeddings.
+
+Das Embedding-Modell schneidet Texte nach max_seq_length Tokens stillschweigend ab; ohne
+Chunking wären spätere Teile langer E-Mails nicht auffindbar. Zitierte Antworten werden
+vorher entfernt, da sie bereits als eigene E-Mails im Index liegen.
+"""
+import hashlib
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CHUNK_TOKENS = getattr(settings, 'AI_EMBEDDING_CHUNK_TOKENS', 256) # Obergrenze; wird auf max_seq_length des Modells begrenzt
+EMBEDDING_CHUNK_OVERLAP = getattr(settings, 'AI_EMBEDDING_CHUNK_OVERLAP', 32)
+EMBEDDING_MAX_CHUNKS = getattr(settings, 'AI_EMBEDDING_MAX_CHUNKS', 64) # Schutz vor riesigen Mails (Logs, Newsletter)
+
+# Beginn eines zitierten Verlaufs (Outlook, Gmail, Apple Mail, Thunderbird; DE/EN)
+_REPLY_HEADER_RES = [
+    re.compile(r'^\s*-{2,}\s*(Original Message|Ursprüngliche Nachricht|Forwarded message|Weitergeleitete Nachricht)\s*-{2,}', re.IGNORECASE),
+    re.compile(r'^\s*On .{1,200} wrote:\s*$', re.IGNORECASE),
+    re.compile(r'^\s*Am .{1,200} schrieb .{1,200}:\s*$', re.IGNORECASE),
+    re.compile(r'^\s*(From|Von):\s.+$', re.IGNORECASE),
+]
+_WHITESPACE_RE = re.compile(r'[ \t]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def strip_quoted_reply(text: str) -> str:
+    """Entfernt '>'-zitierte Zeilen und alles ab dem ersten Antwort-/Weiterleitungs-Header."""
+    if not text:
+        return ""
+    kept_lines = []
+    for line in text.splitlines():
+        if any(pattern.match(line) for pattern in _REPLY_HEADER_RES):
+            # Nur abschneiden, wenn davor bereits eigener Inhalt steht (reine Weiterleitungen behalten)
+            if any(kept.strip() for kept in kept_lines):
+                break
+            continue
+        if line.lstrip().startswith('>'):
+            continue
+        kept_lines.append(line)
+    stripped = '\n'.join(kept_lines)
+    stripped = _WHITESPACE_RE.sub(' ', stripped)
+    return _BLANK_LINES_RE.sub('\n\n', stripped).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _token_spans(tokenizer, text: str) -> Optional[List[Tuple[int, int]]]:
+    """Zeichen-Offsets der Tokens (nur Fast-Tokenizer liefern offset_mapping)."""
+    try:
+        encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, truncation=False)
+        return [tuple(span) for span in encoded['offset_mapping']]
+    except Exception as e:
+        logger.debug(f"Tokenizer liefert keine Offsets, verwende Wort-Fenster: {e}")
+        return None
+
+
+def _word_spans(text: str) -> List[Tuple[int, int]]:
+    return [match.span() for match in re.finditer(r'\S+', text)]
+
+
+def chunk_email_text(subject: str, from_address: str, body_text: str, model=None) -> List[Dict[str, Any]]:
+    """Zerlegt eine E-Mail in Chunks ('chunk_index', 'text', 'text_hash').
+
+    Jeder Chunk beginnt mit Betreff und Absender, damit er für sich allein suchbar ist. Die Fenstergröße
+    richtet sich nach dem Tokenizer des Modells (max_seq_length abzüglich Header und Spezialtokens).
+    """
+    header = f"Betreff: {subject or ''}\nAbsender: {from_address or ''}\n\n"
+    body = strip_quoted_reply(body_text or '')
+
+    tokenizer = getattr(model, 'tokenizer', None) if model is not None else None
+    max_tokens = EMBEDDING_CHUNK_TOKENS
+    model_max = getattr(model, 'max_seq_length', None) if model is not None else None
+    if model_max:
+        max_tokens = min(max_tokens, model_max)
+
+    spans = _token_spans(tokenizer, body) if tokenizer is not None else None
+    header_tokens = len(_token_spans(tokenizer, header) or []) if spans is not None else len(header.split())
+    if spans is None:
+        spans = _word_spans(body)
+    window = max(16, max_tokens - header_tokens - 2) # [CLS]/[SEP]
+    step = max(1, window - min(EMBEDDING_CHUNK_OVERLAP, window // 2))
+
+    chunks = []
+    if not spans:
+        chunks.append(header.strip())
+    else:
+        for start in range(0, len(spans), step):
+            window_spans = spans[start:start + window]
+            chunks.append(header + body[window_spans[0][0]:window_spans[-1][1]])
+            if start + window >= len(spans) or len(chunks) >= EMBEDDING_MAX_CHUNKS:
+                break
+
+    return [
+        {'chunk_index': index, 'text': chunk_text, 'text_hash': text_hash(chunk_text)}
+        for index, chunk_text in enumerate(chunks)
+    ]
@@ -9,16 +9,30 @@ from sentence_transformers import SentenceTransformer
 from qdrant_client import QdrantClient, models as qdrant_models
 from groq import Groq
 import httpx
+from .model_backends import TEXT_MODEL_BACKEND, embedding_model_key, load_text_model
 
 logger = logging.getLogger(__name__)
 
+TEXT_MODEL_NAME = getattr(settings, 'AI_TEXT_MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
+EMBEDDING_SERVER_URL = getattr(settings, 'AI_EMBEDDING_SERVER_URL', '')
+# Schlüssel für den Embedding-Cache (enthält das Backend, siehe model_backends.embedding_model_key)
+EMBEDDING_MODEL_KEY = embedding_model_key(TEXT_MODEL_NAME)
+
 _text_model = None
 image_model = None
 qdrant_client = None
 
-def get_text_model():
-    """Lädt das SentenceTransformer-Modell beim ersten Aufruf im Prozess und gibt es zurück."""
+def get_text_model(use_server: bool = True):
+    """Lädt das SentenceTransformer-Modell beim ersten Aufruf im Prozess und gibt es zurück.
+
+    Ist AI_EMBEDDING_SERVER_URL gesetzt, wird stattdessen ein Client für den Embedding-Server
+    zurückgegeben (gleiche encode()-Schnittstelle, kein Modell im Worker-Prozess).
+    """
     global _text_model
+    if _text_model is None and use_server and EMBEDDING_SERVER_URL:
+        from .embedding_client import RemoteTextModel
+        _text_model = RemoteTextModel(EMBEDDING_SERVER_URL)
+        logger.info(f"--- get_text_model: using embedding server at {EMBEDDING_SERVER_URL}. ---")
     if _text_model is None:
         logger.info("--- get_text_model: _text_model is None, attempting to load. ---")
         load_models_env = os.getenv('LOAD_AI_MODELS', 'false').lower() == 'true'
@@ -30,7 +44,7 @@ def get_text_model():
         try:
             logger.info("SentenceTransformer library imported successfully.")
 
-            model_name = 'sentence-transformers/all-MiniLM-L6-v2'
+            model_name = TEXT_MODEL_NAME
             logger.info(f"Attempting to instantiate SentenceTransformer with model: {model_name}...")
 
             cache_folder = os.getenv('SENTENCE_TRANSFORMERS_HOME')
@@ -42,12 +56,11 @@ def get_text_model():
 
                  if cache_folder:
                       logger.info(f"Using explicit cache folder: {cache_folder}")
-                      _text_model = SentenceTransformer(model_name, cache_folder=cache_folder)
                  else:
                       logger.warning("SENTENCE_TRANSFORMERS_HOME not set, relying on default cache.")
-                      _text_model = SentenceTransformer(model_name)
+                 _text_model = load_text_model(model_name, cache_folder=cache_folder)
 
-                 logger.info(f"SentenceTransformer model '{model_name}' instantiated successfully.")
+                 logger.info(f"SentenceTransformer model '{model_name}' instantiated successfully (backend: {TEXT_MODEL_BACKEND}).")
 
             except Exception as model_load_e:
                  logger.critical(f"!!! CRITICAL ERROR DURING SentenceTransformer INSTANTIATION: {model_load_e} !!!", exc_info=True)
@@ -108,6 +121,17 @@ def get_qdrant_client():
                     logger.error(f"Fehler beim Erstellen der Collection {email_collection_name}: {e_create_email}", exc_info=True)
                     raise
 
+            # Payload-Indizes für Chunk-Verwaltung (Filter nach email_id) und Suche (user_id/account_id)
+            for field_name in ('email_id', 'chunk_index', 'user_id', 'account_id'):
+                try:
+                    qdrant_client.create_payload_index(
+                        collection_name=email_collection_name,
+                        field_name=field_name,
+                        field_schema=qdrant_models.PayloadSchemaType.INTEGER,
+                    )
+                except Exception as e_index:
+                    logger.debug(f"Payload-Index '{field_name}' für {email_collection_name} nicht angelegt: {e_index}")
+
             attachment_collection_name = "attachment_embeddings"
             attachment_vector_size = new_vector_size
             try:
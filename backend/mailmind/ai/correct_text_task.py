@@ -1,6 +1,7 @@
 import logging
 # from .clients import get_gemini_model # Replaced with call_ai_api
 from .api_calls import call_ai_api
+from .response_cache import response_cache_options
 from ..prompt_templates.utils import get_prompt_details
 import json
 
@@ -78,7 +79,8 @@ async def correct_text_with_ai(text_to_correct: str, user,
         prompt=formatted_prompt,
         user=user,
         provider=prompt_details['provider'],
-        model_name=prompt_details['model_name']
+        model_name=prompt_details['model_name'],
+        cache_options=response_cache_options(prompt_details),
     )
 
     if not response_str:
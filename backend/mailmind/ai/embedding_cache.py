@@ -0,0 +1,93 @@
+"""
+Persistenter Embedding-Cache (EmbeddingCacheEntry).
+
+Schlüssel ist (Modellname, SHA-256 des normalisierten Eingabetexts); die Vektoren liegen als
+float16 in Postgres (384 Dimensionen = 768 Bytes). Reprocessing, Re-Indexing nach einem
+Qdrant-Wipe oder eine Collection-Migration kommen so ohne erneute Modell-Inferenz aus.
+"""
+import hashlib
+import logging
+import re
+import unicodedata
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+from django.conf import settings
+
+from .clients import EMBEDDING_MODEL_KEY
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = getattr(settings, 'AI_EMBEDDING_CACHE_ENABLED', True)
+EMBEDDING_CACHE_LOOKUP_CHUNK = 500 # Hashes pro IN-Query
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_embedding_text(text: str) -> str:
+    """Normalisiert Eingabetext für den Cache-Schlüssel (Unicode NFC, Whitespace zusammengefasst)."""
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+def embedding_text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_embedding_text(text).encode('utf-8')).hexdigest()
+
+
+def get_cached_embeddings(text_hashes: Iterable[str], model_name: str = EMBEDDING_MODEL_KEY) -> Dict[str, List[float]]:
+    from mailmind.core.models import EmbeddingCacheEntry
+
+    text_hashes = list(set(text_hashes))
+    cached = {}
+    for start in range(0, len(text_hashes), EMBEDDING_CACHE_LOOKUP_CHUNK):
+        entries = EmbeddingCacheEntry.objects.filter(
+            model_name=model_name,
+            text_hash__in=text_hashes[start:start + EMBEDDING_CACHE_LOOKUP_CHUNK],
+        ).values_list('text_hash', 'vector')
+        for text_hash, vector in entries:
+            cached[text_hash] = np.frombuffer(bytes(vector), dtype=np.float16).astype(np.float32).tolist()
+    return cached
+
+
+def store_embeddings(vectors_by_hash: Dict[str, List[float]], model_name: str = EMBEDDING_MODEL_KEY):
+    from mailmind.core.models import EmbeddingCacheEntry
+
+    entries = []
+    for text_hash, vector in vectors_by_hash.items():
+        vector_f16 = np.asarray(vector, dtype=np.float16)
+        entries.append(EmbeddingCacheEntry(
+            model_name=model_name,
+            text_hash=text_hash,
+            vector=vector_f16.tobytes(),
+            dimensions=vector_f16.shape[0],
+        ))
+    # Parallel geschriebene identische Einträge sind unkritisch
+    EmbeddingCacheEntry.objects.bulk_create(entries, batch_size=EMBEDDING_CACHE_LOOKUP_CHUNK, ignore_conflicts=True)
+
+
+def encode_with_cache(texts: List[str], encode_fn: Callable[[List[str]], list], model_name: str = EMBEDDING_MODEL_KEY) -> list:
+    """Gibt Vektoren für texts zurück; nur Cache-Misses werden über encode_fn (Liste von Texten -> Vektoren) kodiert."""
+    if not EMBEDDING_CACHE_ENABLED or not texts:
+        return encode_fn(texts)
+
+    hashes = [embedding_text_hash(text) for text in texts]
+    try:
+        cached = get_cached_embeddings(hashes, model_name)
+    except Exception as e:
+        logger.warning(f"Embedding-Cache nicht lesbar, kodiere ohne Cache: {e}")
+        return encode_fn(texts)
+
+    missing = {} # text_hash -> text, Duplikate nur einmal kodieren
+    for text_hash, text in zip(hashes, texts):
+        if text_hash not in cached and text_hash not in missing:
+            missing[text_hash] = text
+
+    if missing:
+        new_vectors = dict(zip(missing.keys(), encode_fn(list(missing.values()))))
+        try:
+            store_embeddings(new_vectors, model_name)
+        except Exception as e:
+            logger.warning(f"Embeddings konnten nicht im Cache gespeichert werden: {e}")
+        cached.update(new_vectors)
+
+    logger.debug(f"Embedding-Cache: {len(texts) - len(missing)} Treffer, {len(missing)} neu kodiert.")
+    return [cached[text_hash] for text_hash in hashes]
@@ -0,0 +1,119 @@
+"""
+Client für den Embedding-Server (siehe embedding_server.py / `manage.py run_embedding_server`).
+
+RemoteTextModel bietet die von uns genutzte Teilmenge der SentenceTransformer-Schnittstelle
+(encode, max_seq_length, tokenizer), so dass get_text_model()-Aufrufer unverändert bleiben.
+"""
+import http.client
+import json
+import logging
+import os
+import socket
+import threading
+from typing import List, Optional, Union
+from urllib.parse import urlparse
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SERVER_TIMEOUT = getattr(settings, 'AI_EMBEDDING_SERVER_TIMEOUT', 60)
+
+
+class EmbeddingServerError(RuntimeError):
+    pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP über einen Unix-Socket."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+class RemoteTextModel:
+    """Stellvertreter für das SentenceTransformer-Modell, der die Inferenz an den Embedding-Server delegiert."""
+
+    def __init__(self, server_url: str, timeout: float = EMBEDDING_SERVER_TIMEOUT):
+        self.server_url = server_url
+        self.timeout = timeout
+        parsed = urlparse(server_url)
+        self._socket_path = parsed.path if parsed.scheme == 'unix' else None
+        self._host = parsed.hostname or '127.0.0.1'
+        self._port = parsed.port or 8765
+        self._local = threading.local() # Keep-Alive-Verbindung pro Thread
+        self._info = None
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._socket_path:
+                connection = _UnixHTTPConnection(self._socket_path, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2): # Einmal neu verbinden, falls der Server die Keep-Alive-Verbindung geschlossen hat
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise EmbeddingServerError(f"Embedding-Server {self.server_url} nicht erreichbar: {e}") from e
+                continue
+            if response.status != 200:
+                raise EmbeddingServerError(f"Embedding-Server {method} {path}: HTTP {response.status} {data[:200]!r}")
+            return response, data
+
+    @property
+    def info(self) -> dict:
+        if self._info is None:
+            _, data = self._request('GET', '/info')
+            self._info = json.loads(data)
+        return self._info
+
+    @property
+    def max_seq_length(self) -> Optional[int]:
+        return self.info.get('max_seq_length')
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.info['dimensions']
+
+    @property
+    def tokenizer(self):
+        """Lokaler (leichtgewichtiger) Tokenizer für das Chunking; None, falls nicht ladbar."""
+        if not self._tokenizer_loaded:
+            self._tokenizer_loaded = True
+            try:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.info['model'], cache_dir=os.getenv('SENTENCE_TRANSFORMERS_HOME'))
+            except Exception as e:
+                logger.warning(f"Tokenizer für '{self.info.get('model')}' nicht ladbar, Chunking nutzt Wort-Fenster: {e}")
+        return self._tokenizer
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """Wie SentenceTransformer.encode (numpy-Ausgabe); die Batch-Bildung übernimmt der Server."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        response, data = self._request('POST', '/embed', json.dumps({'texts': texts}).encode('utf-8'))
+        dimensions = int(response.getheader('X-Embedding-Dimensions'))
+        vectors = np.frombuffer(data, dtype=np.float32).reshape(len(texts), dimensions)
+        return vectors[0] if single else vectors
@@ -0,0 +1,186 @@
+"""
+Lokaler Embedding-Server: lädt das Text-Modell einmal und bedient alle Worker.
+
+Gleichzeitige Anfragen werden zu dynamischen Batches zusammengefasst: der Batcher wartet nach
+der ersten Anfrage höchstens max_latency_ms auf weitere, bis max_batch_size Texte erreicht sind.
+
+Protokoll (HTTP/1.1 über localhost-TCP oder Unix-Socket):
+    GET  /info   -> {"model", "dimensions", "max_seq_length"}
+    POST /embed  {"texts": [...]} -> float32-Matrix (row-major), Header X-Embedding-Dimensions
+"""
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+
+class _EmbedRequest:
+    __slots__ = ('texts', 'done', 'vectors', 'error')
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.vectors = None
+        self.error = None
+
+
+class DynamicBatcher:
+    """Sammelt Anfragen mehrerer Threads und kodiert sie gemeinsam in einem Inferenz-Thread."""
+
+    def __init__(self, model, max_batch_size: int = 64, max_latency_ms: float = 10.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        request = _EmbedRequest(texts)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.vectors
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+
+    def _collect_batch(self, first: _EmbedRequest) -> List[_EmbedRequest]:
+        batch = [first]
+        text_count = len(first.texts)
+        deadline = time.monotonic() + self.max_latency
+        while text_count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._stopped.set()
+                break
+            batch.append(request)
+            text_count += len(request.texts)
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect_batch(first)
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = np.asarray(
+                    self.model.encode(texts, batch_size=self.max_batch_size, convert_to_numpy=True),
+                    dtype=np.float32,
+                )
+                offset = 0
+                for request in batch:
+                    request.vectors = vectors[offset:offset + len(request.texts)]
+                    offset += len(request.texts)
+            except Exception as e:
+                logger.error(f"Embedding-Batch mit {len(texts)} Texten fehlgeschlagen: {e}", exc_info=True)
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+            logger.debug(f"Embedding-Batch: {len(batch)} Anfragen, {len(texts)} Texte.")
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-Alive für die RemoteTextModel-Clients
+
+    def address_string(self):
+        # Unix-Sockets haben keine (host, port)-Adresse
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json', headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict):
+        self._send(status, json.dumps(data).encode('utf-8'))
+
+    def do_GET(self):
+        if self.path == '/info':
+            self._send_json(200, self.server.model_info)
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/embed':
+            self._send_json(404, {'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_REQUEST_BYTES:
+            self.close_connection = True # Body wurde nicht gelesen
+            self._send_json(413 if length else 400, {'error': 'invalid request size'})
+            return
+        try:
+            texts = json.loads(self.rfile.read(length))['texts']
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("'texts' must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        if not texts:
+            # encode([]) liefert ein 1-D-Array ohne Dimensionsachse: leere Antwort direkt senden
+            self._send(200, b'', content_type='application/octet-stream',
+                       headers={'X-Embedding-Dimensions': str(self.server.model_info['dimensions'])})
+            return
+        try:
+            vectors = self.server.batcher.encode(texts)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send(200, vectors.tobytes(), content_type='application/octet-stream',
+                   headers={'X-Embedding-Dimensions': str(vectors.shape[1])})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_embedding_server(model, model_name: str, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None,
+                            max_batch_size: int = 64, max_latency_ms: float = 10.0):
+    """Erstellt den HTTP-Server (TCP auf host:port oder Unix-Socket) samt DynamicBatcher; serve_forever() startet ihn."""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, EmbeddingRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), EmbeddingRequestHandler)
+        server.daemon_threads = True
+    server.batcher = DynamicBatcher(model, max_batch_size=max_batch_size, max_latency_ms=max_latency_ms)
+    server.model_info = {
+        'model': model_name,
+        'dimensions': model.get_sentence_embedding_dimension(),
+        'max_seq_length': getattr(model, 'max_seq_length', None),
+    }
+    return server
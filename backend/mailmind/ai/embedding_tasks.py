@@ -1,69 +1,160 @@
 import logging
 import time
+import uuid
+from typing import Dict, List, Tuple
+from django.conf import settings
 from PIL import Image
 import pytesseract
+from qdrant_client.http import models as rest_models
 from qdrant_client.http.models import PointStruct
-from .clients import get_text_model, get_qdrant_client
+from .chunking import chunk_email_text
+from .embedding_cache import encode_with_cache
+from .clients import EMBEDDING_MODEL_KEY, get_text_model, get_qdrant_client
 
 logger = logging.getLogger(__name__)
 
-def generate_email_embedding(email):
-    """Generiert Text-Embedding für eine E-Mail und speichert es in Qdrant."""
-    from mailmind.core.models import Email
-    # Ensure type hint is still useful if possible, or remove if it causes issues
-    # email: Email
+EMBEDDING_ENCODE_BATCH_SIZE = getattr(settings, 'AI_EMBEDDING_ENCODE_BATCH_SIZE', 32) # Texte pro model.encode-Aufruf
+EMBEDDING_TASK_BATCH_SIZE = getattr(settings, 'AI_EMBEDDING_TASK_BATCH_SIZE', 256) # E-Mails pro Batch-Task
 
-    try:
-        model = get_text_model()
-        client = get_qdrant_client()
+EMAIL_COLLECTION_NAME = "email_embeddings"
+# Namespace für deterministische Punkt-IDs der E-Mail-Chunks (Qdrant erlaubt nur int/UUID)
+EMAIL_CHUNK_NAMESPACE = uuid.UUID('6f1c2b7e-3d0a-4d8e-9a51-0c2e5d7b8f43')
 
-        text_content = f"Betreff: {email.subject}\nAbsender: {email.from_address}\n\n{email.body_text}"
-        embedding = model.encode(text_content)
+def email_chunk_point_id(email_id: int, chunk_index: int) -> str:
+    return str(uuid.uuid5(EMAIL_CHUNK_NAMESPACE, f"email:{email_id}:chunk:{chunk_index}"))
 
-        to_addresses = list(email.to_contacts.values_list('email', flat=True))
-        cc_addresses = list(email.cc_contacts.values_list('email', flat=True))
-        bcc_addresses = list(email.bcc_contacts.values_list('email', flat=True))
-        attachment_filenames = list(email.attachments.values_list('filename', flat=True))
-        attachment_ids = list(email.attachments.values_list('id', flat=True))
+def _email_embedding_payload(email) -> dict:
+    """Qdrant-Payload einer E-Mail; nutzt vorab geladene Relationen (prefetch_related), falls vorhanden."""
+    attachments = list(email.attachments.all())
+    return {
+        'email_id': email.id,
+        'subject': email.subject or "",
+        'from_address': email.from_address or "",
+        'to_addresses': [contact.email for contact in email.to_contacts.all()],
+        'cc_addresses': [contact.email for contact in email.cc_contacts.all()],
+        'bcc_addresses': [contact.email for contact in email.bcc_contacts.all()],
+        'received_at': email.received_at.isoformat() if email.received_at else None,
+        'sent_at': email.sent_at.isoformat() if email.sent_at else None,
+        'body_snippet': (email.body_text or "")[:250], # Gekürzt
+        'has_attachments': bool(attachments),
+        'attachment_filenames': [attachment.filename for attachment in attachments],
+        'attachment_ids': [attachment.id for attachment in attachments],
+        'account_id': email.account_id,
+        'user_id': email.account.user_id,
+        'is_read': email.is_read,
+        'is_flagged': email.is_flagged,
+        'is_replied': email.is_replied,
+        'is_deleted': email.is_deleted_on_server,
+        'is_draft': email.is_draft,
+        'folder_name': email.folder_name or "",
+    }
 
-        payload = {
-            'email_id': email.id,
-            'subject': email.subject or "",
-            'from_address': email.from_address or "",
-            'to_addresses': to_addresses,
-            'cc_addresses': cc_addresses,
-            'bcc_addresses': bcc_addresses,
-            'received_at': email.received_at.isoformat() if email.received_at else None,
-            'sent_at': email.sent_at.isoformat() if email.sent_at else None,
-            'body_snippet': (email.body_text or "")[:250], # Gekürzt
-            'has_attachments': email.attachments.exists(),
-            'attachment_filenames': attachment_filenames,
-            'attachment_ids': attachment_ids,
-            'account_id': email.account_id,
-            'user_id': email.account.user_id,
-            'is_read': email.is_read,
-            'is_flagged': email.is_flagged,
-            'is_replied': email.is_replied,
-            'is_deleted': email.is_deleted_on_server,
-            'is_draft': email.is_draft,
-            'folder_name': email.folder_name or "",
-        }
+def generate_email_embedding(email):
+    """Generiert die Chunk-Embeddings für eine E-Mail und speichert sie in Qdrant."""
+    try:
+        encoded_count = index_email_chunks([email])
+        logger.info(f"Text-Embeddings für Email ID {email.id} in Qdrant gespeichert ({encoded_count} Chunks neu kodiert).")
+    except Exception as e:
+        logger.error(f"Fehler beim Generieren/Speichern des E-Mail-Embeddings für ID {email.id}: {e}", exc_info=True)
 
-        point = PointStruct(
-            id=email.id,
-            vector=embedding.tolist(),
-            payload=payload
-        )
+def encode_texts_batched(model, texts: List[str], batch_size: int = EMBEDDING_ENCODE_BATCH_SIZE) -> list:
+    """Kodiert Texte in nach Länge sortierten Mini-Batches (wenig Padding) und gibt die Vektoren in Eingabereihenfolge zurück."""
+    order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+    vectors = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        batch_indices = order[start:start + batch_size]
+        batch_vectors = model.encode([texts[index] for index in batch_indices], batch_size=len(batch_indices))
+        for index, vector in zip(batch_indices, batch_vectors):
+            vectors[index] = vector.tolist()
+    return vectors
 
-        client.upsert(
-            collection_name="email_embeddings",
-            points=[point],
-            wait=True
+def _existing_chunk_vectors(client, email_ids: List[int]) -> Dict[Tuple[int, int], Tuple[str, list]]:
+    """Lädt (chunk_hash, vector) der bereits gespeicherten Chunks, um unveränderte Chunks nicht neu zu kodieren.
+
+    Nur Vektoren des aktuellen Modells/Backends (payload 'model_key' == EMBEDDING_MODEL_KEY) werden
+    zurückgegeben; ältere Punkte ohne model_key gelten als veraltet und werden neu kodiert.
+    """
+    existing = {}
+    scroll_filter = rest_models.Filter(must=[
+        rest_models.FieldCondition(key='email_id', match=rest_models.MatchAny(any=list(email_ids))),
+    ])
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=EMAIL_COLLECTION_NAME,
+            scroll_filter=scroll_filter,
+            with_payload=['email_id', 'chunk_index', 'chunk_hash', 'model_key'],
+            with_vectors=True,
+            limit=256,
+            offset=offset,
         )
-        logger.info(f"Text-Embedding für Email ID {email.id} in Qdrant gespeichert.")
+        for record in records:
+            payload = record.payload or {}
+            if payload.get('model_key') != EMBEDDING_MODEL_KEY:
+                continue
+            if payload.get('chunk_hash') is not None and payload.get('chunk_index') is not None:
+                existing[(payload['email_id'], payload['chunk_index'])] = (payload['chunk_hash'], record.vector)
+        if offset is None:
+            break
+    return existing
 
-    except Exception as e:
-        logger.error(f"Fehler beim Generieren/Speichern des E-Mail-Embeddings für ID {email.id}: {e}", exc_info=True)
+def index_email_chunks(emails) -> int:
+    """Zerlegt die E-Mails in Chunks, kodiert nur neue/geänderte Chunks und schreibt einen Punkt pro Chunk.
+
+    Jeder Punkt trägt die E-Mail-Payload plus 'chunk_index', 'chunk_count', 'chunk_hash' und 'model_key'; überzählige
+    Chunks (E-Mail kürzer geworden) und alte Ein-Punkt-Einträge (id = email.id) werden entfernt.
+    Gibt die Anzahl der neu kodierten Chunks zurück.
+    """
+    emails = list(emails)
+    if not emails:
+        return 0
+    model = get_text_model()
+    client = get_qdrant_client()
+
+    chunks_by_email = [(email, chunk_email_text(email.subject, email.from_address, email.body_text, model=model)) for email in emails]
+    existing = _existing_chunk_vectors(client, [email.id for email in emails])
+
+    to_encode = []
+    for email, chunks in chunks_by_email:
+        for chunk in chunks:
+            cached = existing.get((email.id, chunk['chunk_index']))
+            if cached and cached[0] == chunk['text_hash'] and cached[1]:
+                chunk['vector'] = cached[1]
+            else:
+                to_encode.append(chunk)
+    if to_encode:
+        vectors = encode_with_cache([chunk['text'] for chunk in to_encode], lambda texts: encode_texts_batched(model, texts))
+        for chunk, vector in zip(to_encode, vectors):
+            chunk['vector'] = vector
+
+    points = []
+    for email, chunks in chunks_by_email:
+        base_payload = _email_embedding_payload(email)
+        for chunk in chunks:
+            payload = dict(base_payload)
+            payload.update({
+                'chunk_index': chunk['chunk_index'],
+                'chunk_count': len(chunks),
+                'chunk_hash': chunk['text_hash'],
+                'model_key': EMBEDDING_MODEL_KEY, # Wiederverwendung nur mit demselben Modell/Backend
+                'chunk_snippet': chunk['text'][:250],
+            })
+            points.append(PointStruct(id=email_chunk_point_id(email.id, chunk['chunk_index']), vector=chunk['vector'], payload=payload))
+    client.upsert(collection_name=EMAIL_COLLECTION_NAME, points=points, wait=True)
+
+    # Veraltete Chunks und Ein-Punkt-Einträge aus der Zeit vor dem Chunking entfernen
+    stale_filter = rest_models.Filter(should=[
+        rest_models.Filter(must=[
+            rest_models.FieldCondition(key='email_id', match=rest_models.MatchValue(value=email.id)),
+            rest_models.FieldCondition(key='chunk_index', range=rest_models.Range(gte=len(chunks))),
+        ])
+        for email, chunks in chunks_by_email
+    ])
+    client.delete(collection_name=EMAIL_COLLECTION_NAME, points_selector=rest_models.FilterSelector(filter=stale_filter), wait=True)
+    client.delete(collection_name=EMAIL_COLLECTION_NAME, points_selector=rest_models.PointIdsList(points=[email.id for email in emails]), wait=True)
+
+    logger.debug(f"{len(points)} Chunks für {len(emails)} E-Mails gespeichert, {len(to_encode)} davon neu kodiert.")
+    return len(to_encode)
 
 def generate_attachment_embedding(attachment):
     """Generiert Embedding für einen Anhang (OCR für Bilder) und speichert es in Qdrant."""
@@ -77,8 +168,14 @@ def generate_attachment_embedding(attachment):
         extracted_text = ""
         embedding = None
         is_image = attachment.content_type.startswith('image/')
+        # Inhalt (gleicher SHA-256) bereits analysiert: keine OCR; der Vektor nur, wenn er vom aktuellen Modell stammt
+        cached_analysis = attachment.blob.get_cached_analysis(EMBEDDING_MODEL_KEY) if attachment.blob_id else None
+        embedding_list = None
 
-        if is_image:
+        if cached_analysis:
+            extracted_text, embedding_list = cached_analysis
+            logger.info(f"Anhang {attachment.id} ({attachment.filename}): verwende gespeicherte Analyse von Blob {attachment.blob_id}{'' if embedding_list else ' (Embedding wird neu berechnet)'}.")
+        elif is_image:
             try:
                 if not attachment.file or not attachment.file.path:
                      logger.warning(f"Anhang-Datei für ID {attachment.id} nicht gefunden.")
@@ -102,10 +199,12 @@ def generate_attachment_embedding(attachment):
         else:
             extracted_text = attachment.extracted_text or f"Dateiname: {attachment.filename}"
 
-        if extracted_text:
-            embedding = text_model.encode(extracted_text)
-            embedding_list = embedding.tolist()
-        else:
+        if embedding_list is None and extracted_text:
+            embedding_list = encode_with_cache([extracted_text], lambda texts: encode_texts_batched(text_model, texts))[0]
+            # Nur inhaltsbasierten Text merken (nicht den Dateinamen-Fallback)
+            if attachment.blob_id and (cached_analysis or is_image or attachment.extracted_text):
+                attachment.blob.save_analysis(extracted_text, embedding_list, EMBEDDING_MODEL_KEY)
+        elif embedding_list is None:
             logger.warning(f"Kein Text für Embedding für Anhang {attachment.id} vorhanden.")
             return
 
@@ -148,7 +247,7 @@ def generate_embeddings_for_email(email_id: int):
     start_time = time.time()
     email = None # Initialize email
     try:
-        email = Email.objects.prefetch_related('attachments').select_related('account').get(id=email_id)
+        email = Email.objects.prefetch_related('to_contacts', 'cc_contacts', 'bcc_contacts', 'attachments').select_related('account').get(id=email_id)
         logger.info(f"Starte Embedding-Generierung für Email ID {email_id} (Betreff: {email.subject[:50]}...)")
 
         logger.info(f"[Schritt 1/2] Generiere E-Mail-Embedding für ID {email_id}")
@@ -167,4 +266,40 @@ def generate_embeddings_for_email(email_id: int):
     except Exception as e:
         logger.error(f"Unerwarteter Fehler in generate_embeddings_for_email für ID {email_id}: {e}", exc_info=True)
     finally:
-        logger.info(f"--- END: generate_embeddings_for_email for Email ID {email_id} ---") 
\ No newline at end of file
+        logger.info(f"--- END: generate_embeddings_for_email for Email ID {email_id} ---") 
+
+def generate_embeddings_for_emails(email_ids: List[int]) -> int:
+    """
+    Batch-Variante von generate_embeddings_for_email: lädt die E-Mails mit Prefetching,
+    kodiert ihre Chunks in längensortierten Mini-Batches und schreibt alle Punkte mit einem Upsert nach Qdrant.
+    """
+    from mailmind.core.models import Email
+
+    start_time = time.time()
+    emails = list(
+        Email.objects.filter(id__in=email_ids)
+        .select_related('account')
+        .prefetch_related('to_contacts', 'cc_contacts', 'bcc_contacts', 'attachments')
+    )
+    if not emails:
+        logger.warning(f"Keine E-Mails für Batch-Embedding gefunden ({len(email_ids)} IDs angefragt).")
+        return 0
+
+    try:
+        encoded_count = index_email_chunks(emails)
+    except Exception as e:
+        logger.error(f"Fehler beim Batch-Embedding für {len(emails)} E-Mails: {e}", exc_info=True)
+        return 0
+
+    attachments_processed = 0
+    for email in emails:
+        for attachment in email.attachments.all():
+            attachment.email = email # Vermeidet erneutes Laden von email/account
+            generate_attachment_embedding(attachment)
+            attachments_processed += 1
+
+    logger.info(
+        f"Batch-Embedding: {len(emails)} E-Mails ({encoded_count} Chunks neu kodiert) und {attachments_processed} Anhänge "
+        f"in {time.time() - start_time:.2f}s verarbeitet."
+    )
+    return len(emails)
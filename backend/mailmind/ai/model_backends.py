@@ -0,0 +1,94 @@
+"""
+Inferenz-Backends für das Text-Embedding-Modell.
+
+- 'torch': SentenceTransformer in voller Präzision (bisheriges Verhalten)
+- 'onnx':  ONNX Runtime mit int8-dynamisch quantisiertem Modell (CPU), erzeugt mit
+           `manage.py export_onnx_model`
+
+Beide liefern ein SentenceTransformer-Objekt, so dass encode()/tokenizer/max_seq_length gleich bleiben.
+"""
+import logging
+import os
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TEXT_MODEL_BACKEND = getattr(settings, 'AI_TEXT_MODEL_BACKEND', os.getenv('AI_TEXT_MODEL_BACKEND', 'torch'))
+ONNX_QUANTIZATION = getattr(settings, 'AI_ONNX_QUANTIZATION', 'avx512_vnni') # arm64 | avx2 | avx512 | avx512_vnni
+ONNX_MODEL_DIR = getattr(settings, 'AI_ONNX_MODEL_DIR', None) # Default: <SENTENCE_TRANSFORMERS_HOME>/onnx/<modell>
+INFERENCE_THREADS = getattr(settings, 'AI_INFERENCE_THREADS', None) # None = Default der Runtime
+
+
+def onnx_model_dir(model_name: str) -> str:
+    if ONNX_MODEL_DIR:
+        return ONNX_MODEL_DIR
+    cache_root = os.getenv('SENTENCE_TRANSFORMERS_HOME') or os.path.join(os.path.expanduser('~'), '.cache', 'sentence_transformers')
+    return os.path.join(cache_root, 'onnx', model_name.replace('/', '_'))
+
+
+def onnx_model_file(quantization: str = ONNX_QUANTIZATION) -> str:
+    # Dateiname, den export_dynamic_quantized_onnx_model erzeugt
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+def embedding_model_key(model_name: str, backend: str = TEXT_MODEL_BACKEND) -> str:
+    """Schlüssel für den Embedding-Cache: quantisierte Vektoren dürfen nicht mit float32-Vektoren gemischt werden."""
+    if backend == 'onnx':
+        return f"{model_name}@onnx-qint8-{ONNX_QUANTIZATION}"
+    return model_name
+
+
+def _onnx_session_options(threads: Optional[int]):
+    import onnxruntime
+
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return session_options
+
+
+def load_text_model(model_name: str, cache_folder: Optional[str] = None, backend: str = TEXT_MODEL_BACKEND,
+                    threads: Optional[int] = INFERENCE_THREADS):
+    """Lädt das Embedding-Modell mit dem gewählten Backend."""
+    from sentence_transformers import SentenceTransformer
+
+    if backend == 'onnx':
+        model_dir = onnx_model_dir(model_name)
+        model_file = onnx_model_file()
+        if not os.path.exists(os.path.join(model_dir, model_file)):
+            raise RuntimeError(f"Quantisiertes ONNX-Modell fehlt ({model_dir}/{model_file}); bitte `manage.py export_onnx_model` ausführen.")
+        logger.info(f"Loading ONNX text model from {model_dir}/{model_file} (threads: {threads or 'default'})")
+        return SentenceTransformer(
+            model_dir,
+            backend='onnx',
+            model_kwargs={
+                'file_name': model_file,
+                'provider': 'CPUExecutionProvider',
+                'session_options': _onnx_session_options(threads),
+            },
+        )
+
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    if cache_folder:
+        return SentenceTransformer(model_name, cache_folder=cache_folder)
+    return SentenceTransformer(model_name)
+
+
+def export_quantized_onnx_model(model_name: str, output_dir: Optional[str] = None, quantization: str = ONNX_QUANTIZATION) -> str:
+    """Exportiert das Modell nach ONNX und legt daneben eine int8-dynamisch quantisierte Variante ab."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    output_dir = output_dir or onnx_model_dir(model_name)
+    cache_folder = os.getenv('SENTENCE_TRANSFORMERS_HOME')
+    # backend='onnx' exportiert onnx/model.onnx beim Laden, falls das Hub-Repo keins enthält
+    model = SentenceTransformer(model_name, backend='onnx', cache_folder=cache_folder)
+    model.save(output_dir)
+    export_dynamic_quantized_onnx_model(model, quantization, output_dir)
+    logger.info(f"Exported quantized ONNX model '{model_name}' ({quantization}) to {output_dir}")
+    return os.path.join(output_dir, onnx_model_file(quantization))
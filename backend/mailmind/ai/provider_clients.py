@@ -0,0 +1,256 @@
+"""
+Wiederverwendete Clients der LLM-Provider (Groq, Google Gemini).
+
+Bisher wurde pro Aufruf ein neuer Groq-Client erzeugt bzw. genai.configure() (global, nicht
+threadsicher zwischen Usern) aufgerufen - jeder Request kostete TCP-/TLS-Handshake. Die Registry
+hält pro (Provider, Key-Fingerprint) einen Client mit Keep-Alive-Verbindungen:
+
+- Groq:   AsyncGroq / Groq mit httpx-Client (HTTP/2, Connection-Pool)
+- Gemini: GenerativeService(Async)Client pro API-Key (gRPC, HTTP/2); kein genai.configure()
+
+Async-Clients sind an ihren Event-Loop gebunden (httpx/grpc.aio); sie werden daher pro Loop
+gehalten. Clients, die länger als AI_CLIENT_IDLE_TIMEOUT ungenutzt sind, werden beim nächsten
+Zugriff geschlossen und entfernt.
+
+async_to_sync erzeugt pro Aufruf einen neuen Loop, dort könnte nichts wiederverwendet werden.
+Sync-Aufrufer (Django-Q-Tasks) nutzen daher run_on_client_loop(): ein persistenter Loop pro
+Prozess in einem Daemon-Thread. Wo async_to_sync nötig bleibt (Views, die im Thread des
+ASGI-Handlers laufen), schließt closing_async_to_sync() die Clients des kurzlebigen Loops am Ende.
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLIENT_IDLE_TIMEOUT = getattr(settings, 'AI_CLIENT_IDLE_TIMEOUT', 300) # Sekunden
+CLIENT_MAX_CONNECTIONS = getattr(settings, 'AI_CLIENT_MAX_CONNECTIONS', 20) # pro Client
+CLIENT_TIMEOUT = getattr(settings, 'AI_CLIENT_TIMEOUT', 60.0)
+CLIENT_MAX_ENTRIES = getattr(settings, 'AI_CLIENT_MAX_ENTRIES', 64)
+
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Kurzer Hash des API-Keys, damit der Key selbst nicht als Dict-Schlüssel/in Logs auftaucht."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def _httpx_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=CLIENT_MAX_CONNECTIONS,
+        max_keepalive_connections=CLIENT_MAX_CONNECTIONS,
+        keepalive_expiry=CLIENT_IDLE_TIMEOUT,
+    )
+
+
+def _create_groq_client(api_key: str, is_async: bool):
+    from groq import AsyncGroq, Groq
+
+    if is_async:
+        http_client = httpx.AsyncClient(http2=True, limits=_httpx_limits(), timeout=CLIENT_TIMEOUT, trust_env=False)
+        return AsyncGroq(api_key=api_key, http_client=http_client)
+    http_client = httpx.Client(http2=True, limits=_httpx_limits(), timeout=CLIENT_TIMEOUT, trust_env=False)
+    return Groq(api_key=api_key, http_client=http_client)
+
+
+def _create_gemini_client(api_key: str, is_async: bool):
+    from google.ai import generativelanguage as glm
+    from google.api_core import client_options as client_options_lib
+
+    options = client_options_lib.ClientOptions(api_key=api_key)
+    if is_async:
+        return glm.GenerativeServiceAsyncClient(client_options=options)
+    return glm.GenerativeServiceClient(client_options=options)
+
+
+_CLIENT_FACTORIES = {
+    'groq': _create_groq_client,
+    'google_gemini': _create_gemini_client,
+}
+
+
+async def _close_client_async(provider: str, client):
+    if provider == 'groq':
+        await client.close()
+    else:
+        await client.transport.close()
+
+
+def _close_client_sync(provider: str, client):
+    if provider == 'groq':
+        client.close()
+    else:
+        client.transport.close()
+
+
+class _PooledClient:
+    __slots__ = ('client', 'loop', 'last_used')
+
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+        self.last_used = time.monotonic()
+
+
+class ProviderClientRegistry:
+    """Prozessweite Registry der Provider-Clients, Schlüssel (provider, key_fingerprint, loop_id)."""
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, Optional[int]], _PooledClient] = {}
+        self._lock = threading.Lock()
+
+    def _pop_expired(self, loop=None):
+        """Entfernt abgelaufene Einträge; liefert [(provider, entry)], die der Aufrufer schließen muss."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, entry in list(self._clients.items()):
+                loop_closed = entry.loop is not None and entry.loop.is_closed()
+                idle = now - entry.last_used > CLIENT_IDLE_TIMEOUT
+                # Async-Clients eines anderen, noch laufenden Loops können nur dort geschlossen werden
+                if loop_closed:
+                    # Sollte mit run_on_client_loop/closing_async_to_sync nicht mehr vorkommen
+                    logger.warning(f"Dropping pooled {key[0]} client of a closed event loop without closing it.")
+                if loop_closed or (idle and entry.loop is loop):
+                    expired.append((key[0], self._clients.pop(key), loop_closed))
+            if len(self._clients) > CLIENT_MAX_ENTRIES:
+                oldest = sorted(
+                    (item for item in self._clients.items() if item[1].loop is loop),
+                    key=lambda item: item[1].last_used,
+                )
+                for key, entry in oldest[:len(self._clients) - CLIENT_MAX_ENTRIES]:
+                    expired.append((key[0], self._clients.pop(key), False))
+        return expired
+
+    def _get_or_create(self, provider: str, api_key: str, loop) -> Any:
+        if provider not in _CLIENT_FACTORIES:
+            raise ValueError(f"No pooled client available for provider '{provider}'.")
+        key = (provider, key_fingerprint(api_key), id(loop) if loop is not None else None)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None and entry.loop is loop:
+                entry.last_used = time.monotonic()
+                return entry.client
+            client = _CLIENT_FACTORIES[provider](api_key, is_async=loop is not None)
+            self._clients[key] = _PooledClient(client, loop)
+        logger.debug(f"Created pooled {provider} client ({'async' if loop else 'sync'}, key {key[1]}); {len(self._clients)} pooled.")
+        return client
+
+    def get_sync(self, provider: str, api_key: str):
+        """Synchroner Client (threadsicher, für Django-Q-Worker und call_ai_api_sync)."""
+        for expired_provider, entry, _ in self._pop_expired(loop=None):
+            try:
+                _close_client_sync(expired_provider, entry.client)
+            except Exception as e:
+                logger.debug(f"Closing idle {expired_provider} client failed: {e}")
+        return self._get_or_create(provider, api_key, loop=None)
+
+    async def get_async(self, provider: str, api_key: str):
+        """Async-Client für den laufenden Event-Loop."""
+        loop = asyncio.get_running_loop()
+        for expired_provider, entry, loop_closed in self._pop_expired(loop=loop):
+            if loop_closed:
+                continue # Verbindungen des geschlossenen Loops werden mit dem Objekt freigegeben
+            try:
+                await _close_client_async(expired_provider, entry.client)
+            except Exception as e:
+                logger.debug(f"Closing idle {expired_provider} client failed: {e}")
+        return self._get_or_create(provider, api_key, loop=loop)
+
+    async def aclose_loop(self, loop=None):
+        """Schließt alle Clients des (laufenden) Loops, bevor dieser beendet wird."""
+        loop = loop or asyncio.get_running_loop()
+        with self._lock:
+            entries = [(key[0], self._clients.pop(key)) for key, entry in list(self._clients.items()) if entry.loop is loop]
+        for provider, entry in entries:
+            try:
+                await _close_client_async(provider, entry.client)
+            except Exception as e:
+                logger.debug(f"Closing {provider} client failed: {e}")
+
+    def invalidate(self, provider: str, api_key: str):
+        """Entfernt alle Clients zu einem Key (z.B. nach Key-Wechsel); sie werden nicht mehr ausgegeben."""
+        fingerprint = key_fingerprint(api_key)
+        with self._lock:
+            for key in [key for key in self._clients if key[0] == provider and key[1] == fingerprint]:
+                del self._clients[key]
+
+
+registry = ProviderClientRegistry()
+
+
+class _ClientLoop:
+    """Ein Event-Loop pro Prozess (Daemon-Thread), auf dem die gepoolten Async-Clients leben."""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        # Django-Q forkt Worker: Loop und Thread gehören zum jeweiligen Prozess
+        if self._loop is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='ai-client-loop', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+        return self._loop
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+
+client_loop = _ClientLoop()
+
+
+def run_on_client_loop(async_fn, *args, **kwargs):
+    """Führt eine AI-Coroutine aus Sync-Code (Django-Q-Task) auf dem persistenten Loop aus und wartet.
+
+    Nicht aus Code verwenden, der selbst in einem thread_sensitive sync_to_async-Kontext läuft (Views
+    unter ASGI): die Coroutine bräuchte denselben Thread für ORM-Zugriffe -> closing_async_to_sync().
+    """
+    return client_loop.run(async_fn(*args, **kwargs))
+
+
+def closing_async_to_sync(async_fn):
+    """Wie async_to_sync, schließt aber die auf dem kurzlebigen Loop erzeugten Provider-Clients."""
+    from asgiref.sync import async_to_sync
+
+    @functools.wraps(async_fn)
+    async def _run_and_close(*args, **kwargs):
+        try:
+            return await async_fn(*args, **kwargs)
+        finally:
+            await registry.aclose_loop()
+
+    return async_to_sync(_run_and_close)
+
+
+def get_gemini_model(model_name: str, service_client, is_async: bool):
+    """GenerativeModel, das den gepoolten Service-Client statt des globalen genai.configure()-Clients nutzt."""
+    import google.generativeai as genai
+
+    model = genai.GenerativeModel(model_name, safety_settings=GEMINI_SAFETY_SETTINGS)
+    if is_async:
+        model._async_client = service_client
+    else:
+        model._client = service_client
+    return model
@@ -0,0 +1,325 @@
+"""
+Verteilter Rate-Limiter und Concurrency-Governor für LLM-Aufrufe (Redis).
+
+Mit cpu_count*2+1 Django-Q-Workern (und ASGI-Prozessen) liefen Massenläufe wie
+queue_ai_suggestions ungebremst in die 429-Limits von Groq/Gemini. Jeder Aufruf von
+call_ai_api(_sync) holt sich deshalb vorher eine Freigabe:
+
+1. Concurrency-Slot pro (Provider, Key-Fingerprint): Sorted Set mit Lease-IDs, deren Score das
+   Ablaufdatum ist (abgestürzte Worker blockieren nicht dauerhaft).
+2. Token-Bucket pro (Provider, Key-Fingerprint, Modell) für Requests/min und Tokens/min in einem
+   Redis-Hash, atomar per Lua. Die Token-Kosten werden vorab geschätzt (Prompt-Länge/4 +
+   AI_RATE_LIMIT_COMPLETION_TOKENS) und nach der Antwort mit der tatsächlichen Usage verrechnet.
+
+Antworten des Providers fließen zurück: Groqs x-ratelimit-remaining-tokens begrenzt den
+Token-Bucket, x-ratelimit-remaining-requests == 0 (Tageslimit) bzw. ein 429 mit retry-after
+sperren den Bucket bis zum Reset. Gemini (gRPC) liefert keine Header; bei ResourceExhausted wird
+die retry_delay aus der Fehlermeldung bzw. AI_RATE_LIMIT_BACKOFF verwendet.
+
+Aufrufer warten höchstens bis zur Deadline (Standard AI_RATE_LIMIT_DEADLINE Sekunden) und
+bekommen danach RateLimitExceeded mit retry_after statt den Provider weiter anzufragen.
+
+Limits: AI_RATE_LIMITS = {'groq': {...}, 'groq:llama3-70b-8192': {...}} mit den Schlüsseln
+rpm, tpm und concurrency (0 = unbegrenzt); Modell-Einträge ergänzen den Provider-Eintrag.
+"""
+import asyncio
+import logging
+import random
+import re
+import time
+import uuid
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .provider_clients import key_fingerprint
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = getattr(settings, 'AI_RATE_LIMIT_ENABLED', True)
+RATE_LIMIT_REDIS_URL = getattr(settings, 'AI_RATE_LIMIT_REDIS_URL', 'redis://redis:6379/3')
+RATE_LIMIT_DEADLINE = getattr(settings, 'AI_RATE_LIMIT_DEADLINE', 60) # Sekunden Wartezeit pro Aufruf
+RATE_LIMIT_TASK_DEADLINE = getattr(settings, 'AI_RATE_LIMIT_TASK_DEADLINE', 300) # für Django-Q-Tasks
+RATE_LIMIT_COMPLETION_TOKENS = getattr(settings, 'AI_RATE_LIMIT_COMPLETION_TOKENS', 1000) # geschätzte Antwortlänge
+RATE_LIMIT_BACKOFF = getattr(settings, 'AI_RATE_LIMIT_BACKOFF', 30) # Sperre nach 429 ohne retry-after (s)
+RATE_LIMIT_LEASE_TIMEOUT = getattr(settings, 'AI_RATE_LIMIT_LEASE_TIMEOUT', 300) # max. Dauer eines Slots (s)
+RATE_LIMIT_POLL_INTERVAL = 0.25 # Sekunden, wenn kein Slot frei ist
+
+# Konservative Defaults (Free-Tier-Größenordnung); in den Settings überschreibbar
+DEFAULT_RATE_LIMITS = {
+    'groq': {'rpm': 30, 'tpm': 6000, 'concurrency': 4},
+    'google_gemini': {'rpm': 15, 'tpm': 1000000, 'concurrency': 4},
+}
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'AI_RATE_LIMITS', {})}
+
+KEY_PREFIX = 'ai_rl:v1'
+
+# KEYS[1] Bucket-Hash; ARGV: now_ms, rpm, tpm, cost -> 0 (erteilt) oder Wartezeit in ms
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local b = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts', 'blocked_until')
+local req = tonumber(b[1]) or rpm
+local tok = tonumber(b[2]) or tpm
+local ts = tonumber(b[3]) or now
+local blocked = tonumber(b[4]) or 0
+local elapsed = math.max(0, now - ts)
+local wait = 0
+if blocked > now then wait = blocked - now end
+if rpm > 0 then
+    req = math.min(rpm, req + elapsed * rpm / 60000)
+    if req < 1 then wait = math.max(wait, math.ceil((1 - req) * 60000 / rpm)) end
+end
+if tpm > 0 then
+    tok = math.min(tpm, tok + elapsed * tpm / 60000)
+    cost = math.min(cost, tpm)
+    if tok < cost then wait = math.max(wait, math.ceil((cost - tok) * 60000 / tpm)) end
+end
+if wait == 0 then
+    req = req - 1
+    tok = tok - cost
+end
+redis.call('HSET', KEYS[1], 'req', req, 'tok', tok, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 3600000)
+return wait
+"""
+
+# KEYS[1] Bucket-Hash; ARGV: tokens_delta, remaining_tokens (-1 = unbekannt), blocked_until_ms (0 = keine Sperre)
+_OBSERVE_SCRIPT = """
+local b = redis.call('HMGET', KEYS[1], 'tok', 'blocked_until')
+local tok = (tonumber(b[1]) or 0) - tonumber(ARGV[1])
+local remaining = tonumber(ARGV[2])
+if remaining >= 0 and remaining < tok then tok = remaining end
+redis.call('HSET', KEYS[1], 'tok', tok)
+local blocked_until = tonumber(ARGV[3])
+if blocked_until > (tonumber(b[2]) or 0) then
+    redis.call('HSET', KEYS[1], 'blocked_until', blocked_until)
+end
+return 1
+"""
+
+# KEYS[1] Slot-Sorted-Set; ARGV: now_ms, limit, lease_id, lease_ms -> 1 (Slot erhalten) oder 0
+_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(ARGV[4]), ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_GEMINI_RETRY_RE = re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)')
+
+_redis = None
+_scripts = {}
+
+
+class RateLimitExceeded(Exception):
+    """Keine Freigabe bis zur Deadline; retry_after = empfohlene Wartezeit in Sekunden."""
+
+    def __init__(self, provider: str, model_name: str, retry_after: float):
+        self.provider = provider
+        self.model_name = model_name
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit for {provider}/{model_name} not available within deadline (retry after {retry_after:.0f}s).")
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(RATE_LIMIT_REDIS_URL)
+        _scripts['take'] = _redis.register_script(_TAKE_SCRIPT)
+        _scripts['observe'] = _redis.register_script(_OBSERVE_SCRIPT)
+        _scripts['slot'] = _redis.register_script(_SLOT_SCRIPT)
+    return _redis
+
+
+def get_limits(provider: str, model_name: str) -> Optional[dict]:
+    """Effektive Limits für Provider/Modell oder None (kein Limit konfiguriert)."""
+    limits = RATE_LIMITS.get(provider)
+    model_limits = RATE_LIMITS.get(f'{provider}:{model_name}')
+    if limits is None and model_limits is None:
+        return None
+    return {**(limits or {}), **(model_limits or {})}
+
+
+def estimate_tokens(prompt: str) -> int:
+    return len(prompt) // 4 + RATE_LIMIT_COMPLETION_TOKENS
+
+
+def parse_duration(value) -> Optional[float]:
+    """Groq-Resetangaben ('7.66s', '2m59.56s', '120ms') bzw. retry-after ('12') in Sekunden."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    factors = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    return sum(float(number) * factors[unit] for number, unit in parts)
+
+
+def rate_limit_retry_after(provider: str, error: Exception) -> Optional[float]:
+    """Wartezeit in Sekunden, falls error ein 429/ResourceExhausted des Providers ist, sonst None."""
+    if provider == 'groq':
+        if getattr(error, 'status_code', None) != 429:
+            return None
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        return parse_duration(headers.get('retry-after')) or parse_duration(headers.get('x-ratelimit-reset-tokens')) or RATE_LIMIT_BACKOFF
+    if provider == 'google_gemini':
+        if getattr(error, 'code', None) != 429 and type(error).__name__ != 'ResourceExhausted':
+            return None
+        match = _GEMINI_RETRY_RE.search(str(error))
+        return float(match.group(1)) if match else RATE_LIMIT_BACKOFF
+    return None
+
+
+class RateLimitLease:
+    """Freigabe für einen Aufruf; muss mit finish() (bzw. afinish()) zurückgegeben werden."""
+    __slots__ = ('bucket_key', 'slot_key', 'lease_id', 'estimated_tokens', 'waited_ms')
+
+    def __init__(self, bucket_key: str, slot_key: Optional[str], lease_id: str, estimated_tokens: int):
+        self.bucket_key = bucket_key
+        self.slot_key = slot_key
+        self.lease_id = lease_id
+        self.estimated_tokens = estimated_tokens
+        self.waited_ms = 0.0
+
+
+def _try_acquire(lease: RateLimitLease, limits: dict, slot_held: bool):
+    """Ein Versuch; liefert (slot_held, wait_seconds). wait_seconds == 0 heißt: Freigabe erteilt."""
+    client = _get_redis()
+    now_ms = int(time.time() * 1000)
+    if lease.slot_key and not slot_held:
+        slot_held = bool(_scripts['slot'](
+            keys=[lease.slot_key],
+            args=[now_ms, limits['concurrency'], lease.lease_id, RATE_LIMIT_LEASE_TIMEOUT * 1000],
+            client=client,
+        ))
+        if not slot_held:
+            return False, RATE_LIMIT_POLL_INTERVAL
+    wait_ms = _scripts['take'](
+        keys=[lease.bucket_key],
+        args=[now_ms, limits.get('rpm') or 0, limits.get('tpm') or 0, lease.estimated_tokens],
+        client=client,
+    )
+    return slot_held, wait_ms / 1000.0
+
+
+def _prepare(provider: str, api_key: str, model_name: str, prompt: str):
+    if not RATE_LIMIT_ENABLED:
+        return None, None
+    limits = get_limits(provider, model_name)
+    if not limits:
+        return None, None
+    fingerprint = key_fingerprint(api_key)
+    lease = RateLimitLease(
+        bucket_key=f'{KEY_PREFIX}:bucket:{provider}:{fingerprint}:{model_name}',
+        slot_key=f'{KEY_PREFIX}:slots:{provider}:{fingerprint}' if limits.get('concurrency') else None,
+        lease_id=uuid.uuid4().hex,
+        estimated_tokens=estimate_tokens(prompt),
+    )
+    return lease, limits
+
+
+def _release_slot(lease: RateLimitLease):
+    if lease.slot_key:
+        _get_redis().zrem(lease.slot_key, lease.lease_id)
+
+
+def acquire(provider: str, api_key: str, model_name: str, prompt: str, deadline: Optional[float] = None) -> Optional[RateLimitLease]:
+    """Wartet (blockierend) auf Slot und Bucket-Freigabe; None, wenn für den Provider kein Limit gilt.
+
+    Wirft RateLimitExceeded, wenn bis zur Deadline keine Freigabe möglich ist. Ist Redis nicht
+    erreichbar, wird ohne Limit fortgefahren (Logging als Warning).
+    """
+    lease, limits = _prepare(provider, api_key, model_name, prompt)
+    if lease is None:
+        return None
+    started = time.monotonic()
+    give_up_at = started + (RATE_LIMIT_DEADLINE if deadline is None else deadline)
+    slot_held = False
+    try:
+        while True:
+            slot_held, wait = _try_acquire(lease, limits, slot_held)
+            if wait <= 0:
+                lease.waited_ms = (time.monotonic() - started) * 1000
+                return lease
+            if time.monotonic() + wait > give_up_at:
+                if slot_held:
+                    _release_slot(lease)
+                raise RateLimitExceeded(provider, model_name, wait)
+            time.sleep(min(wait, max(give_up_at - time.monotonic(), 0)) + random.uniform(0, 0.05))
+    except RateLimitExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"AI rate limiter unavailable ({provider}/{model_name}), continuing without limit: {e}")
+        return None
+
+
+async def aacquire(provider: str, api_key: str, model_name: str, prompt: str, deadline: Optional[float] = None) -> Optional[RateLimitLease]:
+    """Async-Variante von acquire(); gewartet wird mit asyncio.sleep, Redis-Zugriffe laufen im Thread."""
+    lease, limits = _prepare(provider, api_key, model_name, prompt)
+    if lease is None:
+        return None
+    started = time.monotonic()
+    give_up_at = started + (RATE_LIMIT_DEADLINE if deadline is None else deadline)
+    slot_held = False
+    try_acquire = sync_to_async(_try_acquire, thread_sensitive=False)
+    try:
+        while True:
+            slot_held, wait = await try_acquire(lease, limits, slot_held)
+            if wait <= 0:
+                lease.waited_ms = (time.monotonic() - started) * 1000
+                return lease
+            if time.monotonic() + wait > give_up_at:
+                if slot_held:
+                    await sync_to_async(_release_slot, thread_sensitive=False)(lease)
+                raise RateLimitExceeded(provider, model_name, wait)
+            await asyncio.sleep(min(wait, max(give_up_at - time.monotonic(), 0)) + random.uniform(0, 0.05))
+    except RateLimitExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"AI rate limiter unavailable ({provider}/{model_name}), continuing without limit: {e}")
+        return None
+
+
+def finish(lease: Optional[RateLimitLease], total_tokens: Optional[int] = None, headers=None,
+           retry_after: Optional[float] = None):
+    """Gibt den Slot frei und gleicht den Bucket ab (tatsächliche Tokens, Provider-Header, 429-Sperre)."""
+    if lease is None:
+        return
+    try:
+        token_delta = (total_tokens - lease.estimated_tokens) if total_tokens else 0
+        remaining_tokens = -1
+        blocked_until = 0
+        now_ms = int(time.time() * 1000)
+        if headers:
+            remaining = headers.get('x-ratelimit-remaining-tokens')
+            if remaining is not None and remaining.isdigit():
+                remaining_tokens = int(remaining)
+            # remaining-requests bezieht sich bei Groq auf das Tageslimit: nur als Sperre auswerten
+            if headers.get('x-ratelimit-remaining-requests') == '0':
+                reset = parse_duration(headers.get('x-ratelimit-reset-requests')) or RATE_LIMIT_BACKOFF
+                blocked_until = now_ms + int(reset * 1000)
+        if retry_after:
+            blocked_until = max(blocked_until, now_ms + int(retry_after * 1000))
+            logger.warning(f"Provider rate limit hit ({lease.bucket_key}); blocking for {retry_after:.1f}s.")
+        _scripts['observe'](keys=[lease.bucket_key], args=[token_delta, remaining_tokens, blocked_until], client=_get_redis())
+        _release_slot(lease)
+    except Exception as e:
+        logger.warning(f"Could not update AI rate limiter state for {lease.bucket_key}: {e}")
+
+
+afinish = sync_to_async(finish, thread_sensitive=False)
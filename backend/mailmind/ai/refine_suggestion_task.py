@@ -2,6 +2,8 @@ import logging
 import json
 # from .clients import get_gemini_model # Replaced
 from .api_calls import call_ai_api
+from .provider_clients import run_on_client_loop
+from .streaming import STREAM_SUGGESTIONS, SuggestionDeltaRelay, stream_ai_call
 # from ..prompt_templates.utils import get_prompt_details # Moved inside
 from mailmind.core.models import AISuggestion, User # Added AISuggestion
 # Import get_user_model
@@ -76,7 +78,11 @@ async def refine_suggestion_task(suggestion_id: str, custom_prompt: str, user_id
 
         # 4. Call generic AI API function
         logger.info(f"Sending subject/body for refinement to {prompt_details['provider']} API.")
-        response_str = await call_ai_api(
+        delta_relay = SuggestionDeltaRelay(
+            user.id, suggestion.email_id, suggestion_id=str(suggestion.id), kind='refine'
+        ) if STREAM_SUGGESTIONS else None
+        response_str = await stream_ai_call(
+            delta_relay,
             prompt=formatted_prompt,
             user=user,
             provider=prompt_details['provider'],
@@ -119,8 +125,8 @@ def refine_suggestion_task_sync_wrapper(suggestion_id: str, custom_prompt: str,
     """Synchronous wrapper to call the async refine_suggestion_task."""
     logger.info(f"Sync wrapper called for suggestion {suggestion_id}, user {user_id}")
     try:
-        # Use async_to_sync to run the async task from this sync context
-        async_to_sync(refine_suggestion_task)(suggestion_id, custom_prompt, user_id)
+        # Persistenter Loop pro Worker-Prozess, damit die Provider-Clients wiederverwendet werden
+        run_on_client_loop(refine_suggestion_task, suggestion_id, custom_prompt, user_id)
         logger.info(f"Sync wrapper finished calling async task for suggestion {suggestion_id}")
     except Exception as e:
         logger.error(f"Error calling async task from sync wrapper for suggestion {suggestion_id}: {e}", exc_info=True)
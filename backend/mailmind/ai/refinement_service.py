@@ -1,6 +1,7 @@
 import logging
 import json
 from mailmind.ai.api_calls import call_ai_api_sync # Annahme: Es gibt/wird eine synchrone Version geben
+from mailmind.ai.response_cache import response_cache_options
 from mailmind.prompt_templates.utils import get_prompt_details_sync # Annahme: Es gibt/wird eine synchrone Version geben
 from mailmind.core.models import User # Für User-Objekt
 from knowledge.models import KnowledgeField
@@ -108,7 +109,8 @@ def refine_text_content_sync(
             provider=prompt_details['provider'],
             model_name=prompt_details['model_name'],
             # Falls der API Call eine Quelle erwartet, hier ggf. setzen
-            triggering_source="direct_refine_text_content_sync" 
+            triggering_source="direct_refine_text_content_sync",
+            cache_options=response_cache_options(prompt_details),
         )
 
         # 4. Process JSON response
@@ -0,0 +1,121 @@
+"""
+Gepufferter Writer für AIRequestLog.
+
+call_ai_api baut den Log-Eintrag nur noch im Speicher auf und übergibt ihn hier; ein Hintergrund-
+Thread schreibt die gesammelten Einträge per bulk_create, sobald AI_REQUEST_LOG_BATCH_SIZE erreicht
+ist oder spätestens nach AI_REQUEST_LOG_FLUSH_INTERVAL Sekunden. Der LLM-Aufruf wartet damit auf
+keinen DB-Write mehr.
+
+Hinweise: 'timestamp' (auto_now_add) ist der Zeitpunkt des Flushs, also höchstens ein Intervall
+später als der Request. Beim regulären Prozessende wird per atexit geflusht; bei einem harten Kill
+gehen höchstens die Einträge eines Intervalls verloren.
+"""
+import atexit
+import logging
+import os
+import threading
+from typing import List
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LOG_BATCH_SIZE = getattr(settings, 'AI_REQUEST_LOG_BATCH_SIZE', 50)
+REQUEST_LOG_FLUSH_INTERVAL = getattr(settings, 'AI_REQUEST_LOG_FLUSH_INTERVAL', 2.0) # Sekunden
+REQUEST_LOG_MAX_PENDING = getattr(settings, 'AI_REQUEST_LOG_MAX_PENDING', 10000) # Schutz, falls die DB nicht erreichbar ist
+
+
+class AIRequestLogWriter:
+    def __init__(self, batch_size: int = REQUEST_LOG_BATCH_SIZE, flush_interval: float = REQUEST_LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Django-Q forkt Worker: Thread (und Puffer) gehören zum jeweiligen Prozess
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._pending = []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ai-request-log-writer', daemon=True)
+            self._thread.start()
+
+    def add(self, log_entry):
+        """Nimmt eine ungespeicherte AIRequestLog-Instanz entgegen."""
+        self._ensure_thread()
+        with self._lock:
+            if len(self._pending) >= REQUEST_LOG_MAX_PENDING:
+                logger.warning(f"AIRequestLog buffer full ({REQUEST_LOG_MAX_PENDING}); dropping oldest entry.")
+                self._pending.pop(0)
+            self._pending.append(log_entry)
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        from mailmind.core.models import AIRequestLog
+
+        with self._lock:
+            entries, self._pending = self._pending, []
+        if not entries:
+            return 0
+        try:
+            AIRequestLog.objects.bulk_create(entries, batch_size=self.batch_size)
+        except Exception as e:
+            logger.warning(f"Bulk write of {len(entries)} AIRequestLog entries failed ({e}); saving them one by one.")
+            return self._save_individually(entries)
+        logger.debug(f"Wrote {len(entries)} AIRequestLog entries.")
+        return len(entries)
+
+    def _save_individually(self, entries) -> int:
+        """Fallback nach einem fehlgeschlagenen bulk_create: eine fehlerhafte Zeile (z.B. NUL-Byte im
+        Prompt, FK auf gelöschten User) wird verworfen statt das Logging dauerhaft zu blockieren."""
+        from django.db import DatabaseError, InterfaceError, OperationalError
+
+        written = 0
+        for index, entry in enumerate(entries):
+            try:
+                entry.save(force_insert=True)
+                written += 1
+            except (OperationalError, InterfaceError) as e:
+                # Datenbank nicht erreichbar: Rest für den nächsten Flush aufheben
+                logger.error(f"Database unavailable while writing AIRequestLog entries: {e}")
+                with self._lock:
+                    self._pending = (entries[index:] + self._pending)[-REQUEST_LOG_MAX_PENDING:]
+                break
+            except (DatabaseError, ValueError) as e:
+                close_old_connections()
+                logger.error(
+                    f"Dropping AIRequestLog entry ({entry.provider}/{entry.model_name}, user {entry.user_id}, "
+                    f"source '{entry.triggering_source}'): {e}"
+                )
+        return written
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+request_log_writer = AIRequestLogWriter()
+
+
+def log_ai_request(log_entry):
+    request_log_writer.add(log_entry)
+
+
+@atexit.register
+def _flush_on_exit():
+    if request_log_writer._pending and request_log_writer._pid == os.getpid():
+        request_log_writer.flush()
@@ -0,0 +1,188 @@
+"""
+Antwort-Cache für LLM-Aufrufe (Redis), pro PromptTemplate aktivierbar.
+
+Alle Schlüssel sind pro User getrennt: der gerenderte Prompt enthält RAG-Kontext und Knowledge-Felder,
+eine Antwort darf daher nie an einen anderen Account ausgeliefert werden.
+
+Stufe 1 (exakt): Schlüssel = sha256(user, provider, model, gerenderter Prompt); TTL pro Template
+(PromptTemplate.response_cache_ttl, sonst AI_RESPONSE_CACHE_TTL). Die Anzahl der Einträge ist auf
+AI_RESPONSE_CACHE_MAX_ENTRIES begrenzt; ein Sorted Set mit dem letzten Zugriff dient als LRU.
+
+Stufe 2 (semantisch, optional): Ist PromptTemplate.semantic_cache_threshold gesetzt, wird der
+vollständige gerenderte Prompt (inkl. Kontext/Knowledge) eingebettet und mit den gespeicherten
+Einträgen desselben Users/Templates/Modells verglichen; ab Kosinus >= threshold gilt der Eintrag als
+Treffer. Da das Template den Prompt dominiert, sollte der Schwellwert hoch liegen (z.B. 0.98).
+
+Metriken (Treffer exakt/semantisch, Misses, Stores) liegen als Hash in Redis, pro Template;
+Ausgabe über `manage.py ai_response_cache`.
+"""
+import hashlib
+import logging
+import time
+from typing import Optional
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = getattr(settings, 'AI_RESPONSE_CACHE_ENABLED', True)
+RESPONSE_CACHE_REDIS_URL = getattr(settings, 'AI_RESPONSE_CACHE_REDIS_URL', 'redis://redis:6379/3')
+RESPONSE_CACHE_TTL = getattr(settings, 'AI_RESPONSE_CACHE_TTL', 24 * 3600)
+RESPONSE_CACHE_MAX_ENTRIES = getattr(settings, 'AI_RESPONSE_CACHE_MAX_ENTRIES', 10000)
+SEMANTIC_CACHE_MAX_ENTRIES = getattr(settings, 'AI_SEMANTIC_CACHE_MAX_ENTRIES', 500) # pro User/Template/Modell
+
+KEY_PREFIX = 'ai_resp:v1'
+LRU_KEY = f'{KEY_PREFIX}:lru'
+STATS_KEY = f'{KEY_PREFIX}:stats'
+
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(RESPONSE_CACHE_REDIS_URL)
+    return _redis
+
+
+def response_cache_options(prompt_details: dict) -> Optional[dict]:
+    """Cache-Optionen für call_ai_api aus get_prompt_details(); None, wenn das Template den Cache nicht nutzt."""
+    if not RESPONSE_CACHE_ENABLED or not prompt_details or not prompt_details.get('response_cache_enabled'):
+        return None
+    return {
+        'template': prompt_details.get('name', 'unknown'),
+        'ttl': prompt_details.get('response_cache_ttl') or RESPONSE_CACHE_TTL,
+        'semantic_threshold': prompt_details.get('semantic_cache_threshold'),
+    }
+
+
+def _exact_key(user_id: int, provider: str, model_name: str, prompt: str) -> str:
+    digest = hashlib.sha256('\x00'.join((provider, model_name, prompt)).encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:exact:{user_id}:{digest}'
+
+
+def _semantic_key(user_id: int, template: str, provider: str, model_name: str) -> str:
+    return f'{KEY_PREFIX}:sem:{user_id}:{template}:{provider}:{model_name}'
+
+
+def _embed(text: str) -> np.ndarray:
+    from .clients import get_text_model
+
+    vector = np.asarray(get_text_model().encode(text), dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def _count(template: str, kind: str):
+    try:
+        _get_redis().hincrby(STATS_KEY, f'{template}:{kind}', 1)
+    except Exception:
+        pass
+
+
+class _Lookup:
+    """Ergebnis der Vorab-Prüfung; hält Schlüssel/Vektor für das spätere Speichern."""
+    __slots__ = ('user_id', 'prompt', 'key', 'vector', 'response', 'kind')
+
+    def __init__(self, user_id: int, prompt: str, key: str):
+        self.user_id = user_id
+        self.prompt = prompt
+        self.key = key
+        self.vector = None
+        self.response = None
+        self.kind = None
+
+
+def lookup(user_id: int, provider: str, model_name: str, prompt: str, options: dict) -> _Lookup:
+    """Sucht eine gecachte Antwort des Users (erst exakt, dann semantisch). Fehler von Redis/Modell gelten als Miss."""
+    result = _Lookup(user_id, prompt, _exact_key(user_id, provider, model_name, prompt))
+    template = options['template']
+    try:
+        client = _get_redis()
+        cached = client.get(result.key)
+        if cached is not None:
+            result.response, result.kind = cached.decode('utf-8'), 'exact'
+        elif options.get('semantic_threshold'):
+            result.vector = _embed(prompt)
+            result.response = _semantic_lookup(client, _semantic_key(user_id, template, provider, model_name), result.vector, options['semantic_threshold'])
+            result.kind = 'semantic' if result.response is not None else None
+        if result.response is not None:
+            client.zadd(LRU_KEY, {result.key: time.time()})
+    except Exception as e:
+        logger.warning(f"AI response cache lookup failed ({template}): {e}")
+    _count(template, f'hit_{result.kind}' if result.kind else 'miss')
+    return result
+
+
+def _semantic_lookup(client, semantic_key: str, vector: np.ndarray, threshold: float) -> Optional[str]:
+    entries = client.hgetall(semantic_key)
+    best_key, best_score = None, threshold
+    for exact_key, stored in entries.items():
+        score = float(np.dot(vector, np.frombuffer(stored, dtype=np.float32)))
+        if score >= best_score:
+            best_key, best_score = exact_key, score
+    if best_key is None:
+        return None
+    cached = client.get(best_key)
+    if cached is None: # Exakter Eintrag abgelaufen/verdrängt
+        client.hdel(semantic_key, best_key)
+        return None
+    logger.debug(f"Semantic cache hit (cosine {best_score:.3f}) in {semantic_key}")
+    return cached.decode('utf-8')
+
+
+def store(provider: str, model_name: str, options: dict, result: _Lookup, response: str):
+    """Speichert eine erfolgreiche Antwort und verdrängt die am längsten nicht genutzten Einträge."""
+    template = options['template']
+    try:
+        client = _get_redis()
+        now = time.time()
+        pipe = client.pipeline()
+        pipe.set(result.key, response.encode('utf-8'), ex=int(options['ttl']))
+        pipe.zadd(LRU_KEY, {result.key: now})
+        pipe.zremrangebyscore(LRU_KEY, '-inf', now - RESPONSE_CACHE_TTL * 2) # abgelaufene Keys
+        pipe.zcard(LRU_KEY)
+        size = pipe.execute()[-1]
+        if size > RESPONSE_CACHE_MAX_ENTRIES:
+            evicted = [key for key, _ in client.zpopmin(LRU_KEY, size - RESPONSE_CACHE_MAX_ENTRIES)]
+            if evicted:
+                client.delete(*evicted)
+
+        if options.get('semantic_threshold'):
+            vector = result.vector if result.vector is not None else _embed(result.prompt)
+            semantic_key = _semantic_key(result.user_id, template, provider, model_name)
+            client.hset(semantic_key, result.key, vector.astype(np.float32).tobytes())
+            client.expire(semantic_key, int(options['ttl']))
+            if client.hlen(semantic_key) > SEMANTIC_CACHE_MAX_ENTRIES:
+                # Einträge ohne gültigen exakten Schlüssel zuerst entfernen
+                stale = [key for key in client.hkeys(semantic_key) if not client.exists(key)]
+                if stale:
+                    client.hdel(semantic_key, *stale)
+        _count(template, 'store')
+    except Exception as e:
+        logger.warning(f"AI response cache store failed ({template}): {e}")
+
+
+alookup = sync_to_async(lookup, thread_sensitive=False)
+astore = sync_to_async(store, thread_sensitive=False)
+
+
+def get_stats() -> dict:
+    """{template: {hit_exact, hit_semantic, miss, store}} aus Redis."""
+    stats = {}
+    for field, value in _get_redis().hgetall(STATS_KEY).items():
+        template, kind = field.decode('utf-8').rsplit(':', 1)
+        stats.setdefault(template, {})[kind] = int(value)
+    return stats
+
+
+def clear(keep_stats: bool = False) -> int:
+    """Löscht alle Cache-Einträge (optional ohne die Metriken); gibt die Anzahl gelöschter Keys zurück."""
+    client = _get_redis()
+    keys = [key for key in client.scan_iter(match=f'{KEY_PREFIX}:*', count=1000)
+            if not (keep_stats and key.decode('utf-8') == STATS_KEY)]
+    if keys:
+        client.delete(*keys)
+    return len(keys)
@@ -0,0 +1,85 @@
+"""
+RAG-Retrieval für generate_ai_suggestion.
+
+Die eingehende E-Mail wird wie beim Indexieren gechunkt und eingebettet (Treffer im Embedding-Cache,
+wenn sie bereits indexiert ist), dann werden ähnliche E-Mails desselben Users aus email_embeddings
+gesucht. Treffer aus derselben Konversation werden bevorzugt; der Kontext wird bis zu einem
+Token-Budget aufgefüllt.
+"""
+import logging
+import time
+from typing import Any, Dict, Tuple
+
+from django.conf import settings
+
+from .chunking import chunk_email_text, strip_quoted_reply
+from .clients import get_text_model
+from .embedding_cache import encode_with_cache
+from .embedding_tasks import encode_texts_batched
+from .search import semantic_search_emails
+
+logger = logging.getLogger(__name__)
+
+RAG_TOP_K = getattr(settings, 'AI_RAG_TOP_K', 5)
+RAG_CANDIDATES = getattr(settings, 'AI_RAG_CANDIDATES', 20) # Kandidaten vor Boost/Budget
+RAG_TOKEN_BUDGET = getattr(settings, 'AI_RAG_TOKEN_BUDGET', 1500)
+RAG_MIN_SCORE = getattr(settings, 'AI_RAG_MIN_SCORE', 0.3)
+RAG_CONVERSATION_BOOST = getattr(settings, 'AI_RAG_CONVERSATION_BOOST', 0.1)
+CHARS_PER_TOKEN = 4 # Grobe Schätzung, unabhängig vom LLM-Tokenizer
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def retrieve_email_context(email, token_budget: int = RAG_TOKEN_BUDGET, top_k: int = RAG_TOP_K) -> Tuple[str, Dict[str, Any]]:
+    """Liefert (rag_context, stats) für eine E-Mail; stats enthält u.a. 'retrieval_ms', 'candidates', 'used', 'tokens'."""
+    from mailmind.core.models import Email
+
+    start = time.perf_counter()
+    stats = {'retrieval_ms': 0.0, 'candidates': 0, 'used': 0, 'tokens': 0}
+
+    model = get_text_model()
+    query_text = chunk_email_text(email.subject, email.from_address, email.body_text, model=model)[0]['text']
+    query_vector = encode_with_cache([query_text], lambda texts: encode_texts_batched(model, texts))[0]
+    hits = semantic_search_emails(
+        query_text,
+        user_id=email.account.user_id,
+        limit=RAG_CANDIDATES,
+        query_vector=query_vector,
+        exclude_email_ids=[email.id],
+    )
+    stats['candidates'] = len(hits)
+
+    hits_by_id = {hit['email_id']: hit for hit in hits}
+    candidates = Email.objects.filter(id__in=hits_by_id.keys(), account__user_id=email.account.user_id).only(
+        'id', 'subject', 'from_address', 'received_at', 'body_text', 'conversation_id'
+    )
+    ranked = []
+    for candidate in candidates:
+        score = hits_by_id[candidate.id]['score']
+        if email.conversation_id and candidate.conversation_id == email.conversation_id:
+            score += RAG_CONVERSATION_BOOST
+        if score >= RAG_MIN_SCORE:
+            ranked.append((score, candidate))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+
+    blocks = []
+    remaining_tokens = token_budget
+    for score, candidate in ranked[:top_k]:
+        received = f" vom {candidate.received_at:%d.%m.%Y}" if candidate.received_at else ""
+        header = f"--- E-Mail{received} | Von: {candidate.from_address} | Betreff: {candidate.subject} (Relevanz {score:.2f}) ---\n"
+        body = strip_quoted_reply(candidate.body_text or '') or hits_by_id[candidate.id]['chunk_snippet']
+        available_chars = (remaining_tokens - estimate_tokens(header)) * CHARS_PER_TOKEN
+        if available_chars < 200: # Kein sinnvoller Rest mehr
+            break
+        if len(body) > available_chars:
+            body = body[:available_chars - 6].rsplit(' ', 1)[0] + ' [...]'
+        block = header + body
+        blocks.append(block)
+        remaining_tokens -= estimate_tokens(block)
+
+    stats['used'] = len(blocks)
+    stats['tokens'] = token_budget - remaining_tokens
+    stats['retrieval_ms'] = (time.perf_counter() - start) * 1000
+    return '\n\n'.join(blocks), stats
@@ -0,0 +1,136 @@
+"""
+Semantische Suche über die E-Mail-Chunks in Qdrant und hybride Suche (Volltext + Vektor).
+
+Eine E-Mail ist als mehrere Chunk-Punkte gespeichert (siehe embedding_tasks.index_email_chunks);
+die Treffer werden serverseitig nach 'email_id' gruppiert, so dass jede E-Mail genau einmal mit
+ihrem besten Chunk erscheint.
+
+Die hybride Suche kombiniert die Postgres-Volltextsuche (Email.search_vector, GIN-indexiert) mit der Vektorsuche per Reciprocal Rank Fusion: score = Σ 1 / (k + rang).
+"""
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from qdrant_client.http import models as rest_models
+
+from .clients import get_text_model, get_qdrant_client
+from .embedding_tasks import EMAIL_COLLECTION_NAME
+
+logger = logging.getLogger(__name__)
+
+HYBRID_SEARCH_CANDIDATES = getattr(settings, 'AI_HYBRID_SEARCH_CANDIDATES', 100) # Kandidaten je Verfahren vor der Fusion
+HYBRID_SEARCH_RRF_K = getattr(settings, 'AI_HYBRID_SEARCH_RRF_K', 60)
+
+
+def semantic_search_emails(query_text: str, user_id: int, limit: int = 10, account_id: Optional[int] = None,
+                           query_vector: Optional[List[float]] = None,
+                           exclude_email_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """Sucht E-Mails des Users per Vektorähnlichkeit.
+
+    Gibt eine nach Score absteigend sortierte Liste von Dicts mit 'email_id', 'score', 'chunk_index'
+    und 'chunk_snippet' zurück.
+    """
+    if query_vector is None:
+        query_vector = get_text_model().encode(query_text).tolist()
+
+    conditions = [rest_models.FieldCondition(key='user_id', match=rest_models.MatchValue(value=user_id))]
+    if account_id is not None:
+        conditions.append(rest_models.FieldCondition(key='account_id', match=rest_models.MatchValue(value=account_id)))
+    excluded = []
+    if exclude_email_ids:
+        excluded.append(rest_models.FieldCondition(key='email_id', match=rest_models.MatchAny(any=list(exclude_email_ids))))
+
+    groups = get_qdrant_client().query_points_groups(
+        collection_name=EMAIL_COLLECTION_NAME,
+        query=query_vector,
+        group_by='email_id',
+        group_size=1, # Bester Chunk pro E-Mail
+        limit=limit,
+        query_filter=rest_models.Filter(must=conditions, must_not=excluded or None),
+        with_payload=['chunk_index', 'chunk_snippet', 'body_snippet'],
+    ).groups
+
+    results = []
+    for group in groups:
+        if not group.hits:
+            continue
+        best_hit = group.hits[0]
+        payload = best_hit.payload or {}
+        results.append({
+            'email_id': int(group.id),
+            'score': best_hit.score,
+            'chunk_index': payload.get('chunk_index', 0),
+            'chunk_snippet': payload.get('chunk_snippet') or payload.get('body_snippet', ''),
+        })
+    logger.debug(f"Semantische Suche für User {user_id}: {len(results)} E-Mails gefunden.")
+    return results
+
+
+def email_search_query(query_text: str) -> SearchQuery:
+    """Suchanfrage (Websearch-Syntax) passend zu Email.search_vector: deutsch, englisch und ungestemmt per OR."""
+    from mailmind.core.models import EMAIL_SEARCH_CONFIGS
+
+    search_query = None
+    for config in EMAIL_SEARCH_CONFIGS:
+        config_query = SearchQuery(query_text, config=config, search_type='websearch')
+        search_query = config_query if search_query is None else search_query | config_query
+    return search_query
+
+
+def lexical_search_emails(queryset, query_text: str, limit: int = HYBRID_SEARCH_CANDIDATES) -> List[int]:
+    """Volltextsuche auf dem (bereits gefilterten) Queryset; liefert E-Mail-IDs nach Rang absteigend."""
+    search_query = email_search_query(query_text)
+    return list(
+        queryset.filter(search_vector=search_query)
+        .annotate(rank=SearchRank(F('search_vector'), search_query))
+        .order_by('-rank', '-id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[int]], k: int = HYBRID_SEARCH_RRF_K) -> List[Dict[str, Any]]:
+    """Fusioniert mehrere Ranglisten von IDs; liefert Dicts mit 'email_id', 'score' und 'matched_by'."""
+    fused = {}
+    for source, ids in rankings.items():
+        for rank, email_id in enumerate(ids, start=1):
+            entry = fused.setdefault(email_id, {'email_id': email_id, 'score': 0.0, 'matched_by': []})
+            entry['score'] += 1.0 / (k + rank)
+            entry['matched_by'].append(source)
+    return sorted(fused.values(), key=lambda entry: (-entry['score'], -entry['email_id']))
+
+
+def hybrid_search_emails(queryset, query_text: str, user_id: int, limit: int = 20,
+                         candidates: int = HYBRID_SEARCH_CANDIDATES,
+                         rrf_k: int = HYBRID_SEARCH_RRF_K) -> Dict[str, Any]:
+    """Hybride Suche über das gefilterte Queryset des Users.
+
+    Gibt {'results': [...], 'timings': {...}} zurück; results sind nach RRF-Score sortiert. Fällt die
+    Vektorsuche aus (Qdrant/Modell nicht erreichbar), wird nur das Volltext-Ergebnis verwendet.
+    """
+    timings = {}
+    start = time.perf_counter()
+    lexical_ids = lexical_search_emails(queryset, query_text, limit=candidates)
+    timings['lexical_ms'] = (time.perf_counter() - start) * 1000
+
+    semantic_ids = []
+    start = time.perf_counter()
+    try:
+        hits = semantic_search_emails(query_text, user_id=user_id, limit=candidates)
+        hit_ids = [hit['email_id'] for hit in hits]
+        # Filter des Querysets (Ordner, Flags, ...) gelten auch für die Vektortreffer
+        allowed = set(queryset.filter(id__in=hit_ids).values_list('id', flat=True))
+        semantic_ids = [email_id for email_id in hit_ids if email_id in allowed]
+    except Exception as e:
+        logger.warning(f"Hybride Suche: Vektorsuche für User {user_id} fehlgeschlagen, nur Volltext: {e}")
+    timings['semantic_ms'] = (time.perf_counter() - start) * 1000
+
+    results = reciprocal_rank_fusion({'lexical': lexical_ids, 'semantic': semantic_ids}, k=rrf_k)[:limit]
+    timings['total_ms'] = timings['lexical_ms'] + timings['semantic_ms']
+    logger.debug(
+        f"Hybride Suche für User {user_id}: {len(lexical_ids)} Volltext-, {len(semantic_ids)} Vektortreffer, "
+        f"{len(results)} Ergebnisse in {timings['total_ms']:.1f} ms."
+    )
+    return {'results': results, 'timings': timings}
@@ -0,0 +1,95 @@
+"""
+Streaming der LLM-Antwort an den Browser.
+
+call_ai_api(on_delta=...) liefert die Token-Deltas von Groq/Gemini; SuggestionDeltaRelay fasst sie
+zusammen und schickt höchstens alle AI_STREAM_DELTA_INTERVAL_MS ein 'suggestion.delta'-Event an die
+User-Gruppen beider Consumer: user_<id>_events (EmailConsumer) und user_<id> (SuggestionConsumer). Das letzte Event hat done=True. Der fertige Vorschlag wird wie bisher
+erst nach der vollständigen Antwort gespeichert und per 'email.updated' gemeldet.
+
+Event-Daten: {email_id, suggestion_id, stream_id, kind, seq, delta, done}
+"""
+import logging
+import time
+import uuid
+from typing import Optional
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .api_calls import call_ai_api
+
+logger = logging.getLogger(__name__)
+
+STREAM_SUGGESTIONS = getattr(settings, 'AI_STREAM_SUGGESTIONS', True)
+STREAM_DELTA_INTERVAL = getattr(settings, 'AI_STREAM_DELTA_INTERVAL_MS', 50) / 1000.0
+
+
+class SuggestionDeltaRelay:
+    """Awaitable Callback für call_ai_api(on_delta=...), der Deltas gebündelt über den Channel-Layer sendet."""
+
+    def __init__(self, user_id: int, email_id: int, suggestion_id: Optional[str] = None, kind: str = 'generate',
+                 interval: float = STREAM_DELTA_INTERVAL):
+        self.group_names = (f'user_{user_id}_events', f'user_{user_id}')
+        self.email_id = email_id
+        self.suggestion_id = suggestion_id
+        self.kind = kind
+        self.interval = interval
+        self.stream_id = uuid.uuid4().hex
+        self.channel_layer = get_channel_layer()
+        self.started_at = time.monotonic()
+        self.first_delta_ms = None
+        self._buffer = []
+        self._last_flush = 0.0
+        self._seq = 0
+        self._send_failed = False
+
+    async def __call__(self, delta: str):
+        if self.first_delta_ms is None:
+            self.first_delta_ms = (time.monotonic() - self.started_at) * 1000
+        self._buffer.append(delta)
+        if time.monotonic() - self._last_flush >= self.interval:
+            await self.flush()
+
+    async def flush(self, done: bool = False):
+        if not self._buffer and not done:
+            return
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        if self.channel_layer is None or self._send_failed:
+            return
+        self._seq += 1
+        message = {
+            'type': 'suggestion.delta',
+            'data': {
+                'email_id': self.email_id,
+                'suggestion_id': self.suggestion_id,
+                'stream_id': self.stream_id,
+                'kind': self.kind,
+                'seq': self._seq,
+                'delta': text,
+                'done': done,
+            },
+        }
+        try:
+            for group_name in self.group_names:
+                await self.channel_layer.group_send(group_name, message)
+        except Exception as e:
+            # Streaming ist nur Komfort: Fehler hier dürfen den LLM-Aufruf nicht abbrechen
+            self._send_failed = True
+            logger.warning(f"Could not relay suggestion delta to {self.group_names}: {e}")
+
+    async def finish(self):
+        await self.flush(done=True)
+
+
+async def stream_ai_call(relay: Optional[SuggestionDeltaRelay], **call_kwargs) -> str:
+    """call_ai_api mit Delta-Streaming über relay (None = ohne Streaming); Rückgabe wie call_ai_api."""
+    if relay is None:
+        return await call_ai_api(**call_kwargs)
+    try:
+        return await call_ai_api(on_delta=relay, **call_kwargs)
+    finally:
+        await relay.finish()
+        if relay.first_delta_ms is not None:
+            logger.info(f"[Streaming] {relay.kind} for email {relay.email_id}: first token after {relay.first_delta_ms:.0f} ms, {relay._seq} delta events.")
@@ -2,7 +2,7 @@ import logging
 import time
 import json
 from celery import shared_task
-from celery.exceptions import MaxRetriesExceededError
+from celery.exceptions import MaxRetriesExceededError, Retry
 from django.utils import timezone
 from django.db import transaction
 from django.core.cache import cache
@@ -10,6 +10,8 @@ from django.core.cache import cache
 from mailmind.core.models import Email, User
 from mailmind.prompt_templates.utils import get_prompt_details
 from .api_calls import call_ai_api
+from .provider_clients import run_on_client_loop
+from .rate_limiter import RATE_LIMIT_TASK_DEADLINE
 
 # WebSocket related imports
 from channels.layers import get_channel_layer
@@ -65,7 +67,7 @@ def generate_summary_task(self, email_id: int, triggering_user_id: int | None =
 
         # --- Get Prompt Details ---
         logger.info(f"[TASK_SUMMARY Step 1/4] Fetching prompt template details for 'generate_suggestions'")
-        prompt_details = get_prompt_details('generate_suggestions') # Use the combined prompt for now
+        prompt_details = async_to_sync(get_prompt_details)('generate_suggestions') # Use the combined prompt for now
         if not prompt_details:
             logger.error(f"[TASK_SUMMARY] Could not find active prompt template 'generate_suggestions'. Aborting.")
             cache.delete(cache_key)
@@ -103,12 +105,14 @@ def generate_summary_task(self, email_id: int, triggering_user_id: int | None =
 
         # --- Call AI API ---
         logger.info(f"[TASK_SUMMARY Step 3/4] Calling {prompt_details['provider']} API for Email ID {email.id}")
-        ai_response_str = call_ai_api(
+        ai_response_str = run_on_client_loop(
+            call_ai_api,
             prompt=formatted_prompt,
             user=user,
             provider=prompt_details['provider'],
             model_name=prompt_details['model_name'],
-            triggering_source=f"generate_summary_task_email_{email_id}" # Add source
+            triggering_source=f"generate_summary_task_email_{email_id}", # Add source
+            rate_limit_deadline=RATE_LIMIT_TASK_DEADLINE,
         )
 
         # --- Process Response & Save Summaries ---
@@ -130,6 +134,19 @@ def generate_summary_task(self, email_id: int, triggering_user_id: int | None =
             cache.delete(cache_key)
             return "Failed: Non-JSON response" # Or handle plain text if applicable
 
+        # Rate-Limit (Deadline abgelaufen oder 429): erst nach dem Reset erneut versuchen statt nach festen 60s
+        if ai_response_data.get("rate_limited"):
+             retry_after = ai_response_data.get("retry_after") or 60
+             logger.warning(f"[TASK_SUMMARY] Rate limited for Email {email.id}; retrying in {retry_after:.0f}s.")
+             # Lock vor dem Retry freigeben: retry_after kann länger als SUMMARY_GENERATION_LOCK_TIMEOUT sein,
+             # und der Retry würde sonst am eigenen Lock scheitern und übersprungen
+             cache.delete(cache_key)
+             try:
+                  self.retry(countdown=retry_after)
+             except MaxRetriesExceededError:
+                  logger.error(f"[TASK_SUMMARY] Max retries exceeded after rate limiting for email {email_id}.")
+             return f"Failed: Rate limited - {ai_response_data['error']}"
+
         # Check for error key within the parsed data
         if "error" in ai_response_data:
              logger.error(f"[TASK_SUMMARY] Error received from {prompt_details['provider']} API for Email {email.id}: {ai_response_data['error']}")
@@ -194,7 +211,7 @@ def generate_summary_task(self, email_id: int, triggering_user_id: int | None =
             except Exception as e_save:
                  logger.error(f"[TASK_SUMMARY] Error saving summaries for email {email.id}: {e_save}", exc_info=True)
                  processed_successfully = False # Mark as failed on save error
-                 # Don't delete lock yet, allow potential retry
+                 # Lock wird im finally freigegeben, damit der Retry ihn wieder erhält
                  try:
                       self.retry(exc=e_save)
                  except MaxRetriesExceededError:
@@ -207,6 +224,8 @@ def generate_summary_task(self, email_id: int, triggering_user_id: int | None =
              processed_successfully = True # Consider it success if no update was needed
 
 
+    except Retry:
+        raise # Bereits geplanter Retry (z.B. mit retry_after), nicht erneut mit Standard-Countdown planen
     except Exception as e_outer:
         logger.error(f"[TASK_SUMMARY] Outer unexpected error in generate_summary_task for ID {email_id}: {e_outer}", exc_info=True)
         processed_successfully = False
@@ -221,12 +240,10 @@ def generate_summary_task(self, email_id: int, triggering_user_id: int | None =
 
     finally:
         # --- Release Lock ---
-        # Only delete the lock if the task wasn't retried or max retries were hit in error handling
-        # Check if task is being retried
-        is_retrying = self.request.retries < self.max_retries and not processed_successfully
-        if not is_retrying:
-             deleted = cache.delete(cache_key)
-             logger.debug(f"[TASK_SUMMARY] Lock {cache_key} deleted: {deleted}")
+        # Immer freigeben, auch wenn ein Retry geplant ist: der Retry läuft als neuer Task und muss
+        # den Lock per cache.add wieder erhalten (sonst würde er bis zum Timeout übersprungen)
+        deleted = cache.delete(cache_key)
+        logger.debug(f"[TASK_SUMMARY] Lock {cache_key} deleted: {deleted}")
 
 
         # --- WebSocket Notification (regardless of save success/failure, to update UI state) ---
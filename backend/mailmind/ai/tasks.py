@@ -26,6 +26,10 @@ from mailmind.core.models import Email, Attachment, User, AISuggestion, Availabl
 from django.utils import timezone
 from django.core.cache import cache
 from .api_calls import call_ai_api
+from .provider_clients import run_on_client_loop
+from .rate_limiter import RATE_LIMIT_TASK_DEADLINE
+from .response_cache import response_cache_options
+from .streaming import STREAM_SUGGESTIONS, SuggestionDeltaRelay, stream_ai_call
 from ..prompt_templates.utils import get_prompt_details
 # from .embedding_tasks import generate_embeddings_for_email # Example of potential needed import
 # from .generate_suggestion_task import generate_ai_suggestion # Example
@@ -54,6 +58,9 @@ from google.api_core import exceptions as google_exceptions
 from django.db import transaction
 from multiprocessing import Value
 from knowledge.models import KnowledgeField # Import the new model
+from .embedding_tasks import generate_email_embedding as generate_chunked_email_embedding, generate_attachment_embedding as _generate_attachment_embedding
+from .retrieval import retrieve_email_context
+from . import clients
 
 
 logger = logging.getLogger(__name__)
@@ -96,74 +103,13 @@ def send_suggestions_to_client(email_id: int, user_id: int, suggestions_data: li
 # text_model = _load_text_model_once()
 
 # Globale Modelle (Qdrant/Gemini bleiben beim alten Ladevorgang in get_...)
-_text_model = None # Wieder aktivieren für lazy loading
 image_model = None
 qdrant_client = None
 gemini_model = None
 
 def get_text_model():
-    """Lädt das SentenceTransformer-Modell beim ersten Aufruf im Prozess und gibt es zurück."""
-    global _text_model
-    if _text_model is None:
-        logger.info("--- get_text_model: _text_model is None, attempting to load. ---")
-        load_models_env = os.getenv('LOAD_AI_MODELS', 'false').lower() == 'true'
-        if not load_models_env:
-             logger.warning("LOAD_AI_MODELS ist nicht auf 'true' gesetzt. Text-Modell wird nicht geladen.")
-             raise RuntimeError("Text-Embedding-Modell-Laden nicht aktiviert (LOAD_AI_MODELS!=true).")
-             
-        logger.info("Importing SentenceTransformer library...")
-        try:
-            from sentence_transformers import SentenceTransformer
-            logger.info("SentenceTransformer library imported successfully.")
-            
-            # --- TEMPORARY: Use a smaller model for testing ---
-            # model_name = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
-            model_name = 'sentence-transformers/all-MiniLM-L6-v2' 
-            logger.info(f"Attempting to instantiate SentenceTransformer with model: {model_name}...")
-            
-            # Explizit den Cache-Ordner übergeben
-            cache_folder = os.getenv('SENTENCE_TRANSFORMERS_HOME')
-            
-            # --- HIER: Robuster try...except NUR um die Instanziierung --- 
-            try:
-                 # Explizite Garbage Collection vor dem Laden
-                 logger.debug("Running garbage collection before model load...")
-                 gc.collect()
-                 logger.debug("Garbage collection finished.")
-                 
-                 if cache_folder:
-                      logger.info(f"Using explicit cache folder: {cache_folder}")
-                      _text_model = SentenceTransformer(model_name, cache_folder=cache_folder)
-                 else:
-                      logger.warning("SENTENCE_TRANSFORMERS_HOME not set, relying on default cache.")
-                      _text_model = SentenceTransformer(model_name)
-                 
-                 logger.info(f"SentenceTransformer model '{model_name}' instantiated successfully.")
-                 
-            except Exception as model_load_e:
-                 # Logge den Fehler SEHR explizit und beende den Prozess hart,
-                 # damit wir den Fehler sicher sehen.
-                 logger.critical(f"!!! CRITICAL ERROR DURING SentenceTransformer INSTANTIATION: {model_load_e} !!!", exc_info=True)
-                 # Optional: Zusätzliche Debug-Infos loggen?
-                 # logger.info(f"Environment: {os.environ}")
-                 # logger.info(f"Cache Folder: {cache_folder}")
-                 # Beende den Prozess, um Reinkarnation mit derselben Ursache zu vermeiden
-                 sys.exit(f"Worker exiting due to model load failure: {model_load_e}") 
-            # --- Ende des robusten try...except --- 
-                 
-        except ImportError:
-             logger.error("sentence-transformers ist nicht installiert.", exc_info=True)
-             raise RuntimeError("Fehler beim Laden des Text-Modells: sentence-transformers nicht installiert.")
-        # Den äußeren Exception-Handler brauchen wir hier nicht mehr unbedingt,
-        # da der innere try..except mit sys.exit() den Prozess beendet.
-        # except Exception as e:
-        #     logger.error(f"Exception during SentenceTransformer instantiation: {e}", exc_info=True)
-        #     raise RuntimeError(f"Fehler beim Laden des Text-Modells: {e}")
-        logger.info("--- get_text_model: Model loaded and assigned to _text_model. ---")
-            
-    else:
-        logger.debug("--- get_text_model: _text_model already loaded, returning cached instance. ---")
-    return _text_model
+    """Gibt das Text-Embedding-Modell zurück (eine Instanz pro Prozess bzw. Client für den Embedding-Server, siehe clients.py)."""
+    return clients.get_text_model()
 
 def get_image_model():
     """Lädt und gibt das CLIP-Modell für Bild-Embeddings zurück."""
@@ -385,142 +331,12 @@ async def refine_suggestion_with_prompt(text_to_refine: str, custom_prompt: str,
         return None
 
 def generate_email_embedding(email: Email):
-    """Generiert Text-Embedding für eine E-Mail und speichert es in Qdrant."""
-    try:
-        model = get_text_model()
-        client = get_qdrant_client()
-        
-        text_content = f"Betreff: {email.subject}\nAbsender: {email.from_address}\n\n{email.body_text}"
-        embedding = model.encode(text_content)
-        
-        to_addresses = list(email.to_contacts.values_list('email', flat=True))
-        cc_addresses = list(email.cc_contacts.values_list('email', flat=True))
-        bcc_addresses = list(email.bcc_contacts.values_list('email', flat=True))
-        attachment_filenames = list(email.attachments.values_list('filename', flat=True))
-        attachment_ids = list(email.attachments.values_list('id', flat=True))
-
-        payload = {
-            'email_id': email.id,
-            'subject': email.subject or "",
-            'from_address': email.from_address or "",
-            'to_addresses': to_addresses,
-            'cc_addresses': cc_addresses,
-            'bcc_addresses': bcc_addresses,
-            'received_at': email.received_at.isoformat() if email.received_at else None,
-            'sent_at': email.sent_at.isoformat() if email.sent_at else None,
-            'body_snippet': (email.body_text or "")[:250], # Gekürzt
-            'has_attachments': email.attachments.exists(),
-            'attachment_filenames': attachment_filenames,
-            'attachment_ids': attachment_ids, 
-            'account_id': email.account_id,
-            'user_id': email.account.user_id,
-            'is_read': email.is_read,
-            'is_flagged': email.is_flagged,
-            'is_replied': email.is_replied,
-            'is_deleted': email.is_deleted_on_server,
-            'is_draft': email.is_draft,
-            'folder_name': email.folder_name or "",
-        }
-        
-        point = PointStruct(
-            id=email.id,
-            vector=embedding.tolist(),
-            payload=payload
-        )
-        
-        client.upsert(
-            collection_name="email_embeddings",
-            points=[point],
-            wait=True 
-        )
-        logger.info(f"Text-Embedding für Email ID {email.id} in Qdrant gespeichert.")
-        
-        # Markieren, dass Embedding erstellt wurde (direkt hier statt am Ende des Haupt-Tasks)
-        # Entfernt: Wird jetzt im Haupttask durch ai_processed ersetzt
-        # if not email.embedding_generated:
-        #    email.embedding_generated = True
-        #    email.save(update_fields=['embedding_generated', 'updated_at'])
-            
-    except Exception as e:
-        logger.error(f"Fehler beim Generieren/Speichern des E-Mail-Embeddings für ID {email.id}: {e}", exc_info=True)
+    """Generiert die Chunk-Embeddings für eine E-Mail und speichert sie in Qdrant (siehe embedding_tasks.index_email_chunks)."""
+    generate_chunked_email_embedding(email)
 
 def generate_attachment_embedding(attachment: Attachment):
-    """Generiert Embedding für einen Anhang (OCR für Bilder) und speichert es in Qdrant."""
-    try:
-        text_model = get_text_model()
-        client = get_qdrant_client()
-        
-        extracted_text = ""
-        embedding = None
-        is_image = attachment.content_type.startswith('image/')
-
-        if is_image:
-            try:
-                # Prüfen ob Datei existiert
-                if not attachment.file or not attachment.file.path:
-                     logger.warning(f"Anhang-Datei für ID {attachment.id} nicht gefunden.")
-                     return # Frühzeitiger Ausstieg, wenn kein Pfad vorhanden
-                
-                # Versuche, das Bild zu öffnen und OCR durchzuführen
-                try:
-                    image = Image.open(attachment.file.path)
-                    extracted_text = pytesseract.image_to_string(image, lang='deu+eng')
-                    logger.info(f"OCR für Anhang {attachment.id} ({attachment.filename}) durchgeführt.")
-                except FileNotFoundError:
-                    logger.error(f"Datei für Anhang {attachment.id} nicht gefunden unter Pfad: {attachment.file.path}")
-                    return # Abbruch, wenn Datei fehlt
-                except Exception as ocr_error:
-                    logger.error(f"OCR Fehler für Anhang {attachment.id}: {ocr_error}", exc_info=True)
-                    extracted_text = "" # Setze leeren String bei OCR-Fehler
-
-            except Exception as outer_exception:
-                 # Fängt andere Fehler ab, z.B. Probleme beim Zugriff auf attachment.file.path
-                 logger.error(f"Fehler beim Vorbereiten der OCR für Anhang {attachment.id}: {outer_exception}", exc_info=True)
-                 return
-
-        else:
-            # TODO: Text-Extraktion für andere Typen (PDF, DOCX)
-            extracted_text = attachment.extracted_text or f"Dateiname: {attachment.filename}"
-
-        # Nur Text-Embeddings aktuell
-        if extracted_text:
-            embedding = text_model.encode(extracted_text)
-            embedding_list = embedding.tolist()
-        else:
-            logger.warning(f"Kein Text für Embedding für Anhang {attachment.id} vorhanden.")
-            return 
-
-        payload = {
-            'attachment_id': attachment.id,
-            'parent_email_id': attachment.email_id,
-            'filename': attachment.filename or "",
-            'content_type': attachment.content_type or "",
-            'extracted_text_snippet': (extracted_text or "")[:250], 
-            'size': attachment.size,
-            'is_image': is_image,
-            'account_id': attachment.email.account_id,
-            'user_id': attachment.email.account.user_id,
-        }
-
-        point = PointStruct(
-            id=attachment.id,
-            vector=embedding_list,
-            payload=payload
-        )
-
-        client.upsert(
-            collection_name="attachment_embeddings",
-            points=[point],
-            wait=True
-        )
-        logger.info(f"Embedding für Anhang ID {attachment.id} in Qdrant gespeichert.")
-
-        # Nur speichern, wenn Text extrahiert wurde (optional)
-        # if extracted_text and not attachment.extracted_text:
-        #    attachment.save(update_fields=['extracted_text', 'updated_at'])
-        
-    except Exception as e:
-        logger.error(f"Fehler beim Verarbeiten/Speichern des Anhang-Embeddings für ID {attachment.id}: {e}", exc_info=True)
+    """Generiert Embedding für einen Anhang (OCR für Bilder) und speichert es in Qdrant (siehe embedding_tasks.generate_attachment_embedding)."""
+    _generate_attachment_embedding(attachment)
 
 # Haupt-Task zur Generierung von Vorschlägen für eine E-Mail
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
@@ -594,7 +410,17 @@ def generate_ai_suggestion(self, email_id: int, triggering_user_id: int):
         # [LOGIC] 1. Kontext sammeln (RAG + Knowledge Fields)
         logger.info(f"[TASK Step 1/4] Sammle Kontext für Email ID: {email_id}")
         rag_context = "" # Initialize rag_context
-        # TODO: Implement RAG search here
+        retrieval_ms = None
+        try:
+            rag_context, rag_stats = retrieve_email_context(email)
+            retrieval_ms = rag_stats['retrieval_ms']
+            logger.info(
+                f"[TASK] RAG retrieval for Email ID {email_id}: {rag_stats['used']}/{rag_stats['candidates']} emails, "
+                f"~{rag_stats['tokens']} tokens, {retrieval_ms:.1f} ms"
+            )
+        except Exception as e_rag:
+            # Ohne Kontext weitermachen (z.B. Qdrant nicht erreichbar, Modell nicht geladen)
+            logger.warning(f"[TASK] RAG retrieval failed for Email ID {email_id}, continuing without context: {e_rag}", exc_info=True)
 
         # Fetch user's knowledge fields
         knowledge_context = {}
@@ -673,13 +499,25 @@ def generate_ai_suggestion(self, email_id: int, triggering_user_id: int):
         # [LOGIC] 4. Call the correct AI API function
         logger.info(f"[TASK Step 3/4] Calling {prompt_details['provider']} API ({prompt_details['model_name']}) for Email ID {email.id}")
         # Use the central call_ai_api function
-        api_response_str = async_to_sync(call_ai_api)(
+        llm_start_time = time.time()
+        # Deltas werden während der Generierung als 'suggestion.delta' an den Browser gestreamt
+        delta_relay = SuggestionDeltaRelay(user.id, email.id, kind='generate') if STREAM_SUGGESTIONS else None
+        api_response_str = run_on_client_loop(
+            stream_ai_call,
+            delta_relay,
             prompt=formatted_prompt, 
             user=user, 
             provider=prompt_details['provider'], 
             model_name=prompt_details['model_name'],
-            triggering_source='generate_suggestions_task'
+            triggering_source='generate_suggestions_task',
+            cache_options=response_cache_options(prompt_details),
+            # Massenläufe (queue_ai_suggestions) warten im Worker auf den Rate-Limiter statt 429s zu sammeln
+            rate_limit_deadline=RATE_LIMIT_TASK_DEADLINE,
         )
+        llm_ms = (time.time() - llm_start_time) * 1000
+        retrieval_info = f"{retrieval_ms:.1f} ms" if retrieval_ms is not None else "n/a"
+        first_token_info = f"{delta_relay.first_delta_ms:.1f} ms" if delta_relay and delta_relay.first_delta_ms is not None else "n/a"
+        logger.info(f"[TASK] Latency for Email ID {email.id}: retrieval {retrieval_info}, first token {first_token_info}, LLM {llm_ms:.1f} ms")
         # --> Punkt 6: Verarbeite Antwort
 
         # --- Log the raw response string for debugging ---
@@ -939,7 +777,7 @@ def generate_embeddings_for_email(self, email_id: int):
     email = None # Initialize email
     try:
         # Lade E-Mail mit zugehörigen Anhängen
-        email = Email.objects.prefetch_related('attachments').select_related('account').get(id=email_id)
+        email = Email.objects.prefetch_related('to_contacts', 'cc_contacts', 'bcc_contacts', 'attachments').select_related('account').get(id=email_id)
         logger.info(f"Starte Embedding-Generierung für Email ID {email_id} (Betreff: {email.subject[:50]}...)")
 
         # 1. Embeddings generieren und in Qdrant speichern
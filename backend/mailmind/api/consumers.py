@@ -82,6 +82,13 @@ class SuggestionConsumer(AsyncWebsocketConsumer):
         logger.info(f"SuggestionConsumer sending FULL suggestions.updated event to user {self.user.id} for email {email_id}.")
         await self.send(text_data=json.dumps(message_to_send)) 
 
+    async def suggestion_delta(self, event):
+        """Streamed LLM text deltas (coalesced, see mailmind.ai.streaming); forwarded without DB access."""
+        await self.send(text_data=json.dumps({
+            'type': 'suggestion.delta',
+            'data': event.get('data', {})
+        }))
+
 class LeadConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         try:
@@ -0,0 +1,124 @@
+"""
+Keyset-(Cursor-)Pagination für die E-Mail-Liste.
+
+Statt OFFSET wird die Position der letzten E-Mail (sent_at, received_at, id) im Cursor
+mitgegeben; die nächste Seite beginnt per WHERE direkt dahinter und nutzt die partiellen Indizes
+email_open_inbox_idx / email_open_inbox_folder_idx. Sortierung wie bisher absteigend, NULLs zuerst (Postgres-Default bei DESC).
+Eine Gesamtzahl gibt es nur auf Wunsch (?count=approx) als Schätzung des Query-Planers.
+"""
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_count(queryset) -> Optional[int]:
+    """Geschätzte Zeilenzahl laut EXPLAIN statt COUNT(*) (nur PostgreSQL)."""
+    try:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.warning(f"Could not estimate row count: {e}")
+        return None
+
+
+class EmailKeysetPagination(BasePagination):
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-sent_at', '-received_at', '-id')
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, email) -> str:
+        position = [
+            email.sent_at.isoformat() if email.sent_at else None,
+            email.received_at.isoformat() if email.received_at else None,
+            email.id,
+        ]
+        return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            sent_at, received_at, email_id = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            return (
+                datetime.fromisoformat(sent_at) if sent_at else None,
+                datetime.fromisoformat(received_at) if received_at else None,
+                int(email_id),
+            )
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound('Invalid cursor')
+
+    @staticmethod
+    def _after_desc(field: str, value):
+        """(nach, gleich)-Bedingungen für eine absteigend sortierte Spalte mit NULLs zuerst."""
+        if value is None:
+            return Q(**{f'{field}__isnull': False}), Q(**{f'{field}__isnull': True})
+        return Q(**{f'{field}__lt': value}), Q(**{field: value})
+
+    def keyset_filter(self, position) -> Q:
+        sent_at, received_at, email_id = position
+        sent_after, sent_equal = self._after_desc('sent_at', sent_at)
+        received_after, received_equal = self._after_desc('received_at', received_at)
+        condition = sent_after | (sent_equal & (received_after | (received_equal & Q(id__lt=email_id))))
+        if sent_at is not None:
+            # Redundante Bereichsbedingung, damit Postgres den Index ab der Cursor-Position scannt
+            condition &= Q(sent_at__lte=sent_at)
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.count = estimate_count(queryset) if request.query_params.get(self.count_query_param) == 'approx' else None
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position))
+
+        rows = list(queryset[:page_size + 1]) # Eine Zeile mehr, um das Ende ohne COUNT zu erkennen
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_cursor = self.encode_cursor(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        payload = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            payload['count_estimate'] = self.count
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count_estimate': {'type': 'integer'},
+                'results': schema,
+            },
+        }
@@ -14,6 +14,8 @@ from mailmind.ai.correct_text_task import correct_text_with_ai
 from mailmind.ai.refine_suggestion_task import refine_suggestion_task
 from mailmind.ai.embedding_tasks import generate_embeddings_for_email
 from mailmind.ai.clients import get_qdrant_client, get_gemini_model
+from mailmind.ai.provider_clients import closing_async_to_sync
+from mailmind.ai.search import hybrid_search_emails
 from qdrant_client import models as qdrant_models
 from qdrant_client.http import models as rest_models
 from .serializers import (
@@ -36,6 +38,7 @@ from apps.users.tasks import run_initial_sync_for_account_v2
 from mailmind.imap.actions import move_email
 from channels.layers import get_channel_layer
 from .models import Draft
+from .pagination import EmailKeysetPagination
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +71,8 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
     Provides filtering by 'is_replied', 'is_read', 'is_flagged'
     and ordering by 'sent_at' or 'received_at'.
     Only shows emails belonging to the accounts of the currently authenticated user.
-    Supports Limit/Offset pagination.
+    Supports page number pagination (default) and keyset pagination via
+    ?pagination=cursor (follow 'next'; optional ?count=approx for an estimated total).
     """
     serializer_class = EmailSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -79,6 +83,15 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
     # Add pagination class
     pagination_class = StandardResultsSetPagination
 
+    @property
+    def paginator(self):
+        """Keyset-Pagination für die Liste, wenn ?pagination=cursor oder ein Cursor übergeben wird."""
+        if not hasattr(self, '_paginator') and self.action == 'list':
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or EmailKeysetPagination.cursor_query_param in params:
+                self._paginator = EmailKeysetPagination()
+        return super().paginator
+
     def get_serializer_class(self):
         """Gibt den passenden Serializer je nach Aktion zurück."""
         if self.action == 'list':
@@ -101,7 +114,7 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
         )
 
         # Apply select_related/prefetch_related only for non-list actions (like retrieve)
-        if self.action != 'list':
+        if self.action not in ('list', 'search'):
             logger.debug(f"[EmailViewSet] Applying prefetch/select related for action '{self.action}'")
             queryset = queryset.select_related(
                 'account', 'from_contact'
@@ -112,8 +125,6 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
              # Minimal prefetch for list view if using ContactSimpleSerializer later
              # queryset = queryset.select_related('from_contact')
              pass # Currently only needs fields from Email model itself
-        
-        logger.debug(f"[EmailViewSet] Base queryset count for user {user.email} (before action-specific optimization): {queryset.count()}") 
         return queryset
 
     def list(self, request, *args, **kwargs):
@@ -128,12 +139,13 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = self.get_queryset()
             # Apply filters defined in filter_backends
             filtered_queryset = self.filter_queryset(queryset)
-            logger.info(f"[EmailViewSet] Filtered queryset count: {filtered_queryset.count()}")
 
             # Optimize DB query for list view *after* filtering
             logger.debug("[EmailViewSet] Applying .only() for list view optimization.")
+            # Alle Felder des EmailListSerializer, sonst lädt jedes Objekt deferred Felder einzeln nach
             optimized_queryset = filtered_queryset.only(
-                'id', 'subject', 'from_address', 'sent_at', 'is_read', 'is_flagged', 'account_id'
+                'id', 'subject', 'short_summary', 'from_address', 'from_name', 'sent_at', 'received_at',
+                'is_read', 'is_flagged', 'account_id'
             )
 
             logger.debug("[EmailViewSet] Applying pagination...")
@@ -163,6 +175,37 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
         finally:
             logger.info(f"[EmailViewSet] List method finished for user: {request.user.email}")
 
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """Hybride Suche (Volltext + semantisch, per RRF fusioniert) über die E-Mails des Users.
+           Query-Parameter: q (Suchtext), limit (max. 50); die Filter der Listenansicht gelten ebenfalls."""
+        query_text = (request.query_params.get('q') or '').strip()
+        if not query_text:
+            return Response({'error': "Query parameter 'q' is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), StandardResultsSetPagination.max_page_size)
+        except ValueError:
+            return Response({'error': "Query parameter 'limit' must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        search_result = hybrid_search_emails(queryset, query_text, user_id=request.user.id, limit=limit)
+        hits = search_result['results']
+
+        emails = queryset.filter(id__in=[hit['email_id'] for hit in hits]).only(
+            'id', 'subject', 'short_summary', 'from_address', 'from_name', 'sent_at', 'is_read', 'is_flagged', 'account_id'
+        ).in_bulk()
+        results = []
+        for hit in hits:
+            email = emails.get(hit['email_id'])
+            if email is None:
+                continue
+            data = EmailListSerializer(email).data
+            data['search_score'] = hit['score']
+            data['matched_by'] = hit['matched_by']
+            results.append(data)
+        logger.info(f"[EmailViewSet] Search by {request.user.email}: {len(results)} results in {search_result['timings']['total_ms']:.1f} ms")
+        return Response({'count': len(results), 'results': results, 'timings': search_result['timings']})
+
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """E-Mail als gelesen markieren."""
@@ -332,7 +375,7 @@ class AISuggestionViewSet(viewsets.ModelViewSet):
                 original_body_for_context = suggestion.content
 
             # Wenn selected_text gesetzt ist, erzwinge Snippet-Modus im Task
-            corrected_text_result = async_to_sync(correct_text_with_ai)(
+            corrected_text_result = closing_async_to_sync(correct_text_with_ai)(
                 text_to_correct, 
                 request.user,
                 original_subject=original_subject_for_context, 
@@ -109,6 +109,13 @@ class EmailConsumer(AsyncWebsocketConsumer):
             }
         })) 
 
+    async def suggestion_delta(self, event):
+        """Relays streamed LLM text deltas (coalesced, see mailmind.ai.streaming) to the client."""
+        await self.send(text_data=json.dumps({
+            'type': 'suggestion.delta',
+            'data': event.get('data', {})
+        }))
+
     # --- NEUER HANDLER für API Key Status ---
     async def api_key_status(self, event):
         """Handles the api_key_status message type from the channel layer."""
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from mailmind.ai import response_cache
+
+
+class Command(BaseCommand):
+    help = 'Shows hit/miss metrics of the AI response cache per prompt template, or clears the cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Delete all cached responses and metrics.')
+        parser.add_argument('--keep-stats', action='store_true', help='With --clear: keep the hit/miss metrics.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = response_cache.clear(keep_stats=options['keep_stats'])
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} AI response cache keys."))
+            return
+
+        stats = response_cache.get_stats()
+        if not stats:
+            self.stdout.write("No AI response cache metrics recorded yet.")
+            return
+        self.stdout.write(f"{'template':<32} {'exact':>8} {'semantic':>9} {'miss':>8} {'store':>8} {'hit rate':>9}")
+        for template, counts in sorted(stats.items()):
+            hits = counts.get('hit_exact', 0) + counts.get('hit_semantic', 0)
+            lookups = hits + counts.get('miss', 0)
+            hit_rate = f"{hits / lookups:.1%}" if lookups else "n/a"
+            self.stdout.write(
+                f"{template:<32} {counts.get('hit_exact', 0):>8} {counts.get('hit_semantic', 0):>9} "
+                f"{counts.get('miss', 0):>8} {counts.get('store', 0):>8} {hit_rate:>9}"
+            )
@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+# Gleicher Ausdruck wie im Trigger core_email_search_vector_trigger (Migration 0028)
+BACKFILL_SQL = """
+UPDATE core_email
+SET search_vector = core_email_build_search_vector(
+    subject, from_name, from_address, coalesce(nullif(markdown_body, ''), body_text)
+)
+WHERE id IN (
+    SELECT id FROM core_email
+    WHERE id > %s {missing_only}
+    ORDER BY id
+    LIMIT %s
+)
+RETURNING id
+"""
+
+class Command(BaseCommand):
+    help = 'Fills Email.search_vector for existing emails in keyset-paginated batches (one transaction per batch).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of emails updated per batch (default: 1000).')
+        parser.add_argument('--rebuild', action='store_true', help='Recompute all vectors, not only missing ones (e.g. after changing the configuration).')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Pause in seconds between batches to limit load.')
+
+    def handle(self, *args, **options):
+        sql = BACKFILL_SQL.format(missing_only='' if options['rebuild'] else 'AND search_vector IS NULL')
+        last_id = 0
+        updated = 0
+        start = time.monotonic()
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [last_id, options['batch_size']])
+                ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            last_id = max(ids)
+            updated += len(ids)
+            self.stdout.write(f"Updated {updated} email(s) (last id {last_id}).")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Search vectors filled for {updated} email(s) in {time.monotonic() - start:.1f}s."))
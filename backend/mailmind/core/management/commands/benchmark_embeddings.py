@@ -0,0 +1,100 @@
+import mailbox
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from mailmind.ai.chunking import chunk_email_text
+from mailmind.ai.clients import TEXT_MODEL_NAME
+from mailmind.ai.model_backends import INFERENCE_THREADS, load_text_model
+from mailmind.core.models import Email
+
+def _message_body(message) -> str:
+    parts = message.walk() if message.is_multipart() else [message]
+    texts = []
+    for part in parts:
+        if part.get_content_type() != 'text/plain':
+            continue
+        payload = part.get_payload(decode=True) or b''
+        texts.append(payload.decode(part.get_content_charset() or 'utf-8', errors='replace'))
+    return '\n'.join(texts)
+
+def _load_mbox(path: str, limit: int):
+    emails = []
+    for message in mailbox.mbox(path):
+        emails.append((str(message.get('Subject', '')), str(message.get('From', '')), _message_body(message)))
+        if len(emails) >= limit:
+            break
+    return emails
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class Command(BaseCommand):
+    help = 'Compares throughput, latency and retrieval recall of the torch and the quantized ONNX embedding backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mbox', type=str, default=None, help='Fixture mailbox (mbox file). Default: emails from the database.')
+        parser.add_argument('--limit', type=int, default=500, help='Maximum number of emails (default: 500).')
+        parser.add_argument('--batch-size', type=int, default=32, help='Batch size for the throughput run.')
+        parser.add_argument('--latency-samples', type=int, default=50, help='Number of single-text encodes for latency percentiles.')
+        parser.add_argument('--top-k', type=int, default=10, help='k for recall@k against the torch results.')
+        parser.add_argument('--threads', type=int, default=INFERENCE_THREADS, help='Inference threads for both backends.')
+
+    def handle(self, *args, **options):
+        if options['mbox']:
+            emails = _load_mbox(options['mbox'], options['limit'])
+        else:
+            emails = list(Email.objects.order_by('-id').values_list('subject', 'from_address', 'body_text')[:options['limit']])
+        if len(emails) < 2:
+            raise CommandError('Need at least two emails for the benchmark.')
+
+        backends = {}
+        for backend in ('torch', 'onnx'):
+            self.stdout.write(f"Loading '{TEXT_MODEL_NAME}' with backend '{backend}'...")
+            try:
+                backends[backend] = load_text_model(TEXT_MODEL_NAME, backend=backend, threads=options['threads'])
+            except Exception as e:
+                raise CommandError(f"Could not load backend '{backend}': {e}")
+
+        # Gleiche Chunks wie im Produktivpfad; Betreffzeilen dienen als Suchanfragen
+        corpus = [chunk['text'] for subject, sender, body in emails
+                  for chunk in chunk_email_text(subject, sender, body, model=backends['torch'])]
+        queries = [subject or (body or '')[:200] for subject, sender, body in emails]
+        self.stdout.write(f"{len(emails)} emails, {len(corpus)} chunks, {len(queries)} queries.")
+
+        results = {}
+        for backend, model in backends.items():
+            model.encode(corpus[:options['batch_size']], batch_size=options['batch_size']) # Warm-up
+
+            start = time.perf_counter()
+            corpus_vectors = model.encode(corpus, batch_size=options['batch_size'], convert_to_numpy=True)
+            throughput = len(corpus) / (time.perf_counter() - start)
+
+            latencies = []
+            for query in queries[:options['latency_samples']]:
+                start = time.perf_counter()
+                model.encode(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            results[backend] = {
+                'throughput': throughput,
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+                'corpus': _normalize(np.asarray(corpus_vectors, dtype=np.float32)),
+                'queries': _normalize(np.asarray(model.encode(queries, batch_size=options['batch_size']), dtype=np.float32)),
+            }
+
+        top_k = min(options['top_k'], len(corpus))
+        reference_top = np.argsort(-results['torch']['queries'] @ results['torch']['corpus'].T, axis=1)[:, :top_k]
+        candidate_top = np.argsort(-results['onnx']['queries'] @ results['onnx']['corpus'].T, axis=1)[:, :top_k]
+        recall = np.mean([len(set(ref) & set(cand)) / top_k for ref, cand in zip(reference_top, candidate_top)])
+        cosine = float(np.mean(np.sum(results['torch']['corpus'] * results['onnx']['corpus'], axis=1)))
+
+        self.stdout.write(f"{'backend':<8} {'texts/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for backend in ('torch', 'onnx'):
+            result = results[backend]
+            self.stdout.write(f"{backend:<8} {result['throughput']:>10.1f} {result['p50']:>8.2f} {result['p95']:>8.2f}")
+        self.stdout.write(self.style.SUCCESS(
+            f"ONNX vs torch: recall@{top_k} = {recall:.3f}, mean cosine(torch, onnx) = {cosine:.4f}, "
+            f"speedup = {results['onnx']['throughput'] / results['torch']['throughput']:.2f}x"
+        ))
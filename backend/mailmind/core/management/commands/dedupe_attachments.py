@@ -0,0 +1,107 @@
+import hashlib
+import logging
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from mailmind.core.models import Attachment, AttachmentBlob
+from mailmind.imap.store import get_or_create_attachment_blob, purge_attachment_spool
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def _hash_stored_file(field_file) -> str:
+    sha256 = hashlib.sha256()
+    with field_file.open('rb') as stored_file:
+        for chunk in iter(lambda: stored_file.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class Command(BaseCommand):
+    help = 'Moves existing attachment files into content-addressed storage (AttachmentBlob) and removes duplicate files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of attachments loaded per database query.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many files and bytes would be deduplicated.')
+        parser.add_argument(
+            '--purge-spool-hours',
+            type=int,
+            default=None,
+            help='Additionally delete spooled attachment files older than this many hours.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        queryset = Attachment.objects.filter(blob__isnull=True).exclude(file='').order_by('pk')
+        self.stdout.write(f"Checking {queryset.count()} attachment(s) without content-addressed storage...")
+
+        linked_count = 0
+        duplicate_count = 0
+        saved_bytes = 0
+        failed_count = 0
+        seen_hashes = set()
+
+        for attachment in queryset.iterator(chunk_size=options['batch_size']):
+            try:
+                sha256 = _hash_stored_file(attachment.file)
+            except Exception as e:
+                failed_count += 1
+                logger.warning(f"Could not read attachment file {attachment.file.name} (attachment {attachment.id}): {e}")
+                continue
+
+            if dry_run:
+                if sha256 in seen_hashes or AttachmentBlob.objects.filter(sha256=sha256).exists():
+                    duplicate_count += 1
+                    saved_bytes += attachment.size
+                seen_hashes.add(sha256)
+                continue
+
+            try:
+                # Verschiebt die Datei an den Blob-Pfad bzw. löscht sie, wenn der Inhalt schon existiert
+                blob, blob_created = get_or_create_attachment_blob(sha256, attachment.size, storage_key=attachment.file.name)
+                Attachment.objects.filter(pk=attachment.pk).update(blob=blob, file=blob.file.name)
+                linked_count += 1
+                if not blob_created:
+                    duplicate_count += 1
+                    saved_bytes += attachment.size
+            except Exception as e:
+                failed_count += 1
+                logger.error(f"Error deduplicating attachment {attachment.id} ({attachment.file.name}): {e}", exc_info=True)
+
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f"Dry run: {duplicate_count} duplicate file(s), {saved_bytes / (1024 * 1024):.1f} MB could be freed."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Linked {linked_count} attachment(s); removed {duplicate_count} duplicate file(s), freed {saved_bytes / (1024 * 1024):.1f} MB."
+            ))
+            self._fix_reference_counts()
+
+        if failed_count:
+            self.stdout.write(self.style.WARNING(f"{failed_count} attachment(s) could not be processed (see log)."))
+
+        if options['purge_spool_hours'] is not None and not dry_run:
+            purged_count = purge_attachment_spool(max_age_seconds=options['purge_spool_hours'] * 60 * 60)
+            self.stdout.write(f"Purged {purged_count} stale spooled attachment file(s).")
+
+    def _fix_reference_counts(self):
+        """Setzt ref_count auf die tatsächliche Anzahl referenzierender Attachments und entfernt verwaiste Blobs."""
+        fixed_count = 0
+        orphaned_count = 0
+        # Frische Blobs auslassen: ein laufender Save-Task legt das Attachment erst nach dem Blob an
+        orphan_cutoff = timezone.now() - timedelta(hours=1)
+        blobs = AttachmentBlob.objects.annotate(actual_refs=Count('attachments'))
+        for blob in blobs.iterator():
+            if blob.actual_refs == 0:
+                if blob.created_at > orphan_cutoff:
+                    continue
+                blob.file.delete(save=False)
+                blob.delete()
+                orphaned_count += 1
+            elif blob.ref_count != blob.actual_refs:
+                AttachmentBlob.objects.filter(pk=blob.pk).update(ref_count=blob.actual_refs)
+                fixed_count += 1
+        if fixed_count or orphaned_count:
+            self.stdout.write(f"Corrected {fixed_count} blob reference count(s), removed {orphaned_count} orphaned blob(s).")
@@ -0,0 +1,95 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from mailmind.core.models import AISuggestion, Email
+
+logger = logging.getLogger(__name__)
+
+# Felder, die beim Zusammenführen auf die behaltene Zeile übernommen werden, falls sie dort leer sind
+MERGE_FIELDS = ('short_summary', 'medium_summary', 'markdown_body', 'body_text', 'body_html', 'ai_processed_at')
+
+def _richness(email):
+    """Sortierschlüssel: die Zeile mit AI-Daten, Zusammenfassungen und Inhalt bleibt erhalten."""
+    return (
+        email.ai_processed,
+        email.suggestion_count > 0,
+        bool(email.short_summary) + bool(email.medium_summary),
+        bool(email.markdown_body or email.body_text),
+        email.attachment_count,
+        email.embedding_generated,
+        -email.id, # bei Gleichstand die älteste Zeile
+    )
+
+def _delete_vector_points(email_ids):
+    """Entfernt die Qdrant-Punkte (E-Mail-Chunks und Anhänge) der gelöschten Duplikate."""
+    from qdrant_client.http import models as rest_models
+    from mailmind.ai.clients import get_qdrant_client
+
+    client = get_qdrant_client()
+    if not client:
+        raise RuntimeError("Qdrant client not available.")
+    for collection_name, key in (('email_embeddings', 'email_id'), ('attachment_embeddings', 'parent_email_id')):
+        selector = rest_models.FilterSelector(filter=rest_models.Filter(must=[
+            rest_models.FieldCondition(key=key, match=rest_models.MatchAny(any=list(email_ids))),
+        ]))
+        client.delete(collection_name=collection_name, points_selector=selector, wait=True)
+
+class Command(BaseCommand):
+    help = ('Removes duplicate emails with the same (account, folder_name, uid) left by sync races. '
+            'Keeps the richest row, merges missing summaries/bodies and suggestions into it and deletes the '
+            'others through the ORM (attachment files, blob references and vector points are cleaned up). '
+            'Must be run before migration core.0030.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the duplicate groups.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        groups = list(
+            Email.objects.exclude(uid__isnull=True).exclude(folder_name__isnull=True)
+            .values('account_id', 'folder_name', 'uid')
+            .annotate(copies=Count('id'))
+            .filter(copies__gt=1)
+            .order_by()
+        )
+        self.stdout.write(f"Found {len(groups)} duplicate (account, folder, uid) group(s).")
+        if dry_run or not groups:
+            return
+
+        removed_ids = []
+        for group in groups:
+            emails = list(
+                Email.objects.filter(account_id=group['account_id'], folder_name=group['folder_name'], uid=group['uid'])
+                .annotate(suggestion_count=Count('suggestions', distinct=True), attachment_count=Count('attachments', distinct=True))
+            )
+            emails.sort(key=_richness, reverse=True)
+            keeper, duplicates = emails[0], emails[1:]
+            dup_ids = [email.pk for email in duplicates] # vor delete() merken, danach ist pk None
+            with transaction.atomic():
+                changed_fields = []
+                for field in MERGE_FIELDS:
+                    if not getattr(keeper, field):
+                        value = next((getattr(email, field) for email in duplicates if getattr(email, field)), None)
+                        if value:
+                            setattr(keeper, field, value)
+                            changed_fields.append(field)
+                if changed_fields:
+                    keeper.save(update_fields=changed_fields)
+                if keeper.suggestion_count == 0:
+                    donor = next((email for email in duplicates if email.suggestion_count), None)
+                    if donor:
+                        AISuggestion.objects.filter(email=donor).update(email=keeper)
+                        if not keeper.ai_processed:
+                            Email.objects.filter(pk=keeper.pk).update(ai_processed=True)
+                for email in duplicates:
+                    # Instanz-delete(): post_delete der Anhänge gibt Dateien/Blob-Referenzen frei
+                    email.delete()
+            removed_ids.extend(dup_ids)
+            logger.info(f"Kept email {keeper.id} for account {group['account_id']} / '{group['folder_name']}' / UID {group['uid']}, removed {dup_ids}.")
+
+        try:
+            _delete_vector_points(removed_ids)
+        except Exception as e:
+            self.stderr.write(self.style.WARNING(f"Could not delete vector points of removed emails {removed_ids}: {e}"))
+        self.stdout.write(self.style.SUCCESS(f"Removed {len(removed_ids)} duplicate email row(s)."))
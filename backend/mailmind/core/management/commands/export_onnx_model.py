@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from mailmind.ai.clients import TEXT_MODEL_NAME
+from mailmind.ai.model_backends import ONNX_QUANTIZATION, export_quantized_onnx_model
+
+class Command(BaseCommand):
+    help = 'Exports the text embedding model to ONNX with int8 dynamic quantization (for AI_TEXT_MODEL_BACKEND=onnx)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', type=str, default=TEXT_MODEL_NAME, help=f'Model to export (default: {TEXT_MODEL_NAME}).')
+        parser.add_argument(
+            '--quantization',
+            choices=['arm64', 'avx2', 'avx512', 'avx512_vnni'],
+            default=ONNX_QUANTIZATION,
+            help=f'Target CPU instruction set for the quantized kernels (default: {ONNX_QUANTIZATION}).',
+        )
+        parser.add_argument('--output-dir', type=str, default=None, help='Target directory (default: AI_ONNX_MODEL_DIR / model cache).')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Exporting '{options['model']}' to ONNX ({options['quantization']} int8)...")
+        try:
+            model_file = export_quantized_onnx_model(options['model'], options['output_dir'], options['quantization'])
+        except ImportError as e:
+            raise CommandError(f"ONNX export requires optimum[onnxruntime]: {e}")
+        self.stdout.write(self.style.SUCCESS(f'Successfully exported quantized model to {model_file}'))
@@ -0,0 +1,54 @@
+import logging
+import os
+import signal
+import threading
+from django.core.management.base import BaseCommand
+
+from mailmind.ai.clients import TEXT_MODEL_NAME, get_text_model
+from mailmind.ai.embedding_server import create_embedding_server
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Runs the local embedding server that loads the text model once and batches requests from all workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='Bind address for HTTP (default: 127.0.0.1).')
+        parser.add_argument('--port', type=int, default=8765, help='HTTP port (default: 8765).')
+        parser.add_argument('--socket', type=str, default=None, help='Listen on this Unix socket instead of TCP.')
+        parser.add_argument('--max-batch-size', type=int, default=64, help='Maximum number of texts per model batch.')
+        parser.add_argument('--max-latency-ms', type=float, default=10.0, help='Maximum time to wait for more requests before encoding a batch.')
+
+    def handle(self, *args, **options):
+        # Der Server selbst lädt immer das lokale Modell
+        os.environ['LOAD_AI_MODELS'] = 'true'
+        model = get_text_model(use_server=False)
+
+        server = create_embedding_server(
+            model,
+            TEXT_MODEL_NAME,
+            host=options['host'],
+            port=options['port'],
+            socket_path=options['socket'],
+            max_batch_size=options['max_batch_size'],
+            max_latency_ms=options['max_latency_ms'],
+        )
+        address = f"unix://{options['socket']}" if options['socket'] else f"http://{options['host']}:{options['port']}"
+
+        def shutdown(signum, frame):
+            # shutdown() blockiert bis serve_forever() endet, daher aus einem anderen Thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        self.stdout.write(f"Embedding server for '{TEXT_MODEL_NAME}' listening on {address} "
+                          f"(batch <= {options['max_batch_size']}, latency <= {options['max_latency_ms']} ms)...")
+        try:
+            server.serve_forever()
+        finally:
+            server.batcher.stop()
+            server.server_close()
+            if options['socket'] and os.path.exists(options['socket']):
+                os.unlink(options['socket'])
+        self.stdout.write(self.style.SUCCESS("Embedding server stopped."))
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import signal
+from django.core.management.base import BaseCommand
+
+from mailmind.imap import idle_manager
+from mailmind.imap.idle_sharding import IdleShardCoordinator
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Runs an IMAP IDLE worker that monitors its consistent-hash shard of the active email accounts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--worker-id',
+            type=str,
+            default=None,
+            help='Stable worker id (default: hostname:pid:random). A stable id keeps the shard assignment across restarts.',
+        )
+
+    def handle(self, *args, **options):
+        coordinator = IdleShardCoordinator(worker_id=options['worker_id'])
+        self.stdout.write(f"Starting IDLE worker '{coordinator.worker_id}'...")
+
+        async def run_worker():
+            loop = asyncio.get_running_loop()
+            # Sauber beenden: Leases freigeben, damit andere Worker sofort übernehmen können
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, idle_manager.stop_idle_manager)
+                except NotImplementedError:
+                    pass
+            await idle_manager.manage_idle_connections(shard_coordinator=coordinator)
+
+        asyncio.run(run_worker())
+        self.stdout.write(self.style.SUCCESS(f"IDLE worker '{coordinator.worker_id}' stopped."))
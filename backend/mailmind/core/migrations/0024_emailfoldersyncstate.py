@@ -0,0 +1,74 @@
+# Generated by Django 4.2.20 on 2025-05-12 09:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0023_aisuggestionedithistory"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailFolderSyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("folder_name", models.CharField(max_length=255)),
+                (
+                    "uid_validity",
+                    models.BigIntegerField(
+                        blank=True,
+                        help_text="UIDVALIDITY des Ordners beim letzten Sync",
+                        null=True,
+                    ),
+                ),
+                (
+                    "highest_uid",
+                    models.BigIntegerField(
+                        default=0, help_text="Höchste vollständig verarbeitete UID"
+                    ),
+                ),
+                (
+                    "highest_modseq",
+                    models.BigIntegerField(
+                        blank=True,
+                        help_text="HIGHESTMODSEQ beim letzten Sync (CONDSTORE)",
+                        null=True,
+                    ),
+                ),
+                (
+                    "message_count",
+                    models.PositiveIntegerField(
+                        blank=True,
+                        help_text="MESSAGES laut STATUS beim letzten Sync",
+                        null=True,
+                    ),
+                ),
+                ("last_full_sync_at", models.DateTimeField(blank=True, null=True)),
+                ("last_synced_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="folder_sync_states",
+                        to="core.emailaccount",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Email Folder Sync State",
+                "verbose_name_plural": "Email Folder Sync States",
+                "unique_together": {("account", "folder_name")},
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.20 on 2025-05-13 08:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+import mailmind.core.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0024_emailfoldersyncstate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AttachmentBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                (
+                    "file",
+                    models.FileField(
+                        max_length=255,
+                        upload_to=mailmind.core.models.attachment_blob_upload_path,
+                    ),
+                ),
+                ("size", models.BigIntegerField(default=0)),
+                (
+                    "ref_count",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Anzahl der Attachments, die diese Datei referenzieren",
+                    ),
+                ),
+                ("extracted_text", models.TextField(blank=True)),
+                (
+                    "embedding_vector",
+                    models.BinaryField(
+                        blank=True,
+                        help_text="float32-Embedding des Inhalts (Wiederverwendung)",
+                        null=True,
+                    ),
+                ),
+                ("analyzed_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Attachment Blob",
+                "verbose_name_plural": "Attachment Blobs",
+            },
+        ),
+        migrations.AddField(
+            model_name="attachment",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="attachments",
+                to="core.attachmentblob",
+            ),
+        ),
+    ]
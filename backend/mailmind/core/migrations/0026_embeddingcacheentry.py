@@ -0,0 +1,40 @@
+# Generated by Django 4.2.20 on 2025-05-14 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0025_attachmentblob_attachment_blob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingCacheEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_name", models.CharField(max_length=200)),
+                ("text_hash", models.CharField(max_length=64)),
+                (
+                    "vector",
+                    models.BinaryField(help_text="float16-Vektor (numpy tobytes)"),
+                ),
+                ("dimensions", models.PositiveSmallIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Embedding Cache Entry",
+                "verbose_name_plural": "Embedding Cache Entries",
+                "unique_together": {("model_name", "text_hash")},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2025-05-15 07:36
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0026_embeddingcacheentry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="email",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.search.SearchVector(
+                    "subject",
+                    "from_name",
+                    "from_address",
+                    "markdown_body",
+                    config="simple",
+                ),
+                name="email_search_vector_gin",
+            ),
+        ),
+    ]
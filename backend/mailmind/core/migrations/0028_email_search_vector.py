@@ -0,0 +1,78 @@
+# Generated by Django 4.2.20 on 2025-05-16 09:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Body wird gekürzt, da ein tsvector höchstens 1 MB groß sein darf
+BUILD_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION core_email_build_search_vector(subject text, from_name text, from_address text, body text)
+RETURNS tsvector LANGUAGE sql IMMUTABLE AS $$
+    SELECT setweight(to_tsvector('german', coalesce(subject, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(subject, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(from_name, '') || ' ' || coalesce(from_address, '')), 'B')
+        || setweight(to_tsvector('german', left(coalesce(body, ''), 100000)), 'C')
+        || setweight(to_tsvector('english', left(coalesce(body, ''), 100000)), 'C')
+$$;
+"""
+
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION core_email_search_vector_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT'
+       OR NEW.subject IS DISTINCT FROM OLD.subject
+       OR NEW.from_name IS DISTINCT FROM OLD.from_name
+       OR NEW.from_address IS DISTINCT FROM OLD.from_address
+       OR NEW.body_text IS DISTINCT FROM OLD.body_text
+       OR NEW.markdown_body IS DISTINCT FROM OLD.markdown_body THEN
+        NEW.search_vector := core_email_build_search_vector(
+            NEW.subject, NEW.from_name, NEW.from_address, coalesce(nullif(NEW.markdown_body, ''), NEW.body_text)
+        );
+    ELSIF NEW.search_vector IS NULL THEN
+        -- Model.save() schreibt alle Spalten, auch ein search_vector=None der Python-Instanz
+        NEW.search_vector := OLD.search_vector;
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS core_email_search_vector_update ON core_email;
+CREATE TRIGGER core_email_search_vector_update
+    BEFORE INSERT OR UPDATE ON core_email
+    FOR EACH ROW EXECUTE FUNCTION core_email_search_vector_trigger();
+"""
+
+DROP_SQL = """
+DROP TRIGGER IF EXISTS core_email_search_vector_update ON core_email;
+DROP FUNCTION IF EXISTS core_email_search_vector_trigger();
+DROP FUNCTION IF EXISTS core_email_build_search_vector(text, text, text, text);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0027_email_email_search_vector_gin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="email",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, editable=False, help_text="Volltext-Index, per DB-Trigger gepflegt", null=True
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="email",
+            name="email_search_vector_gin",
+        ),
+        migrations.AddIndex(
+            model_name="email",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="email_search_vector_idx"
+            ),
+        ),
+        # Bestehende Zeilen füllt `manage.py backfill_search_vectors` in Batches
+        migrations.RunSQL(BUILD_FUNCTION_SQL + TRIGGER_SQL, reverse_sql=DROP_SQL),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2025-05-16 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0028_email_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="email",
+            index=models.Index(
+                fields=[
+                    "account",
+                    "is_replied",
+                    "is_deleted_on_server",
+                    "is_draft",
+                    "-sent_at",
+                    "-received_at",
+                    "-id",
+                ],
+                name="email_inbox_keyset_idx",
+            ),
+        ),
+    ]
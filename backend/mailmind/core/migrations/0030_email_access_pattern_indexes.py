@@ -0,0 +1,164 @@
+# Generated by Django 4.2.20 on 2025-05-17 10:41
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+# Ausführungspläne der typischen E-Mail-Abfragen vor und nach der Migration (EXPLAIN ohne ANALYZE)
+_plans_before = {}
+
+
+def _sample_queries(apps):
+    Email = apps.get_model("core", "Email")
+    sample = (
+        Email.objects.exclude(uid__isnull=True).exclude(folder_name__isnull=True)
+        .values("account_id", "account__user_id", "folder_name", "uid").order_by("-id").first()
+    )
+    if sample is None:
+        return {}
+    open_inbox = Email.objects.filter(
+        account__user_id=sample["account__user_id"], is_replied=False, is_deleted_on_server=False, is_draft=False
+    ).order_by("-sent_at", "-received_at", "-id")
+    return {
+        "sync lookup (account, folder, uid)": Email.objects.filter(
+            account_id=sample["account_id"], folder_name=sample["folder_name"], uid=sample["uid"]
+        ),
+        "deleted-on-server sync": Email.objects.filter(
+            account_id=sample["account_id"], folder_name=sample["folder_name"], is_deleted_on_server=False
+        ).values_list("uid", flat=True),
+        "open inbox list": open_inbox[:30],
+        "open inbox list (folder)": open_inbox.filter(folder_name=sample["folder_name"])[:30],
+    }
+
+
+def _explain_all(apps):
+    try:
+        return {label: queryset.explain() for label, queryset in _sample_queries(apps).items()}
+    except Exception as e:
+        logger.info(f"Query plan report skipped: {e}")
+        return {}
+
+
+def capture_plans_before(apps, schema_editor):
+    _plans_before.clear()
+    _plans_before.update(_explain_all(apps))
+
+
+def report_plans(apps, schema_editor):
+    # Nur ins Log (Logger 'mailmind.core.migrations...'), nicht auf stdout von migrate
+    plans_after = _explain_all(apps)
+    for label, plan_after in plans_after.items():
+        logger.info(f"Query plan '{label}'\n  before:\n    {_plans_before.get(label, '(n/a)')}\n  after:\n    {plan_after}")
+
+
+def check_no_duplicate_emails(apps, schema_editor):
+    """Der Unique-Constraint braucht eindeutige (account, folder_name, uid)-Zeilen.
+
+    Duplikate werden hier bewusst nicht gelöscht: historische Modelle lösen keine post_delete-Handler
+    aus (Anhang-Dateien, Blob-Referenzen, Qdrant-Punkte) und könnten die Zeile mit den AI-Daten
+    verwerfen. Das erledigt `manage.py dedupe_emails` vor dieser Migration.
+    """
+    Email = apps.get_model("core", "Email")
+    duplicate_groups = (
+        Email.objects.exclude(uid__isnull=True).exclude(folder_name__isnull=True)
+        .values("account_id", "folder_name", "uid")
+        .annotate(copies=Count("id"))
+        .filter(copies__gt=1)
+        .count()
+    )
+    if duplicate_groups:
+        raise RuntimeError(
+            f"{duplicate_groups} duplicate (account, folder_name, uid) email group(s) found. "
+            "Run `python manage.py dedupe_emails` and then migrate again."
+        )
+
+
+OPEN_INBOX_CONDITION = models.Q(is_deleted_on_server=False, is_draft=False, is_replied=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0029_email_email_inbox_keyset_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(capture_plans_before, migrations.RunPython.noop),
+        migrations.RunPython(check_no_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="email",
+            constraint=models.UniqueConstraint(
+                fields=("account", "folder_name", "uid"), name="email_account_folder_uid_uniq"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="email",
+            index=models.Index(
+                condition=OPEN_INBOX_CONDITION,
+                fields=["account", "-sent_at", "-received_at", "-id"],
+                name="email_open_inbox_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="email",
+            index=models.Index(
+                condition=OPEN_INBOX_CONDITION,
+                fields=["account", "folder_name", "-sent_at", "-received_at", "-id"],
+                name="email_open_inbox_folder_idx",
+            ),
+        ),
+        # Ersetzt durch die partiellen Posteingangs-Indizes
+        migrations.RemoveIndex(model_name="email", name="email_inbox_keyset_idx"),
+        # Einzelspalten-Indizes ohne passende Abfragen bzw. doppelt zu db_index
+        migrations.RemoveIndex(model_name="email", name="core_email_message_6cd15a_idx"),
+        migrations.RemoveIndex(model_name="email", name="core_email_uid_b91403_idx"),
+        migrations.RemoveIndex(model_name="email", name="core_email_folder__122283_idx"),
+        migrations.RemoveIndex(model_name="email", name="core_email_convers_541551_idx"),
+        migrations.RemoveIndex(model_name="email", name="core_email_is_read_a62cc2_idx"),
+        migrations.RemoveIndex(model_name="email", name="core_email_is_flag_654851_idx"),
+        migrations.RemoveIndex(model_name="email", name="core_email_is_repl_9e9fef_idx"),
+        migrations.AlterField(
+            model_name="email",
+            name="uid",
+            field=models.CharField(blank=True, help_text="UID des E-Mails im IMAP-Ordner", max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name="email",
+            name="folder_name",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name="email",
+            name="flags",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name="email",
+            name="is_read",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="email",
+            name="is_flagged",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="email",
+            name="is_replied",
+            field=models.BooleanField(default=False, help_text="Entspricht \\Answered Flag"),
+        ),
+        migrations.AlterField(
+            model_name="email",
+            name="is_deleted_on_server",
+            field=models.BooleanField(default=False, help_text="Entspricht \\Deleted Flag"),
+        ),
+        migrations.AlterField(
+            model_name="email",
+            name="is_draft",
+            field=models.BooleanField(default=False, help_text="Entspricht \\Draft Flag"),
+        ),
+        migrations.RunPython(report_plans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.20 on 2025-05-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0030_email_access_pattern_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachmentblob",
+            name="embedding_model_key",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Modell/Backend, mit dem embedding_vector berechnet wurde (EMBEDDING_MODEL_KEY)",
+                max_length=255,
+            ),
+            preserve_default=False,
+        ),
+    ]
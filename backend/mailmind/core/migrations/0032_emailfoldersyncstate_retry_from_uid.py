@@ -0,0 +1,22 @@
+# Generated by Django 4.2.20 on 2025-05-19 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0031_attachmentblob_embedding_model_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailfoldersyncstate",
+            name="retry_from_uid",
+            field=models.BigIntegerField(
+                blank=True,
+                help_text="Kleinste UID, deren Speichern fehlgeschlagen ist; der nächste Sync holt ab hier erneut",
+                null=True,
+            ),
+        ),
+    ]
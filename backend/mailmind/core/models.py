@@ -4,6 +4,7 @@ from django.core.validators import EmailValidator
 from django.utils.translation import gettext_lazy as _
 from django.utils.crypto import get_random_string
 import uuid
+import array
 from django.utils import timezone
 from datetime import timedelta
 from django.db.models import JSONField
@@ -17,6 +18,8 @@ from cryptography.fernet import Fernet, InvalidToken
 import base64
 import hashlib # Import hashlib
 from django.contrib.postgres.fields import ArrayField # Use ArrayField if using PostgreSQL
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from mailmind.prompt_templates.models import PromptTemplate
 
 logger = logging.getLogger(__name__)
@@ -266,13 +269,31 @@ def delete_account_attachment_folder(sender, instance, **kwargs):
     except Exception as e:
         logger.error(f"Error deleting attachment folder for account {instance.id} at {account_folder_path}: {e}")
 
+# Volltextsuche: search_vector wird per DB-Trigger gepflegt (Migration 0028) und enthält Betreff und Body
+# deutsch und englisch gestemmt sowie Absender unverändert ('simple'); Suchanfragen werden deshalb
+# mit allen drei Konfigurationen gestellt und per OR verknüpft.
+EMAIL_SEARCH_CONFIGS = ('german', 'english', 'simple')
+
+# Prädikat der E-Mail-Liste (EmailViewSet.get_queryset), Bedingung der partiellen Posteingangs-Indizes
+OPEN_INBOX_CONDITION = models.Q(is_replied=False, is_deleted_on_server=False, is_draft=False)
+
+class EmailManager(models.Manager):
+    """Standard-Manager für Email: search_vector gehört dem Trigger und wird nie mitgeladen.
+
+    Filter und SearchRank auf search_vector funktionieren trotzdem (ai/search.py), nur die Spalte
+    selbst landet nicht im SELECT.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
 class Email(models.Model):
     """Repräsentiert eine einzelne E-Mail."""
     
     account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE, related_name='emails')
     message_id = models.CharField(max_length=255, db_index=True)
-    uid = models.CharField(max_length=255, null=True, blank=True, db_index=True, help_text="UID des E-Mails im IMAP-Ordner")
-    folder_name = models.CharField(max_length=255, db_index=True, null=True, blank=True)
+    uid = models.CharField(max_length=255, null=True, blank=True, help_text="UID des E-Mails im IMAP-Ordner")
+    folder_name = models.CharField(max_length=255, null=True, blank=True)
     conversation_id = models.CharField(max_length=255, db_index=True, blank=True)
     
     from_address = models.EmailField()
@@ -299,18 +320,20 @@ class Email(models.Model):
     subject = models.CharField(max_length=1000, blank=True)
     body_text = models.TextField(blank=True)
     body_html = models.TextField(blank=True)
-    flags = JSONField(default=list, blank=True, db_index=True)
+    flags = JSONField(default=list, blank=True)
     markdown_body = models.TextField(null=True, blank=True)
     
     received_at = models.DateTimeField(db_index=True, null=True, blank=True)
     sent_at = models.DateTimeField(null=True, blank=True, db_index=True, help_text="Datum/Zeit aus dem 'Date'-Header der E-Mail")
     date_str = models.CharField(max_length=255, null=True, blank=True, help_text="Originaler 'Date'-String aus dem Header")
     
-    is_read = models.BooleanField(default=False, db_index=True)
-    is_flagged = models.BooleanField(default=False, db_index=True)
-    is_replied = models.BooleanField(default=False, db_index=True, help_text="Entspricht \\Answered Flag")
-    is_deleted_on_server = models.BooleanField(default=False, db_index=True, help_text="Entspricht \\Deleted Flag")
-    is_draft = models.BooleanField(default=False, db_index=True, help_text="Entspricht \\Draft Flag")
+    # Flag-Spalten ohne Einzelindizes: geringe Selektivität, aber bei jedem Flag-Sync Schreiblast;
+    # der Posteingang nutzt die partiellen Indizes in Meta
+    is_read = models.BooleanField(default=False)
+    is_flagged = models.BooleanField(default=False)
+    is_replied = models.BooleanField(default=False, help_text="Entspricht \\Answered Flag")
+    is_deleted_on_server = models.BooleanField(default=False, help_text="Entspricht \\Deleted Flag")
+    is_draft = models.BooleanField(default=False, help_text="Entspricht \\Draft Flag")
     
     headers = JSONField(null=True, blank=True, help_text="E-Mail Header als JSON")
     size_rfc822 = models.PositiveIntegerField(null=True, blank=True, help_text="Größe laut Server (RFC822)")
@@ -335,26 +358,75 @@ class Email(models.Model):
     )
     # --- END NEW FIELDS --- 
 
+    search_vector = SearchVectorField(null=True, blank=True, editable=False, help_text="Volltext-Index, per DB-Trigger gepflegt")
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = EmailManager()
+
     class Meta:
         ordering = ['-sent_at', '-received_at']
+        constraints = [
+            # Schlüssel des IMAP-Syncs (update_or_create, Flag-/Lösch-Abgleich)
+            models.UniqueConstraint(fields=['account', 'folder_name', 'uid'], name='email_account_folder_uid_uniq'),
+        ]
         indexes = [
             models.Index(fields=['account', 'sent_at']),
             models.Index(fields=['account', 'received_at']),
-            models.Index(fields=['message_id']),
-            models.Index(fields=['uid']),
-            models.Index(fields=['folder_name']),
-            models.Index(fields=['conversation_id']),
-            models.Index(fields=['is_read']),
-            models.Index(fields=['is_flagged']),
-            models.Index(fields=['is_replied']),
+            GinIndex(fields=['search_vector'], name='email_search_vector_idx'),
+            # Offener Posteingang (unbeantwortet, nicht gelöscht, kein Entwurf) in Listen-/Keyset-Reihenfolge,
+            # mit und ohne Ordnerfilter
+            models.Index(
+                fields=['account', '-sent_at', '-received_at', '-id'],
+                condition=OPEN_INBOX_CONDITION,
+                name='email_open_inbox_idx',
+            ),
+            models.Index(
+                fields=['account', 'folder_name', '-sent_at', '-received_at', '-id'],
+                condition=OPEN_INBOX_CONDITION,
+                name='email_open_inbox_folder_idx',
+            ),
         ]
 
     def __str__(self):
         return f"{self.subject} (From: {self.from_address}, Sent: {self.sent_at})"
 
+    def save(self, *args, **kwargs):
+        # search_vector wird beim UPDATE nie zurückgeschrieben (der Trigger berechnet ihn selbst);
+        # beim INSERT überschreibt der BEFORE-INSERT-Trigger den mitgeschickten Wert ohnehin
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = [name for name in update_fields if name != 'search_vector']
+        elif not args and not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'search_vector' and f.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+class EmailFolderSyncState(models.Model):
+    """Persistierter IMAP-Sync-Stand pro Konto und Ordner (Basis für inkrementelle Syncs)."""
+
+    account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE, related_name='folder_sync_states')
+    folder_name = models.CharField(max_length=255)
+    uid_validity = models.BigIntegerField(null=True, blank=True, help_text="UIDVALIDITY des Ordners beim letzten Sync")
+    highest_uid = models.BigIntegerField(default=0, help_text="Höchste vollständig verarbeitete UID")
+    highest_modseq = models.BigIntegerField(null=True, blank=True, help_text="HIGHESTMODSEQ beim letzten Sync (CONDSTORE)")
+    message_count = models.PositiveIntegerField(null=True, blank=True, help_text="MESSAGES laut STATUS beim letzten Sync")
+    retry_from_uid = models.BigIntegerField(null=True, blank=True, help_text="Kleinste UID, deren Speichern fehlgeschlagen ist; der nächste Sync holt ab hier erneut")
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('account', 'folder_name')
+        verbose_name = "Email Folder Sync State"
+        verbose_name_plural = "Email Folder Sync States"
+
+    def __str__(self):
+        return f"{self.account_id}/{self.folder_name} (UIDVALIDITY {self.uid_validity}, UID {self.highest_uid}, MODSEQ {self.highest_modseq})"
+
 def attachment_upload_path(instance, filename):
     # filename ist der ursprüngliche Dateiname
     # instance ist die Attachment-Instanz
@@ -363,6 +435,56 @@ def attachment_upload_path(instance, filename):
     # Erstelle einen Pfad wie: attachments/account_1/email_123/original_filename.pdf
     return os.path.join('attachments', f'account_{account_id}', f'email_{email_pk}', filename)
 
+def attachment_blob_upload_path(instance, filename):
+    # Inhaltsadressiert: attachments/blobs/ab/cd/abcd...<sha256>
+    return os.path.join('attachments', 'blobs', instance.sha256[:2], instance.sha256[2:4], instance.sha256)
+
+class AttachmentBlob(models.Model):
+    """Inhaltsadressierte Datei eines Anhangs (SHA-256), von mehreren Attachments referenziert.
+
+    OCR/Textextraktion und Embedding werden pro Inhalt einmal berechnet und hier abgelegt.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=attachment_blob_upload_path, max_length=255)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0, help_text="Anzahl der Attachments, die diese Datei referenzieren")
+
+    extracted_text = models.TextField(blank=True)
+    embedding_vector = models.BinaryField(null=True, blank=True, help_text="float32-Embedding des Inhalts (Wiederverwendung)")
+    embedding_model_key = models.CharField(max_length=255, blank=True, help_text="Modell/Backend, mit dem embedding_vector berechnet wurde (EMBEDDING_MODEL_KEY)")
+    analyzed_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Attachment Blob"
+        verbose_name_plural = "Attachment Blobs"
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes, {self.ref_count} refs)"
+
+    def get_cached_analysis(self, model_key):
+        """Gibt (extracted_text, embedding) zurück, falls der Inhalt bereits analysiert wurde, sonst None.
+
+        embedding ist None, wenn der gespeicherte Vektor mit einem anderen Modell/Backend als model_key
+        berechnet wurde; der extrahierte Text (OCR) bleibt dann trotzdem wiederverwendbar.
+        """
+        if not self.analyzed_at:
+            return None
+        if not self.embedding_vector or self.embedding_model_key != model_key:
+            return self.extracted_text, None
+        vector = array.array('f')
+        vector.frombytes(bytes(self.embedding_vector))
+        return self.extracted_text, vector.tolist()
+
+    def save_analysis(self, extracted_text, embedding, model_key=''):
+        self.extracted_text = extracted_text or ''
+        self.embedding_vector = array.array('f', embedding).tobytes()
+        self.embedding_model_key = model_key or ''
+        self.analyzed_at = timezone.now()
+        self.save(update_fields=['extracted_text', 'embedding_vector', 'embedding_model_key', 'analyzed_at'])
+
 class Attachment(models.Model):
     """E-Mail-Anhang mit extrahiertem Text und Embedding."""
     
@@ -376,6 +498,8 @@ class Attachment(models.Model):
     
     # Verwende die neue Funktion für upload_to
     file = models.FileField(upload_to=attachment_upload_path)
+    # Gemeinsame inhaltsadressierte Datei; file zeigt dann auf blob.file
+    blob = models.ForeignKey(AttachmentBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='attachments')
     
     # Extrahierte Informationen
     extracted_text = models.TextField(blank=True)
@@ -392,7 +516,22 @@ class Attachment(models.Model):
 # NEU: Signal-Handler zum Löschen der Datei, wenn das Attachment-Objekt gelöscht wird
 @receiver(post_delete, sender=Attachment)
 def delete_attachment_file(sender, instance, **kwargs):
-    """Löscht die Datei vom Dateisystem, wenn ein Attachment-Objekt gelöscht wird."""
+    """Löscht die Datei vom Dateisystem, wenn ein Attachment-Objekt gelöscht wird.
+
+    Bei inhaltsadressierten Anhängen wird nur der Referenzzähler des Blobs verringert;
+    die Datei wird erst gelöscht, wenn kein Attachment sie mehr referenziert.
+    """
+    if instance.blob_id:
+        AttachmentBlob.objects.filter(pk=instance.blob_id, ref_count__gt=0).update(ref_count=models.F('ref_count') - 1)
+        # Nur löschen, solange niemand parallel eine neue Referenz angelegt hat
+        deleted_blobs = AttachmentBlob.objects.filter(pk=instance.blob_id, ref_count=0, attachments__isnull=True)
+        blob = deleted_blobs.first()
+        if blob and deleted_blobs.delete()[0]:
+            try:
+                blob.file.delete(save=False)
+            except Exception as e:
+                logger.warning(f"Error deleting attachment blob file {blob.file.name}: {e}")
+        return
     # Stelle sicher, dass instance.file existiert und eine Datei hat
     if instance.file:
         if os.path.isfile(instance.file.path):
@@ -677,4 +816,20 @@ class AISuggestionEditHistory(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"{self.suggestion_id} {self.field} {self.edit_type} @ {self.created_at}" 
\ No newline at end of file
+        return f"{self.suggestion_id} {self.field} {self.edit_type} @ {self.created_at}" 
+
+class EmbeddingCacheEntry(models.Model):
+    """Persistenter Embedding-Cache: Vektor je (Modell, SHA-256 des normalisierten Eingabetexts), als float16 gespeichert."""
+    model_name = models.CharField(max_length=200)
+    text_hash = models.CharField(max_length=64)
+    vector = models.BinaryField(help_text="float16-Vektor (numpy tobytes)")
+    dimensions = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Embedding Cache Entry"
+        verbose_name_plural = "Embedding Cache Entries"
+        unique_together = ('model_name', 'text_hash')
+
+    def __str__(self):
+        return f"{self.model_name}:{self.text_hash[:12]} ({self.dimensions}d)"
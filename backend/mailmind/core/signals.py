@@ -1,17 +1,25 @@
 """
-Signal-Handler für APICredential-Modell, um crawl4ai über neue/geänderte API-Keys zu informieren.
+Signal-Handler für APICredential-Modell, um crawl4ai über neue/geänderte API-Keys zu informieren
+und den prozesslokalen API-Key-Cache (mailmind.ai.api_keys) zu invalidieren.
 """
 
 import logging
 import requests
 import os
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from .models import APICredential
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+@receiver(post_save, sender=APICredential)
+@receiver(post_delete, sender=APICredential)
+def invalidate_cached_api_key(sender, instance, **kwargs):
+    """Verwirft den entschlüsselten Key im Cache dieses Prozesses (andere Prozesse: TTL)."""
+    from mailmind.ai.api_keys import invalidate_api_key
+    invalidate_api_key(instance.user_id, instance.provider)
+
 @receiver(post_save, sender=APICredential)
 def notify_crawl4ai_api_key_change(sender, instance, created, **kwargs):
     """
@@ -1,5 +1,6 @@
 import logging
 from django.apps import AppConfig
+from django.conf import settings
 import sys
 
 logger = logging.getLogger(__name__)
@@ -13,14 +14,17 @@ class ImapConfig(AppConfig):
         # Verhindere das Starten im migrate/makemigrations oder anderen Management-Befehlen
         # und stelle sicher, dass es der Hauptprozess ist (nicht der Reload-Prozess).
         # `runserver` startet oft zwei Prozesse.
-        is_management_command = any(cmd in sys.argv for cmd in ['makemigrations', 'migrate', 'shell', 'test', 'collectstatic', 'qcluster'])
+        is_management_command = any(cmd in sys.argv for cmd in ['makemigrations', 'migrate', 'shell', 'test', 'collectstatic', 'qcluster', 'run_idle_worker'])
         is_runserver = 'runserver' in sys.argv
 
         # Starte den Manager nur im Haupt-runserver-Prozess (oder wenn Daphne/Gunicorn läuft)
         # und nicht bei Management-Befehlen.
         # Dies ist eine Heuristik und muss ggf. für die Produktionsumgebung angepasst werden.
         # Für Daphne/Gunicorn läuft `ready` normalerweise nur einmal pro Worker.
-        if not is_management_command:
+        # Im Sharding-Modus laufen die IDLE-Verbindungen in eigenen Workern (`manage.py run_idle_worker`)
+        if getattr(settings, 'IMAP_IDLE_SHARDING', False):
+            logger.info("ImapConfig.ready(): IMAP_IDLE_SHARDING enabled, IDLE connections are handled by run_idle_worker.")
+        elif not is_management_command:
             logger.info("ImapConfig.ready(): Attempting to start IDLE Manager...")
             try:
                 from . import idle_manager
@@ -45,6 +45,29 @@ def _get_connection_key(account_id: int) -> str:
     """Generiert einen eindeutigen Schlüssel für die Verbindung."""
     return f"{account_id}_{os.getpid()}"
 
+def refresh_capabilities(mailbox: MailBox) -> None:
+    """Re-reads CAPABILITY after LOGIN; many servers (e.g. Dovecot, Gmail) announce
+    CONDSTORE/QRESYNC/ENABLE only in the authenticated state."""
+    client = mailbox.client
+    typ, data = client.capability()
+    if typ == 'OK' and data and data[-1]:
+        client.capabilities = tuple(data[-1].decode('ascii', errors='replace').upper().split())
+
+def _enable_qresync(mailbox: MailBox, account_id: int) -> None:
+    """Enables QRESYNC on a freshly logged-in connection if the server supports it.
+    Must run before the first SELECT (login with initial_folder=None).
+    Sets mailbox.qresync_enabled so incremental syncs can request VANISHED responses."""
+    mailbox.qresync_enabled = False
+    try:
+        refresh_capabilities(mailbox)
+        capabilities = set(getattr(mailbox.client, 'capabilities', ()) or ())
+        if 'QRESYNC' in capabilities and 'ENABLE' in capabilities and mailbox.client.state == 'AUTH':
+            typ, _ = mailbox.client.enable('QRESYNC')
+            mailbox.qresync_enabled = typ == 'OK'
+            logger.debug(f"QRESYNC enabled for account {account_id}: {mailbox.qresync_enabled}")
+    except Exception as e:
+        logger.warning(f"Could not enable QRESYNC for account {account_id}: {e}")
+
 @contextmanager
 def get_imap_connection(account: EmailAccount) -> Generator[MailBox, None, None]:
     """Gibt eine IMAP-Verbindung aus dem Pool zurück oder erstellt eine neue."""
@@ -143,7 +166,8 @@ def get_imap_connection(account: EmailAccount) -> Generator[MailBox, None, None]
                 retry_count = 0
                 while retry_count < _max_retries:
                     try:
-                        mailbox = mb.login(account.email, password)
+                        # Kein SELECT beim Login: ENABLE QRESYNC ist nur im Authenticated State erlaubt
+                        mailbox = mb.login(account.email, password, initial_folder=None)
                         # Warte kurz nach erfolgreichem Login
                         time.sleep(1)
                         break
@@ -171,6 +195,10 @@ def get_imap_connection(account: EmailAccount) -> Generator[MailBox, None, None]
                     logger.warning(f"Could not access socket to set timeout for account {account_id}.")
                 
                 logger.debug(f"Login completed in {time.time() - login_start:.2f}s")
+
+                # QRESYNC (RFC 7162) kann nur im Authenticated State vor dem ersten SELECT aktiviert werden
+                _enable_qresync(mailbox, account_id)
+                mailbox.folder.set('INBOX') # bisheriges Verhalten von login(): INBOX ausgewählt
                 
                 pool.append({'connection': mailbox, 'last_used': time.time(), 'in_use': True})
                 logger.debug(f"Connection created and stored in pool in {time.time() - start_time:.2f}s")
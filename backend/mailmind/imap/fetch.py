@@ -1,10 +1,11 @@
 import logging
 from typing import List, Iterable, Dict, Tuple, Optional
-from imap_tools import MailBox, MailMessage, MailboxFolderSelectError, MailboxFetchError, A
+from imap_tools import MailBox, MailMessage, MailboxFolderSelectError, MailboxFolderStatusError, MailboxFetchError, A
 from mailmind.core.models import EmailAccount
 # Entferne nicht mehr existierende Imports
 # from .store import save_email_metadata, save_full_email 
 import time
+import re
 # Importiere async_task zum Starten von Hintergrundtasks
 from django_q.tasks import async_task 
 import datetime # Import datetime
@@ -15,6 +16,7 @@ import html2text # NEU: Importieren
 from .store import save_or_update_email_from_dict
 # Importiere die Mapping-Funktion
 from .mapper import map_full_email_to_db
+from .fetch_pipeline import run_fetch_pipeline
 from django.conf import settings # Import settings
 # Importiere utils, um auf decode_email_header zuzugreifen, falls benötigt
 from . import utils 
@@ -26,9 +28,113 @@ METADATA_BATCH_SIZE = 25 # Standard Batch-Größe für Metadaten
 # Standard Batch-Größen, anpassbar über Settings
 FULL_EMAIL_BATCH_SIZE = getattr(settings, 'IMAP_FULL_EMAIL_BATCH_SIZE', 50) # Z.B. 50 für volle E-Mails
 MAX_BATCH_SIZE_BYTES = 10 * 1024 * 1024 # 10MB maximale Batch-Größe
+FULL_EMAIL_BATCH_MAX_BYTES = getattr(settings, 'IMAP_FULL_EMAIL_BATCH_MAX_BYTES', int(9.5 * 1024 * 1024)) # Byte-Grenze pro Fetch-Batch
+LARGE_MESSAGE_BYTES = getattr(settings, 'IMAP_LARGE_MESSAGE_BYTES', 5 * 1024 * 1024) # Größere Mails werden einzeln geholt
+UID_SIZE_FETCH_CHUNK = 1000 # UIDs pro UID FETCH (RFC822.SIZE)
 
-def fetch_folder_uids(mailbox: MailBox, account: EmailAccount, folder_name: str, existing_uids_in_db: set) -> List[str]:
-    """Selects a folder, fetches metadata including X-GM-LABELS, dispatches save tasks, and returns UIDs/Sizes."""
+# Regex für FETCH-Antworten mit CHANGEDSINCE (z.B. b'12 (UID 345 FLAGS (\\Seen) MODSEQ (678))')
+_FETCH_UID_RE = re.compile(rb'UID (\d+)')
+_FETCH_FLAGS_RE = re.compile(rb'FLAGS \(([^)]*)\)')
+_FETCH_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+
+def server_supports(mailbox: MailBox, capability: str) -> bool:
+    """Checks whether the IMAP server announced the given capability (e.g. 'CONDSTORE').
+    The pool refreshes client.capabilities after LOGIN (see connection.refresh_capabilities)."""
+    capabilities = getattr(mailbox.client, 'capabilities', ()) or ()
+    return capability.upper() in {str(c).upper() for c in capabilities}
+
+_STATUS_ITEM_RE = re.compile(rb'([A-Z]+) (\d+)')
+
+def _quote_folder(folder_name: str) -> bytes:
+    """Modified UTF-7 und Quoting wie imap_tools, für den direkten STATUS-Befehl."""
+    from imap_tools.imap_utf7 import utf7_encode
+    encoded = utf7_encode(folder_name)
+    return b'"' + encoded.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+def get_folder_status(mailbox: MailBox, folder_name: str) -> Dict[str, int]:
+    """Returns STATUS values for a folder: MESSAGES, UIDNEXT, UIDVALIDITY and,
+    if the server supports CONDSTORE, HIGHESTMODSEQ."""
+    options = ['MESSAGES', 'UIDNEXT', 'UIDVALIDITY']
+    if not (server_supports(mailbox, 'CONDSTORE') or server_supports(mailbox, 'QRESYNC')):
+        status = mailbox.folder.status(folder_name, options)
+        logger.debug(f"STATUS for folder '{folder_name}': {status}")
+        return status
+
+    # imap_tools (1.10) lehnt HIGHESTMODSEQ als STATUS-Option ab -> Befehl direkt senden
+    client = mailbox.client
+    options.append('HIGHESTMODSEQ')
+    typ, data = client._simple_command('STATUS', _quote_folder(folder_name), f'({" ".join(options)})')
+    if typ != 'OK':
+        raise MailboxFolderStatusError((typ, data), 'OK')
+    typ, data = client._untagged_response(typ, data, 'STATUS')
+    status_line = next((item for item in data or [] if isinstance(item, bytes)), b'')
+    status = {key.decode(): int(value) for key, value in _STATUS_ITEM_RE.findall(status_line.rsplit(b'(', 1)[-1])}
+    logger.debug(f"STATUS for folder '{folder_name}': {status}")
+    return status
+
+def fetch_new_uids(mailbox: MailBox, highest_uid: int) -> List[str]:
+    """Returns the UIDs above highest_uid in the selected folder (UID SEARCH UID n+1:*)."""
+    uids = mailbox.uids(f'UID {highest_uid + 1}:*')
+    # 'n:*' liefert immer mindestens die letzte Nachricht, auch wenn deren UID <= n ist
+    return [uid for uid in uids if int(uid) > highest_uid]
+
+def _parse_uid_set(uid_set: str) -> List[str]:
+    """Expands an IMAP UID set like '41,43:45' into a list of UIDs."""
+    uids = []
+    for part in uid_set.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if ':' in part:
+            start, end = (int(x) for x in part.split(':', 1))
+            uids.extend(str(uid) for uid in range(min(start, end), max(start, end) + 1))
+        else:
+            uids.append(str(int(part)))
+    return uids
+
+def fetch_flag_changes(mailbox: MailBox, since_modseq: int) -> Tuple[Dict[str, List[str]], List[str]]:
+    """Fetches flags of all messages changed since since_modseq in the selected folder.
+
+    Uses UID FETCH ... (CHANGEDSINCE n) (CONDSTORE, RFC 7162). If QRESYNC was enabled on the
+    connection, the VANISHED modifier is added and expunged UIDs are returned as well.
+
+    Returns:
+        A tuple (flags_by_uid, vanished_uids).
+    """
+    client = mailbox.client
+    use_qresync = getattr(mailbox, 'qresync_enabled', False)
+    modifiers = f'(CHANGEDSINCE {since_modseq} VANISHED)' if use_qresync else f'(CHANGEDSINCE {since_modseq})'
+    typ, data = client.uid('FETCH', '1:*', f'(UID FLAGS) {modifiers}')
+    if typ != 'OK':
+        raise MailboxFetchError((typ, data), 'OK')
+
+    flags_by_uid: Dict[str, List[str]] = {}
+    for item in data or []:
+        line = item[0] if isinstance(item, tuple) else item
+        if not isinstance(line, bytes):
+            continue
+        uid_match = _FETCH_UID_RE.search(line)
+        flags_match = _FETCH_FLAGS_RE.search(line)
+        if uid_match and flags_match:
+            flags_by_uid[uid_match.group(1).decode()] = flags_match.group(1).decode(errors='replace').split()
+
+    vanished_uids: List[str] = []
+    if use_qresync:
+        _, vanished_data = client.response('VANISHED')
+        for entry in vanished_data or []:
+            if isinstance(entry, bytes):
+                uid_set = entry.decode(errors='replace').replace('(EARLIER)', '').strip()
+                vanished_uids.extend(_parse_uid_set(uid_set))
+
+    logger.debug(f"CHANGEDSINCE {since_modseq}: {len(flags_by_uid)} changed, {len(vanished_uids)} vanished.")
+    return flags_by_uid, vanished_uids
+
+def fetch_folder_uids(mailbox: MailBox, account: EmailAccount, folder_name: str, existing_uids_in_db: set, since_uid: Optional[int] = None) -> List[str]:
+    """Selects a folder, fetches metadata including X-GM-LABELS, dispatches save tasks, and returns UIDs/Sizes.
+
+    If since_uid is given, only messages with a UID above it are fetched (UID n+1:*)
+    instead of the whole folder.
+    """
     start_time = time.time()
     logger.debug(f"Fetching UIDs and metadata for folder '{folder_name}'...")
     
@@ -52,7 +158,8 @@ def fetch_folder_uids(mailbox: MailBox, account: EmailAccount, folder_name: str,
         # messages = mailbox.fetch(criteria='ALL', mail_parts=fetch_parts, mark_seen=False) # FALSCH
         # messages = mailbox.fetch(criteria='ALL', fetch_items=fetch_parts, mark_seen=False) # AUCH FALSCH
         # messages = mailbox.fetch(criteria='ALL', fetch_parts=fetch_parts, mark_seen=False) # AUCH FALSCH
-        messages = mailbox.fetch(criteria='ALL', mark_seen=False, bulk=True) # Zurück zum Standard, bulk=True für Metadaten
+        criteria = f'UID {since_uid + 1}:*' if since_uid is not None else 'ALL'
+        messages = mailbox.fetch(criteria=criteria, mark_seen=False, bulk=True) # Zurück zum Standard, bulk=True für Metadaten
         logger.debug(f"Initial fetch command completed in {time.time() - fetch_start:.2f}s. Iterating messages and dispatching save tasks...")
 
         # Iterate messages, dispatch save tasks, collect UIDs/Sizes
@@ -62,6 +169,8 @@ def fetch_folder_uids(mailbox: MailBox, account: EmailAccount, folder_name: str,
         for msg in messages:
             # Kombiniertes Log für Iteration und Dispatch
             logger.debug(f"---> Iterating and dispatching save task for UID {msg.uid}...") 
+            if since_uid is not None and int(msg.uid) <= since_uid:
+                continue # 'n:*' liefert immer mindestens die letzte Nachricht
             message_count += 1
             try:
                 # Collect UID and Size for later full fetch
@@ -121,10 +230,15 @@ def fetch_folder_uids(mailbox: MailBox, account: EmailAccount, folder_name: str,
         logger.error(f"Error fetching UIDs/Metadata for folder '{folder_name}': {e}")
         raise
 
-def calculate_batches(uids_with_metadata: List[dict], max_batch_size_bytes: int = 9.5 * 1024 * 1024, max_uids_per_batch: int = 50) -> List[List[dict]]:
-    """Calculates optimal batches based on UID sizes and count."""
+def calculate_batches(uids_with_metadata: List[dict], max_batch_size_bytes: int = 9.5 * 1024 * 1024, max_uids_per_batch: int = 50, single_message_bytes: Optional[int] = None) -> List[List[dict]]:
+    """Calculates optimal batches based on UID sizes and count.
+
+    Messages larger than max_batch_size_bytes (or single_message_bytes, if given) get a batch of their own.
+    """
     if not uids_with_metadata:
         return []
+    if single_message_bytes is None:
+        single_message_bytes = max_batch_size_bytes
 
     # Sort UIDs by size (largest first)
     sorted_uids = sorted(uids_with_metadata, key=lambda x: x['size'], reverse=True)
@@ -137,7 +251,7 @@ def calculate_batches(uids_with_metadata: List[dict], max_batch_size_bytes: int
         size = uid_data['size']
         
         # If single UID is larger than max size, create single batch
-        if size > max_batch_size_bytes:
+        if size > min(max_batch_size_bytes, single_message_bytes):
             if current_batch:
                 batches.append(current_batch)
             batches.append([uid_data])
@@ -165,119 +279,77 @@ def calculate_batches(uids_with_metadata: List[dict], max_batch_size_bytes: int
 
     return batches
 
-def fetch_uids_full(mailbox: MailBox, uids: List[str], account: EmailAccount, folder_name: str) -> Tuple[int, int]:
+def fetch_uid_sizes(mailbox: MailBox, uids: List[str]) -> Dict[str, int]:
+    """Fetches RFC822.SIZE for the given UIDs (UID FETCH <set> (UID RFC822.SIZE)), in chunks."""
+    sizes = {}
+    for i in range(0, len(uids), UID_SIZE_FETCH_CHUNK):
+        chunk = uids[i:i + UID_SIZE_FETCH_CHUNK]
+        typ, data = mailbox.client.uid('FETCH', ','.join(chunk), '(UID RFC822.SIZE)')
+        if typ != 'OK':
+            raise MailboxFetchError((typ, data), 'OK')
+        for item in data:
+            line = item[0] if isinstance(item, tuple) else item
+            if not isinstance(line, bytes):
+                continue
+            uid_match = _FETCH_UID_RE.search(line)
+            size_match = _FETCH_SIZE_RE.search(line)
+            if uid_match and size_match:
+                sizes[uid_match.group(1).decode()] = int(size_match.group(1))
+    return sizes
+
+def plan_fetch_batches(uids_with_metadata: List[dict]) -> List[List[str]]:
+    """Builds byte-bounded UID batches for the full fetch.
+
+    Batches are capped by IMAP_FULL_EMAIL_BATCH_MAX_BYTES and IMAP_FULL_EMAIL_BATCH_SIZE;
+    messages above IMAP_LARGE_MESSAGE_BYTES are fetched alone.
+    """
+    batches = calculate_batches(
+        uids_with_metadata,
+        max_batch_size_bytes=FULL_EMAIL_BATCH_MAX_BYTES,
+        max_uids_per_batch=FULL_EMAIL_BATCH_SIZE,
+        single_message_bytes=LARGE_MESSAGE_BYTES,
+    )
+    return [[uid_data['uid'] for uid_data in batch] for batch in batches]
+
+def fetch_uids_full(mailbox: MailBox, uids: List[str], account: EmailAccount, folder_name: str, uids_with_metadata: Optional[List[dict]] = None) -> Tuple[int, int]:
     """
-    Fetches full email content for the given UIDs in batches and saves them directly using save_or_update_email_from_dict.
+    Fetches full email content for the given UIDs and hands the mapped data off to save_batch_content_task.
+
+    Batches are planned by size (plan_fetch_batches); fetching, parsing/mapping and the hand-off
+    run as a pipeline with bounded queues (see fetch_pipeline.run_fetch_pipeline).
 
     Args:
         mailbox: The MailBox instance connected and folder selected.
         uids: A list of UIDs (strings) to fetch.
         account: The EmailAccount instance.
         folder_name: The name of the folder being processed.
+        uids_with_metadata: Optional [{'uid', 'size'}] as returned by fetch_folder_uids; otherwise
+            the sizes are fetched with a cheap RFC822.SIZE request.
 
     Returns:
-        A tuple containing: (total_emails_processed, total_errors)
+        A tuple containing: (emails handed off for saving, total_errors)
     """
     if not uids:
         logger.debug(f"fetch_uids_full: No UIDs to fetch for folder '{folder_name}'")
         return 0, 0
 
-    batch_size = FULL_EMAIL_BATCH_SIZE
-    logger.info(f"Fetching full content for {len(uids)} UIDs from '{folder_name}' in batches of {batch_size}...")
-
-    total_emails_processed = 0 # Zählt erfolgreich *gespeicherte* Mails (vom Task gemeldet)
-    total_errors = 0           # Zählt Fehler beim Holen/Mappen *vor* dem Speichern
+    if uids_with_metadata is None:
+        size_start = time.time()
+        sizes = fetch_uid_sizes(mailbox, uids)
+        uids_with_metadata = [{'uid': uid, 'size': sizes.get(uid, 0)} for uid in uids]
+        logger.debug(f"Fetched RFC822.SIZE for {len(sizes)} UIDs in {time.time() - size_start:.2f}s")
+    else:
+        wanted = set(uids)
+        uids_with_metadata = [uid_data for uid_data in uids_with_metadata if uid_data['uid'] in wanted]
 
-    for i in range(0, len(uids), batch_size):
-        batch_uids = uids[i:i + batch_size]
-        current_batch_num = i // batch_size + 1
-        total_batches = (len(uids) + batch_size - 1) // batch_size
-        
-        logger.info(f"--- Processing Batch {current_batch_num}/{total_batches} (UIDs: {batch_uids[:5]}...{batch_uids[-1:]}) ---")
-        
-        fetch_start_time = time.time()
-        processed_in_batch = 0 # Zählt erfolgreich *geholte/gemappte* Mails in diesem Batch
-        errors_in_batch = 0
-        messages_generator = None
-        batch_content_data = [] # <<< NEU: Liste zum Sammeln der Daten
-
-        try:
-            logger.debug(f"[{current_batch_num}] Calling mailbox.fetch for {len(batch_uids)} UIDs...")
-            messages_generator = mailbox.fetch(A(uid=batch_uids), bulk=False, mark_seen=False)
-            logger.debug(f"[{current_batch_num}] mailbox.fetch returned. Iterating...")
-            
-            received_uids_in_batch = []
-            for msg in messages_generator:
-                received_uids_in_batch.append(msg.uid)
-                try:
-                    logger.debug(f"[{current_batch_num}] Mapping UID: {msg.uid}") # Geändert von "Processing"
-                    
-                    # Step 1: Map data
-                    db_data = map_full_email_to_db(msg, folder_name, account.email)
-                    
-                    # Step 2: Add mapped data to batch list <<< GEÄNDERT >>>
-                    batch_content_data.append(db_data) 
-                    processed_in_batch += 1
-                    
-                    # Entferne direkten Speicheraufruf
-                    # save_or_update_email_from_dict(db_data, account, folder_name)
-
-                except ValueError as e_map: # Errors from mapper (e.g., missing message_id)
-                    logger.error(f"[{current_batch_num}] Mapping failed for UID {msg.uid}: {e_map}")
-                    errors_in_batch += 1
-                except Exception as e_proc: # Andere Fehler beim Verarbeiten einer einzelnen Mail
-                    logger.error(f"[{current_batch_num}] Error processing email data for UID {msg.uid}: {e_proc}", exc_info=True)
-                    errors_in_batch += 1
-                
-            # Optional: Check for missing UIDs in the response vs request
-            if set(batch_uids) != set(received_uids_in_batch):
-                 missing_uids = set(batch_uids) - set(received_uids_in_batch)
-                 logger.warning(f"[{current_batch_num}] Mismatch between requested ({len(batch_uids)}) and received ({len(received_uids_in_batch)}) UIDs! Missing: {missing_uids}")
+    uid_batches = plan_fetch_batches(uids_with_metadata)
+    uid_sizes = {uid_data['uid']: uid_data['size'] for uid_data in uids_with_metadata}
+    logger.info(f"Fetching full content for {len(uids)} UIDs ({sum(uid_sizes.values()) / (1024 * 1024):.1f} MB) from '{folder_name}' in {len(uid_batches)} size-bounded batches...")
+    total_handed_off, total_errors = run_fetch_pipeline(mailbox, uid_batches, account, folder_name, uid_sizes=uid_sizes)
 
-        except MailboxFetchError as e_fetch:
-            logger.error(f"IMAP Fetch Error during batch {current_batch_num}: {e_fetch}", exc_info=True)
-            # Assume all in this batch failed if the fetch itself fails
-            errors_in_batch = len(batch_uids) - processed_in_batch 
-        except Exception as e_batch:
-            logger.error(f"Unexpected error during processing of batch {current_batch_num}: {e_batch}", exc_info=True)
-             # Assume all remaining in this batch failed 
-            errors_in_batch = len(batch_uids) - processed_in_batch
-        finally:
-            # Clean up generator if it exists and iteration was interrupted
-            if messages_generator and hasattr(messages_generator, 'close'):
-                 try:
-                     messages_generator.close() # Ensure resources are released if loop breaks early
-                 except Exception: pass # Ignore errors during close
-
-            # total_emails_processed += processed_in_batch # Wird nicht mehr hier gezählt
-            total_errors += errors_in_batch # Zähle nur Fehler *vor* dem Queuing
-            batch_duration = time.time() - fetch_start_time
-            logger.info(f"--- Finished FETCHING Batch {current_batch_num}/{total_batches} in {batch_duration:.2f}s. Mapped: {processed_in_batch}, Mapping Errors: {errors_in_batch} ---")
-
-        # --- Step 3: Queue the batch content saving task <<< NEU/WICHTIG >>> ---
-        if batch_content_data:
-            try:
-                logger.info(f"Enqueuing save_batch_content_task for Batch {current_batch_num} ({len(batch_content_data)} items)...")
-                async_task('mailmind.imap.tasks.save_batch_content_task',
-                           batch_content_data, 
-                           account.id)
-                logger.debug(f"Successfully enqueued save_batch_content_task for Batch {current_batch_num}.")
-            except Exception as q_err:
-                logger.error(f"Failed to enqueue save_batch_content_task for Batch {current_batch_num}: {q_err}", exc_info=True)
-                # Markiere alle erfolgreich gemappten Mails dieses Batches als Fehler, da sie nicht gespeichert werden
-                total_errors += len(batch_content_data)
-        elif errors_in_batch > 0 and not batch_content_data:
-             logger.warning(f"Batch {current_batch_num} resulted in {errors_in_batch} mapping errors and no data to queue.")
-        else:
-             logger.info(f"Batch {current_batch_num} resulted in no data to queue (likely empty fetch or all mapping errors).")
-        # ---------------------------------------------------------------------
-
-    # Anmerkung: total_emails_processed wird hier nicht mehr final geloggt, da das Speichern asynchron ist.
-    # Der Hook könnte das Gesamtergebnis loggen oder den Account-Status aktualisieren.
-    logger.info(f"=== Finished dispatching fetch/save tasks for folder '{folder_name}'. Total FETCH/MAP Errors: {total_errors} ===")
-    # Return value needs reconsidering - we don't know the final processed count here.
-    # Returning (0, total_errors) might be misleading. Maybe just return errors?
-    return 0, total_errors # Temporär, bis Hook-Logik implementiert ist
+    # Gespeichert wird asynchron in save_batch_content_task; hier zählen nur Fehler *vor* dem Queuing
+    logger.info(f"=== Finished dispatching fetch/save tasks for folder '{folder_name}'. Handed off: {total_handed_off}, Total FETCH/MAP Errors: {total_errors} ===")
+    return total_handed_off, total_errors
 
 def fetch_single_full_email(mailbox: MailBox, uid: str, account: EmailAccount, folder_name: str) -> Optional[Dict]:
     """
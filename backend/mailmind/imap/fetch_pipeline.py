@@ -0,0 +1,410 @@
+"""
+Pipelined full-message fetch: IMAP fetch -> parse/map -> persistence hand-off.
+
+Die drei Stufen laufen nebenläufig und sind über begrenzte Queues verbunden:
+
+1. Fetch (aufrufender Thread, besitzt die IMAP-Verbindung): holt Roh-Nachrichten per
+   UID FETCH (BODY.PEEK[] UID FLAGS RFC822.SIZE) in kleinen Teil-Batches
+   (IMAP_PIPELINE_FETCH_SUB_BATCH Nachrichten) und legt sie in die Raw-Queue.
+2. Parse/Map (Thread- oder Prozess-Pool): baut MailMessage, ruft map_full_email_to_db und
+   schreibt Anhänge direkt in den Attachment-Spool (stage_attachment_payloads).
+3. Persistenz (eigener Thread): sammelt gemappte Dicts (nur Storage-Keys, Größen, Hashes
+   der Anhänge) und übergibt sie in Chunks an save_batch_content_task.
+
+Die IMAP-Verbindung wartet dadurch nicht auf das Parsen. Da imaplib eine FETCH-Antwort komplett
+in den Speicher liest, wird jeder Batch in Teil-Batches geholt; eine volle Raw-Queue bremst so den
+nächsten FETCH, und der Speicherbedarf ist durch Queue-Tiefe + Teil-Batch statt durch die
+Batch-Größe begrenzt.
+"""
+import email
+import logging
+import queue
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django_q.tasks import async_task
+from imap_tools import MailBox, MailMessage, MailboxFetchError
+
+from mailmind.core.models import EmailAccount
+from .mapper import map_full_email_to_db
+from .store import stage_attachment_payloads
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_QUEUE_DEPTH = getattr(settings, 'IMAP_PIPELINE_QUEUE_DEPTH', 20) # Max. Nachrichten pro Queue zwischen den Stufen
+PIPELINE_PARSE_WORKERS = getattr(settings, 'IMAP_PIPELINE_PARSE_WORKERS', 2)
+PIPELINE_FETCH_SUB_BATCH = getattr(settings, 'IMAP_PIPELINE_FETCH_SUB_BATCH', 5) # Nachrichten pro UID FETCH innerhalb eines Batches
+PIPELINE_EXECUTOR = getattr(settings, 'IMAP_PIPELINE_EXECUTOR', 'thread') # 'thread' oder 'process'
+PIPELINE_PERSIST_CHUNK_SIZE = getattr(settings, 'IMAP_FULL_EMAIL_BATCH_SIZE', 50) # Emails pro save_batch_content_task
+PIPELINE_PERSIST_CHUNK_BYTES = getattr(settings, 'IMAP_FULL_EMAIL_BATCH_MAX_BYTES', int(9.5 * 1024 * 1024)) # Bytes pro save_batch_content_task
+BODYSTRUCTURE_THRESHOLD_BYTES = getattr(settings, 'IMAP_BODYSTRUCTURE_THRESHOLD_BYTES', 20 * 1024 * 1024) # Ab hier erst BODYSTRUCTURE holen
+MAX_ATTACHMENT_BYTES = getattr(settings, 'IMAP_MAX_ATTACHMENT_BYTES', 25 * 1024 * 1024) # Größere Anhänge großer Mails werden nicht geholt
+FETCH_METRICS_HISTORY = 50 # Letzte Batch-Metriken pro Konto im Cache
+FETCH_METRICS_CACHE_TIMEOUT = 24 * 60 * 60
+
+FULL_MESSAGE_FETCH_PARTS = '(BODY.PEEK[] UID FLAGS RFC822.SIZE)'
+
+_BODY_SECTION_RE = re.compile(rb'BODY\[([^\]]*)\]')
+_LITERAL_SUFFIX_RE = re.compile(rb'\{\d+\}$')
+_SEXP_TOKEN_RE = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+_STOP = object() # Sentinel zum Beenden der Stufen
+
+
+def _group_fetch_items(fetch_data: list) -> List[list]:
+    """Groups a raw imaplib FETCH response into per-message items as expected by MailMessage.
+
+    Each message starts with a (header, literal) tuple followed by bytes like b')'.
+    """
+    items = []
+    for part in fetch_data or []:
+        if isinstance(part, tuple):
+            items.append([part])
+        elif items and part is not None:
+            items[-1].append(part)
+    return items
+
+
+def _parse_fetch_item(fetch_item: list, folder_name: str, account_email: str, account_id: int) -> Dict:
+    """Parse/map stage for one message. Top-level function so it can run in a process pool.
+
+    Attachment bytes are written to the attachment spool here, so the mapped dict only carries references.
+    """
+    msg = MailMessage(fetch_item)
+    db_data = map_full_email_to_db(msg, folder_name, account_email)
+    return stage_attachment_payloads(db_data, account_id)
+
+
+def _fetch_response_bytes(fetch_data: list) -> int:
+    """Number of literal bytes in a raw FETCH response (for metrics)."""
+    return sum(len(part[1]) for part in fetch_data or [] if isinstance(part, tuple) and isinstance(part[1], bytes))
+
+
+def _flatten_fetch_response(fetch_data: list) -> bytes:
+    """Joins a FETCH response into one line, inlining literals as quoted strings."""
+    flattened = b''
+    for part in fetch_data or []:
+        if isinstance(part, tuple):
+            literal = part[1].replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+            flattened += _LITERAL_SUFFIX_RE.sub(b'', part[0].rstrip()) + b'"' + literal + b'"'
+        elif isinstance(part, bytes):
+            flattened += part
+    return flattened
+
+
+def _parse_sexp(data: bytes) -> list:
+    """Minimal parser for IMAP parenthesized lists (strings, NIL, atoms)."""
+    stack = [[]]
+    for token in _SEXP_TOKEN_RE.findall(data):
+        if token == b'(':
+            stack.append([])
+        elif token == b')':
+            if len(stack) > 1:
+                closed = stack.pop()
+                stack[-1].append(closed)
+        elif token.startswith(b'"'):
+            stack[-1].append(token[1:-1].replace(b'\\"', b'"').replace(b'\\\\', b'\\').decode(errors='replace'))
+        elif token.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token.decode(errors='replace'))
+    return stack[0]
+
+
+def _fetch_attributes(parsed: list) -> Dict[str, Any]:
+    """Turns the parsed '<seq> (KEY value KEY value ...)' FETCH line into a dict."""
+    for element in parsed:
+        if isinstance(element, list):
+            return {str(element[i]).upper(): element[i + 1] for i in range(0, len(element) - 1, 2)}
+    return {}
+
+
+def _bodystructure_leaves(body: list, prefix: str = '') -> List[Dict[str, Any]]:
+    """Leaf parts of a BODYSTRUCTURE with section number, content type, size and attachment flag."""
+    if body and isinstance(body[0], list):
+        leaves = []
+        # Kind-Parts stehen vor dem Subtype; danach folgen Extension-Daten (Parameter-Liste etc.)
+        children = []
+        for element in body:
+            if not isinstance(element, list):
+                break
+            children.append(element)
+        for index, child in enumerate(children):
+            section = f"{prefix}.{index + 1}" if prefix else str(index + 1)
+            leaves.extend(_bodystructure_leaves(child, section))
+        return leaves
+    main_type = str(body[0] or '').lower() if body else ''
+    sub_type = str(body[1] or '').lower() if len(body) > 1 else ''
+    size = int(body[6]) if len(body) > 6 and str(body[6]).isdigit() else 0
+    # Position der Disposition hängt vom Typ ab (RFC 3501, body-ext-1part)
+    disposition_index = 9 if main_type == 'text' else 11 if (main_type, sub_type) == ('message', 'rfc822') else 8
+    disposition = body[disposition_index] if len(body) > disposition_index else None
+    disposition_type = str(disposition[0]).lower() if isinstance(disposition, list) and disposition and disposition[0] else None
+    return [{
+        'section': prefix or '1',
+        'content_type': f"{main_type}/{sub_type}",
+        'size': size,
+        'attachment': disposition_type == 'attachment' or main_type != 'text',
+    }]
+
+
+def _reassemble_message(header: bytes, parts: List[Tuple[bytes, bytes]]) -> bytes:
+    """Builds a multipart/mixed message from the original header and the fetched (MIME header, body) parts."""
+    boundary = f"=_mailmind_{uuid.uuid4().hex}".encode()
+    header_msg = email.message_from_bytes(header)
+    del header_msg['Content-Type']
+    del header_msg['Content-Transfer-Encoding']
+    header_msg['Content-Type'] = f'multipart/mixed; boundary="{boundary.decode()}"'
+    raw = header_msg.as_bytes().rstrip(b'\r\n') + b'\r\n\r\n'
+    for mime_header, content in parts:
+        raw += b'--' + boundary + b'\r\n' + mime_header.rstrip(b'\r\n') + b'\r\n\r\n' + content + b'\r\n'
+    return raw + b'--' + boundary + b'--\r\n'
+
+
+def _fetch_large_message(mailbox: MailBox, uid: str) -> Tuple[Optional[list], int]:
+    """Fetches a very large message: BODYSTRUCTURE first, then only the parts within IMAP_MAX_ATTACHMENT_BYTES.
+
+    Returns a fetch item in the same layout as a regular BODY[] fetch (so MailMessage can parse it)
+    and the number of fetched bytes.
+    """
+    typ, data = mailbox.client.uid('FETCH', uid, '(UID FLAGS RFC822.SIZE BODYSTRUCTURE)')
+    if typ != 'OK':
+        raise MailboxFetchError((typ, data), 'OK')
+    attributes = _fetch_attributes(_parse_sexp(_flatten_fetch_response(data)))
+    bodystructure = attributes.get('BODYSTRUCTURE')
+    if not isinstance(bodystructure, list) or not bodystructure:
+        return None, 0
+    leaves = _bodystructure_leaves(bodystructure)
+    oversized = [leaf for leaf in leaves if leaf['attachment'] and leaf['size'] > MAX_ATTACHMENT_BYTES]
+
+    if not isinstance(bodystructure[0], list) or not oversized:
+        # Keine übergroßen Anhänge: ganze Nachricht (einzeln) holen
+        typ, data = mailbox.client.uid('FETCH', uid, FULL_MESSAGE_FETCH_PARTS)
+        if typ != 'OK':
+            raise MailboxFetchError((typ, data), 'OK')
+        items = _group_fetch_items(data)
+        return (items[0] if items else None), _fetch_response_bytes(data)
+
+    for leaf in oversized:
+        logger.warning(f"[Pipeline] UID {uid}: skipping attachment part {leaf['section']} ({leaf['content_type']}, {leaf['size'] / (1024 * 1024):.1f} MB) above IMAP_MAX_ATTACHMENT_BYTES.")
+    included = [leaf for leaf in leaves if leaf not in oversized]
+    sections = ' '.join(f"BODY.PEEK[{leaf['section']}.MIME] BODY.PEEK[{leaf['section']}]" for leaf in included)
+    typ, data = mailbox.client.uid('FETCH', uid, f'(BODY.PEEK[HEADER] {sections})')
+    if typ != 'OK':
+        raise MailboxFetchError((typ, data), 'OK')
+    fetched = {}
+    for part in data:
+        if isinstance(part, tuple):
+            match = _BODY_SECTION_RE.search(part[0])
+            if match:
+                fetched[match.group(1).decode().upper()] = part[1]
+    raw = _reassemble_message(
+        fetched.get('HEADER', b''),
+        [(fetched.get(f"{leaf['section']}.MIME", b''), fetched.get(leaf['section'], b'')) for leaf in included],
+    )
+    flags = ' '.join(str(flag) for flag in attributes.get('FLAGS') or [])
+    fetch_header = f"1 (UID {uid} FLAGS ({flags}) RFC822.SIZE {attributes.get('RFC822.SIZE', len(raw))} BODY[] {{{len(raw)}}}".encode()
+    return [(fetch_header, raw), b')'], _fetch_response_bytes(data)
+
+
+def _record_fetch_metrics(account_id: int, folder_name: str, batch_metrics: List[Dict[str, Any]]):
+    """Stores the latest per-batch fetch metrics (seconds, bytes, messages) in the cache for tuning the batch caps."""
+    if not batch_metrics:
+        return
+    cache_key = f"imap_fetch_metrics_{account_id}"
+    try:
+        history = cache.get(cache_key) or []
+        history.extend(dict(metric, folder=folder_name) for metric in batch_metrics)
+        cache.set(cache_key, history[-FETCH_METRICS_HISTORY:], timeout=FETCH_METRICS_CACHE_TIMEOUT)
+    except Exception as cache_err:
+        logger.warning(f"[Pipeline] Could not store fetch metrics for account {account_id}: {cache_err}")
+
+
+def get_fetch_metrics(account_id: int) -> List[Dict[str, Any]]:
+    """Returns the latest per-batch fetch metrics of an account (see _record_fetch_metrics)."""
+    return cache.get(f"imap_fetch_metrics_{account_id}") or []
+
+
+def enqueue_save_batch(batch_content_data: List[Dict], account_id: int):
+    """Default persistence hand-off: one save_batch_content_task per chunk."""
+    async_task('mailmind.imap.tasks.save_batch_content_task', batch_content_data, account_id)
+
+
+def run_fetch_pipeline(
+    mailbox: MailBox,
+    uid_batches: Iterable[List[str]],
+    account: EmailAccount,
+    folder_name: str,
+    persist: Optional[Callable[[List[Dict], int], None]] = None,
+    uid_sizes: Optional[Dict[str, int]] = None,
+) -> Tuple[int, int]:
+    """Fetches the given UID batches through the fetch -> parse -> persist pipeline.
+
+    Args:
+        mailbox: The MailBox instance connected and folder selected.
+        uid_batches: UID lists (planning/metrics unit); each list is fetched in sub-batches of
+            IMAP_PIPELINE_FETCH_SUB_BATCH UIDs so the bounded raw queue applies backpressure.
+        account: The EmailAccount instance.
+        folder_name: The name of the folder being processed.
+        persist: Hand-off for mapped chunks (default: enqueue save_batch_content_task).
+        uid_sizes: RFC822.SIZE per UID; single-message batches above IMAP_BODYSTRUCTURE_THRESHOLD_BYTES
+            are fetched via BODYSTRUCTURE first (see _fetch_large_message).
+
+    Returns:
+        A tuple (emails handed off to persistence, fetch/map/hand-off errors)
+    """
+    persist = persist or enqueue_save_batch
+    uid_sizes = uid_sizes or {}
+    batch_metrics = []
+    raw_queue = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+    mapped_queue = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+    worker_count = max(1, PIPELINE_PARSE_WORKERS)
+    process_pool = ProcessPoolExecutor(max_workers=worker_count) if PIPELINE_EXECUTOR == 'process' else None
+    stats = {'handed_off': 0, 'errors': 0}
+    stats_lock = threading.Lock()
+
+    def count_errors(count: int):
+        with stats_lock:
+            stats['errors'] += count
+
+    def parse_worker():
+        while True:
+            item = raw_queue.get()
+            if item is _STOP:
+                mapped_queue.put(_STOP)
+                return
+            uid, fetch_item = item
+            try:
+                if process_pool:
+                    db_data = process_pool.submit(_parse_fetch_item, fetch_item, folder_name, account.email, account.id).result()
+                else:
+                    db_data = _parse_fetch_item(fetch_item, folder_name, account.email, account.id)
+                mapped_queue.put(db_data)
+            except ValueError as e_map: # Errors from mapper (e.g., missing message_id)
+                logger.error(f"[Pipeline] Mapping failed for UID {uid}: {e_map}")
+                count_errors(1)
+            except Exception as e_proc:
+                logger.error(f"[Pipeline] Error processing email data for UID {uid}: {e_proc}", exc_info=True)
+                count_errors(1)
+
+    def persist_worker():
+        pending = []
+        pending_bytes = 0
+        stopped_workers = 0
+
+        def flush():
+            nonlocal pending_bytes
+            pending_bytes = 0
+            if not pending:
+                return
+            try:
+                persist(list(pending), account.id)
+                with stats_lock:
+                    stats['handed_off'] += len(pending)
+                logger.debug(f"[Pipeline] Handed off {len(pending)} emails from '{folder_name}' to persistence.")
+            except Exception as q_err:
+                logger.error(f"[Pipeline] Failed to hand off {len(pending)} emails to persistence: {q_err}", exc_info=True)
+                count_errors(len(pending))
+            pending.clear()
+
+        while stopped_workers < worker_count:
+            item = mapped_queue.get()
+            if item is _STOP:
+                stopped_workers += 1
+                continue
+            pending.append(item)
+            # Anhänge liegen bereits im Spool; im Task-Payload stecken nur noch die Bodies
+            pending_bytes += len(item.get('body_text') or '') + len(item.get('body_html') or '')
+            if len(pending) >= PIPELINE_PERSIST_CHUNK_SIZE or pending_bytes >= PIPELINE_PERSIST_CHUNK_BYTES:
+                flush()
+        flush()
+
+    parse_threads = [
+        threading.Thread(target=parse_worker, name=f'imap-parse-{i}', daemon=True) for i in range(worker_count)
+    ]
+    persist_thread = threading.Thread(target=persist_worker, name='imap-persist', daemon=True)
+    for thread in parse_threads:
+        thread.start()
+    persist_thread.start()
+
+    start_time = time.time()
+    try:
+        # --- Fetch-Stufe: nur Netzwerk, Parsen übernimmt der Pool ---
+        for batch_number, batch_uids in enumerate(uid_batches, start=1):
+            if not batch_uids:
+                continue
+            batch_start = time.time()
+            fetched_count = 0
+            fetched_bytes = 0
+            wait_seconds = 0.0 # Zeit, die der Fetch wegen voller Queue blockiert war
+            if len(batch_uids) == 1 and uid_sizes.get(batch_uids[0], 0) >= BODYSTRUCTURE_THRESHOLD_BYTES:
+                sub_batches = [batch_uids]
+            else:
+                step = max(1, PIPELINE_FETCH_SUB_BATCH)
+                sub_batches = [batch_uids[i:i + step] for i in range(0, len(batch_uids), step)]
+            for sub_uids in sub_batches:
+                try:
+                    if len(sub_uids) == 1 and uid_sizes.get(sub_uids[0], 0) >= BODYSTRUCTURE_THRESHOLD_BYTES:
+                        fetch_item, sub_bytes = _fetch_large_message(mailbox, sub_uids[0])
+                        fetch_items = [fetch_item] if fetch_item else []
+                    else:
+                        typ, data = mailbox.client.uid('FETCH', ','.join(sub_uids), FULL_MESSAGE_FETCH_PARTS)
+                        if typ != 'OK':
+                            raise MailboxFetchError((typ, data), 'OK')
+                        fetch_items = _group_fetch_items(data)
+                        sub_bytes = _fetch_response_bytes(data)
+                        del data # Roh-Antwort freigeben, bevor auf Platz in der Queue gewartet wird
+                except Exception as e_fetch:
+                    logger.error(f"[Pipeline] IMAP fetch error in batch {batch_number} ({len(sub_uids)} UIDs) in '{folder_name}': {e_fetch}", exc_info=True)
+                    count_errors(len(sub_uids))
+                    continue
+                fetched_count += len(fetch_items)
+                fetched_bytes += sub_bytes
+                if len(fetch_items) != len(sub_uids):
+                    logger.warning(f"[Pipeline] Batch {batch_number}: requested {len(sub_uids)} UIDs, received {len(fetch_items)} messages.")
+                    count_errors(max(len(sub_uids) - len(fetch_items), 0))
+                queue_start = time.time()
+                for fetch_item in fetch_items:
+                    raw_queue.put((_fetch_item_uid(fetch_item), fetch_item)) # Blockiert, wenn die Queue voll ist (Backpressure)
+                wait_seconds += time.time() - queue_start
+                fetch_items = None
+
+            fetch_seconds = time.time() - batch_start - wait_seconds
+            batch_metrics.append({
+                'batch': batch_number,
+                'messages': fetched_count,
+                'planned_bytes': sum(uid_sizes.get(uid, 0) for uid in batch_uids),
+                'fetched_bytes': fetched_bytes,
+                'fetch_seconds': round(fetch_seconds, 3),
+                'queue_wait_seconds': round(wait_seconds, 3),
+            })
+            logger.info(f"[Pipeline] Batch {batch_number}: {fetched_count} messages, {fetched_bytes / 1024:.0f} KB in {fetch_seconds:.2f}s ({fetched_bytes / 1024 / max(fetch_seconds, 0.001):.0f} KB/s), queue wait {wait_seconds:.2f}s.")
+    finally:
+        for _ in parse_threads:
+            raw_queue.put(_STOP)
+        for thread in parse_threads:
+            thread.join()
+        persist_thread.join()
+        if process_pool:
+            process_pool.shutdown(wait=True)
+        _record_fetch_metrics(account.id, folder_name, batch_metrics)
+
+    logger.info(f"[Pipeline] Finished '{folder_name}' in {time.time() - start_time:.2f}s. Handed off: {stats['handed_off']}, Errors: {stats['errors']}")
+    return stats['handed_off'], stats['errors']
+
+
+def _fetch_item_uid(fetch_item: list) -> Optional[str]:
+    """Extracts the UID from the FETCH header of a grouped message item (for logging)."""
+    header = fetch_item[0][0] if fetch_item and isinstance(fetch_item[0], tuple) else b''
+    marker = b'UID '
+    position = header.find(marker)
+    if position == -1:
+        return None
+    digits = header[position + len(marker):].split(b' ', 1)[0].rstrip(b')')
+    return digits.decode(errors='replace')
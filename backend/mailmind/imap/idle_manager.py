@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import time
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 import threading
 import ssl
 import re
@@ -14,6 +14,7 @@ from channels.layers import get_channel_layer
 from channels.db import database_sync_to_async
 from django_q.tasks import async_task
 from aioimaplib import aioimaplib
+from imap_tools import imap_utf7
 
 # Importiere Modelle erst nach potenziellem django.setup() in start_idle_manager
 # from mailmind.core.models import EmailAccount
@@ -25,27 +26,364 @@ IDLE_COMMAND_TIMEOUT = 30  # Timeout für IDLE-Start in Sekunden
 # Reduzierter Timeout für regelmäßigen Check, z.B. 5 Minuten
 wait_timeout = 5 * 60 # 5 Minuten Timeout für IDLE-Wait
 
+# Intervall für den vollständigen UID-Abgleich (FETCH 1:* (UID)); sonst nur Deltas
+IDLE_RECONCILE_INTERVAL = getattr(settings, 'IMAP_IDLE_RECONCILE_INTERVAL', 60 * 60) # 1 Stunde
+
+# Multi-Folder-Überwachung pro Konto
+IDLE_CONNECTIONS_PER_ACCOUNT = getattr(settings, 'IMAP_IDLE_CONNECTIONS_PER_ACCOUNT', 2) # IDLE-Verbindungen (+1 Steuerverbindung für LIST/STATUS)
+IDLE_MAX_WATCHED_FOLDERS = getattr(settings, 'IMAP_IDLE_MAX_WATCHED_FOLDERS', 25)
+IDLE_MIN_FOLDER_PRIORITY = getattr(settings, 'IMAP_IDLE_MIN_FOLDER_PRIORITY', -1) # Spam/Junk/Deleted liegen darunter
+IDLE_STATUS_POLL_INTERVAL = getattr(settings, 'IMAP_IDLE_STATUS_POLL_INTERVAL', 2 * 60) # 2 Minuten
+IDLE_USE_NOTIFY = getattr(settings, 'IMAP_IDLE_USE_NOTIFY', True)
+NOTIFY_EVENTS = '(MessageNew MessageExpunge FlagChange)'
+
+# Regexe für ungetaggte Server-Antworten (SELECT / IDLE-Push / FETCH)
+_EXISTS_RE = re.compile(r'^\*?\s*(\d+)\s+EXISTS', re.IGNORECASE)
+_EXPUNGE_RE = re.compile(r'^\*?\s*(\d+)\s+EXPUNGE', re.IGNORECASE)
+_FETCH_PUSH_RE = re.compile(r'^\*?\s*(\d+)\s+FETCH', re.IGNORECASE)
+_UIDNEXT_RE = re.compile(r'UIDNEXT\s+(\d+)', re.IGNORECASE)
+_UIDVALIDITY_RE = re.compile(r'UIDVALIDITY\s+(\d+)', re.IGNORECASE)
+_UID_RE = re.compile(r'UID\s+(\d+)', re.IGNORECASE)
+_STATUS_PUSH_RE = re.compile(r'^\*?\s*STATUS\s+(?P<name>"(?:[^"\\]|\\.)*"|\S+)\s+\(', re.IGNORECASE)
+_STATUS_ITEM_RE = re.compile(r'(UIDNEXT|MESSAGES|UIDVALIDITY|HIGHESTMODSEQ)\s+(\d+)', re.IGNORECASE)
+_LIST_RE = re.compile(r'^(?:\*\s+)?(?:LIST\s+)?\((?P<flags>[^)]*)\)\s+(?P<delim>"(?:[^"\\]|\\.)*"|NIL)\s+(?P<name>.+)$', re.IGNORECASE)
+
 # Globales Dictionary zur Verfolgung laufender IDLE-Tasks
 # Schlüssel: account_id, Wert: asyncio.Task
 running_idle_tasks: Dict[int, asyncio.Task] = {}
 _manager_stop_event = asyncio.Event()
 
-# --- Account-spezifischer IDLE Task ---
-async def run_idle_for_account(account_id: int, decrypted_password: Optional[str]):
-    """Hauptfunktion für die IDLE-Verbindung eines einzelnen Kontos."""
+def _response_lines(lines) -> list:
+    """Flattens aioimaplib response lines (bytes/str, possibly nested lists) to a list of str."""
+    result = []
+    for line in lines or []:
+        if isinstance(line, (list, tuple)):
+            result.extend(_response_lines(line))
+        elif isinstance(line, (bytes, bytearray)):
+            result.append(bytes(line).decode(errors='replace'))
+        elif isinstance(line, str):
+            result.append(line)
+    return result
+
+def _parse_select_response(lines) -> Dict[str, Optional[int]]:
+    """Extracts EXISTS, UIDNEXT and UIDVALIDITY from the untagged SELECT responses."""
+    info = {'exists': None, 'uidnext': None, 'uidvalidity': None}
+    for line in _response_lines(lines):
+        match = _EXISTS_RE.match(line.strip())
+        if match:
+            info['exists'] = int(match.group(1))
+        match = _UIDNEXT_RE.search(line)
+        if match:
+            info['uidnext'] = int(match.group(1))
+        match = _UIDVALIDITY_RE.search(line)
+        if match:
+            info['uidvalidity'] = int(match.group(1))
+    return info
+
+def _parse_idle_push(responses) -> Tuple[Optional[int], int, bool]:
+    """Parses IDLE push responses.
+
+    Returns:
+        (latest EXISTS count or None, number of EXPUNGE responses, whether FETCH responses (flag changes) were seen)
+    """
+    exists = None
+    expunged = 0
+    flags_changed = False
+    for line in _response_lines(responses):
+        line = line.strip()
+        match = _EXISTS_RE.match(line)
+        if match:
+            exists = int(match.group(1))
+            continue
+        if _EXPUNGE_RE.match(line):
+            expunged += 1
+            if exists is not None:
+                exists -= 1 # EXPUNGE nach EXISTS verschiebt die Zählung
+            continue
+        if _FETCH_PUSH_RE.match(line):
+            flags_changed = True
+    return exists, expunged, flags_changed
+
+async def _fetch_uids_above(imap_client, last_uid: int) -> set:
+    """Returns the UIDs above last_uid via UID FETCH <last_uid+1>:* (UID)."""
+    response = await imap_client.uid('fetch', f'{last_uid + 1}:*', '(UID)')
+    uids = set()
+    if response and response.result == 'OK':
+        for line in _response_lines(response.lines):
+            match = _UID_RE.search(line)
+            if match and int(match.group(1)) > last_uid: # '*' liefert immer die letzte Nachricht
+                uids.add(match.group(1))
+    else:
+        raise aioimaplib.Abort(f"UID FETCH {last_uid + 1}:* failed: {getattr(response, 'result', None)}")
+    return uids
+
+async def _fetch_all_uids(imap_client) -> set:
+    """Full UID scan via FETCH 1:* (UID). Only used for the periodic reconciliation pass."""
+    response = await imap_client.fetch('1:*', '(UID)')
+    uids = set()
+    if response and response.result == 'OK':
+        for line in _response_lines(response.lines):
+            match = _UID_RE.search(line)
+            if match:
+                uids.add(match.group(1))
+    else:
+        raise aioimaplib.Abort(f"FETCH 1:* (UID) failed: {getattr(response, 'result', None)}")
+    return uids
+
+async def _open_imap_connection(account, decrypted_password: Optional[str], account_id: int):
+    """Opens an SSL connection with aioimaplib and logs in. Raises aioimaplib.Abort on failure."""
+    # Verwende E-Mail als Fallback für Benutzernamen
+    login_username = account.username
+    if not login_username:
+        login_username = account.email
+        logger.warning(f"[IDLE Task {account_id}] Username is empty for account {account.email}. Using email address as login username.")
+
+    # Stelle sicher, dass der login_username nicht immer noch leer ist (sollte nicht passieren, wenn E-Mail Pflicht ist)
+    if not login_username:
+         logger.error(f"[IDLE Task {account_id}] Both username and email are empty for account ID {account_id}. Cannot login.")
+         raise ValueError("Username and Email cannot both be empty.")
+
+    # Verwende das übergebene (bereits entschlüsselte) Passwort
+    password = decrypted_password
+    if not password:
+         logger.error(f"[IDLE Task {account_id}] No password provided to task or failed to decrypt earlier.")
+         raise aioimaplib.Abort("Missing credentials")
+
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = True
+    ssl_context.verify_mode = ssl.CERT_REQUIRED
+
+    # Connect with timeout
+    try:
+        imap_client = aioimaplib.IMAP4_SSL(
+            host=account.imap_server,
+            port=account.imap_port,
+            ssl_context=ssl_context,
+            timeout=60 # Erhöht von 15 auf 60 Sekunden
+        )
+        await imap_client.wait_hello_from_server()
+    except asyncio.TimeoutError:
+         logger.error(f"[IDLE Task {account_id}] Connection attempt timed out after 60s.")
+         raise aioimaplib.Abort('Connection timeout')
+    except Exception as conn_err:
+         logger.error(f"[IDLE Task {account_id}] Connection failed: {conn_err}")
+         raise aioimaplib.Abort(f'Connection failed: {conn_err}')
+
+    # Login mit dem (potenziell Fallback) Benutzernamen
+    logger.debug(f"[IDLE Task {account_id}] Attempting login with username: '{login_username}' and password: '*****'") # Log username
+    await imap_client.login(login_username, password)
+    return imap_client
+
+def _quote_mailbox(folder_name: str) -> str:
+    """Encodes a folder name as modified UTF-7 and quotes it for use in an IMAP command."""
+    encoded = imap_utf7.encode(folder_name).decode('ascii')
+    return '"' + encoded.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _decode_mailbox(raw_name: str) -> str:
+    """Inverse of _quote_mailbox for names from LIST/STATUS responses."""
+    name = raw_name.strip()
+    if len(name) >= 2 and name[0] == '"' and name[-1] == '"':
+        name = name[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    try:
+        return imap_utf7.decode(name.encode('ascii'))
+    except Exception:
+        return name
+
+def _parse_status_pushes(responses) -> set:
+    """Returns the folder names of unsolicited STATUS responses (sent by the server after NOTIFY SET)."""
+    folders = set()
+    for line in _response_lines(responses):
+        match = _STATUS_PUSH_RE.match(line.strip())
+        if match:
+            folders.add(_decode_mailbox(match.group('name')))
+    return folders
+
+def _status_changed(previous: Dict[str, int], current: Dict[str, int]) -> bool:
+    """Compares two STATUS snapshots; only keys present in both are considered."""
+    for key in ('uidvalidity', 'uidnext', 'messages', 'highestmodseq'):
+        if previous.get(key) is not None and current.get(key) is not None and previous[key] != current[key]:
+            return True
+    return False
+
+def _rank_folders(folder_names: List[str]) -> List[str]:
+    """Sorts folders for monitoring: INBOX first, then by get_folder_priority (highest first).
+
+    Folders below IMAP_IDLE_MIN_FOLDER_PRIORITY (Spam, Junk, Deleted) are not monitored.
+    """
+    from mailmind.imap.store import get_folder_priority
+    inbox = [name for name in folder_names if name.upper() == 'INBOX']
+    others = [
+        name for name in folder_names
+        if name.upper() != 'INBOX' and get_folder_priority(name) >= IDLE_MIN_FOLDER_PRIORITY
+    ]
+    others.sort(key=lambda name: (-get_folder_priority(name), name.lower()))
+    return (inbox + others)[:IDLE_MAX_WATCHED_FOLDERS]
+
+def _select_idle_folders(ranked_folders: List[str], budget: int, last_activity: Dict[str, float]) -> List[str]:
+    """Chooses the folders that get a dedicated IDLE connection.
+
+    The first ranked folder (INBOX) is pinned; the remaining slots rotate to the folders with the
+    most recent activity seen by the STATUS poller, ties broken by priority rank.
+    """
+    if not ranked_folders or budget <= 0:
+        return []
+    rank = {name: index for index, name in enumerate(ranked_folders)}
+    rotating = sorted(ranked_folders[1:], key=lambda name: (-last_activity.get(name, 0.0), rank[name]))
+    return ranked_folders[:1] + rotating[:budget - 1]
+
+async def _list_watchable_folders(imap_client, account_id: int) -> List[str]:
+    """LISTs all selectable folders and returns them ranked for monitoring."""
+    response = await imap_client.list('""', '*')
+    if not response or response.result != 'OK':
+        raise aioimaplib.Abort(f"LIST failed: {getattr(response, 'result', None)}")
+    folder_names = []
+    for line in _response_lines(response.lines):
+        match = _LIST_RE.match(line.strip())
+        if not match:
+            continue
+        flags = match.group('flags').lower()
+        if '\\noselect' in flags or '\\nonexistent' in flags:
+            continue
+        folder_name = _decode_mailbox(match.group('name'))
+        # [Gmail]/All Mail dupliziert nur andere Ordner (wie in sync_account)
+        if folder_name.lower() in ('[gmail]/all mail', '[gmail]/alle nachrichten'):
+            continue
+        folder_names.append(folder_name)
+    ranked = _rank_folders(folder_names)
+    logger.debug(f"[IDLE Task {account_id}] Watchable folders (ranked): {ranked}")
+    return ranked
+
+def _ensure_notify_command():
+    """Registers NOTIFY with aioimaplib, which only knows the commands of RFC 3501 and a few extensions."""
+    if 'NOTIFY' not in aioimaplib.Commands:
+        aioimaplib.Commands['NOTIFY'] = aioimaplib.Cmd('NOTIFY', (aioimaplib.AUTH, aioimaplib.SELECTED), aioimaplib.Exec.is_sync)
+
+async def _notify_set(imap_client, selected_folder: str, other_folders: List[str], account_id: int) -> bool:
+    """Sends NOTIFY SET for the selected folder and the given other folders (RFC 5465)."""
+    others = [name for name in other_folders if name != selected_folder]
+    args = ['SET', f'(SELECTED {NOTIFY_EVENTS})']
+    if others:
+        args.append(f"(MAILBOXES ({' '.join(_quote_mailbox(name) for name in others)}) {NOTIFY_EVENTS})")
+    try:
+        _ensure_notify_command()
+        response = await imap_client.protocol.simple_command('NOTIFY', *args)
+    except Exception as notify_err:
+        logger.warning(f"[IDLE Task {account_id}] NOTIFY SET failed: {notify_err}")
+        return False
+    if response.result != 'OK':
+        logger.warning(f"[IDLE Task {account_id}] NOTIFY SET rejected by server: {response.result} {response.lines}")
+        return False
+    logger.info(f"[IDLE Task {account_id}] NOTIFY SET active for '{selected_folder}' and {len(others)} other folders.")
+    return True
+
+async def _supports_notify(imap_client, account_id: int) -> bool:
+    """Checks the NOTIFY capability and probes it with NOTIFY NONE on the control connection."""
+    if not imap_client.has_capability('NOTIFY'):
+        return False
+    try:
+        _ensure_notify_command()
+        response = await imap_client.protocol.simple_command('NOTIFY', 'NONE')
+        return response.result == 'OK'
+    except Exception as notify_err:
+        logger.warning(f"[IDLE Task {account_id}] NOTIFY probe failed, falling back to IDLE rotation: {notify_err}")
+        return False
+
+async def _load_folder_baselines(account_id: int) -> Dict[str, Dict[str, Optional[int]]]:
+    """Builds STATUS-like baselines per folder from the persisted EmailFolderSyncState rows.
+
+    UIDNEXT is not persisted and cannot be derived from highest_uid (expunged or skipped UIDs), so it
+    stays None here; the first real STATUS poll of the folder seeds it (see _poll_folder_status).
+    """
+    from mailmind.core.models import EmailFolderSyncState
+
+    def _load():
+        baselines = {}
+        for state in EmailFolderSyncState.objects.filter(account_id=account_id):
+            baselines[state.folder_name] = {
+                'uidvalidity': state.uid_validity,
+                'uidnext': None,
+                'messages': state.message_count,
+                'highestmodseq': state.highest_modseq,
+            }
+        return baselines
+
+    return await database_sync_to_async(_load)()
+
+async def _poll_folder_status(imap_client, account_id: int, folder_name: str, status_cache: Dict[str, Dict[str, Optional[int]]]) -> bool:
+    """Polls STATUS (UIDNEXT MESSAGES UIDVALIDITY [HIGHESTMODSEQ]) and returns True if the folder changed.
+
+    Only values present in the previous snapshot are compared, so a baseline without UIDNEXT is
+    seeded with the server's real UIDNEXT by this call.
+    """
+    items = 'UIDNEXT MESSAGES UIDVALIDITY'
+    if imap_client.has_capability('CONDSTORE') or imap_client.has_capability('QRESYNC'):
+        items += ' HIGHESTMODSEQ'
+    response = await imap_client.status(_quote_mailbox(folder_name), f'({items})')
+    if not response or response.result != 'OK':
+        logger.warning(f"[IDLE Task {account_id}] STATUS for '{folder_name}' failed: {getattr(response, 'result', None)}")
+        return False
+    current = {}
+    for line in _response_lines(response.lines):
+        for key, value in _STATUS_ITEM_RE.findall(line):
+            current[key.lower()] = int(value)
+    previous = status_cache.get(folder_name)
+    status_cache[folder_name] = current
+    return previous is not None and _status_changed(previous, current)
+
+async def _stop_idle_tasks(idle_tasks: Dict[str, asyncio.Task], folder_names: List[str]):
+    """Cancels the IDLE tasks of the given folders, waits until their connections are closed and removes them."""
+    tasks = [idle_tasks.pop(folder_name) for folder_name in folder_names if folder_name in idle_tasks]
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _mark_emails_deleted_and_notify(account_id: int, folder_name: str, removed_uids: set):
+    """Marks the given UIDs as deleted on server and sends an 'email.refresh' event."""
+    from mailmind.core.models import EmailAccount
+    from mailmind.imap.store import mark_emails_deleted_on_server
+    try:
+        account_obj = await database_sync_to_async(EmailAccount.objects.get)(id=account_id)
+        updated_count = await database_sync_to_async(mark_emails_deleted_on_server)(account_obj, folder_name, list(removed_uids))
+        logger.info(f"[IDLE Task {account_id}] Marked {updated_count} emails as deleted in DB (folder: {folder_name}).")
+        # WebSocket-Event anstoßen
+        try:
+            user_id = account_obj.user_id
+            group_name = f'user_{user_id}_events'
+            message = {
+                'type': 'email.refresh',
+                'payload': {'folder': folder_name}
+            }
+            await get_channel_layer().group_send(group_name, message)
+            logger.info(f"[IDLE Task {account_id}] WebSocket-Event 'email.refresh' an Gruppe {group_name} gesendet (wegen Löschung).")
+        except Exception as ws_err:
+            logger.error(f"[IDLE Task {account_id}] WebSocket-Event 'email.refresh' fehlgeschlagen: {ws_err}", exc_info=True)
+    except Exception as del_err:
+        logger.error(f"[IDLE Task {account_id}] Fehler beim Markieren gelöschter UIDs: {del_err}", exc_info=True)
+
+# --- Ordner-spezifischer IDLE Task ---
+async def run_idle_for_folder(account_id: int, decrypted_password: Optional[str], folder_to_monitor: str = 'INBOX', notify_folders: Optional[List[str]] = None):
+    """IDLE-Verbindung für einen einzelnen Ordner eines Kontos.
+
+    Mit notify_folders wird nach dem SELECT ein NOTIFY SET (RFC 5465) für diese Ordner gesendet;
+    deren Änderungen kommen dann als ungetaggte STATUS-Antworten über dieselbe IDLE-Verbindung.
+    """
     from mailmind.core.models import EmailAccount # Import hier, da in async context
     
-    logger.info(f"[IDLE Task {account_id}] Starting for account {account_id}")
+    logger.info(f"[IDLE Task {account_id}] Starting for account {account_id}, folder '{folder_to_monitor}'")
     imap_client = None
     retry_delay = 5 # Initial retry delay in seconds
-    folder_to_monitor = 'INBOX' # TODO: Make configurable?
-    known_uids = set() # Store known UIDs for this account/folder
+    # Delta-Status statt vollständiger UID-Menge
+    last_uid = None          # Höchste bekannte UID im Ordner
+    uid_validity = None      # UIDVALIDITY der aktuellen Auswahl
+    message_count = None     # Letzter bekannter EXISTS-Wert
+    last_reconcile_at = time.time()
 
     while not _manager_stop_event.is_set():
         imap_client = None
         idle_command_task = None
         idle_wait_task = None
-        new_uids_after_idle = None # Initialize here
         try:
             # 0. Fetch account data (inside loop to get updates)
             try:
@@ -78,79 +416,38 @@ async def run_idle_for_account(account_id: int, decrypted_password: Optional[str
                        imap_client = None
                 # --- End close previous connection --- 
                 try:
-                    # Verwende E-Mail als Fallback für Benutzernamen
-                    login_username = account.username
-                    if not login_username:
-                        login_username = account.email
-                        logger.warning(f"[IDLE Task {account_id}] Username is empty for account {account.email}. Using email address as login username.")
-                    
-                    # Stelle sicher, dass der login_username nicht immer noch leer ist (sollte nicht passieren, wenn E-Mail Pflicht ist)
-                    if not login_username:
-                         logger.error(f"[IDLE Task {account_id}] Both username and email are empty for account ID {account_id}. Cannot login.")
-                         raise ValueError("Username and Email cannot both be empty.")
-                        
-                    # Password Entschlüsselung via Model-Methode (asynchron)
-                    # password = await database_sync_to_async(account.get_password)() # Entfernt
-                    # Verwende das übergebene Passwort
-                    password = decrypted_password
-                    if not password:
-                         logger.error(f"[IDLE Task {account_id}] No password provided to task or failed to decrypt earlier.")
-                         raise aioimaplib.Abort("Missing credentials")
-                    
-                    ssl_context = ssl.create_default_context()
-                    ssl_context.check_hostname = True
-                    ssl_context.verify_mode = ssl.CERT_REQUIRED
-                    
-                    # Connect with timeout
-                    try:
-                        imap_client = aioimaplib.IMAP4_SSL(
-                            host=account.imap_server,
-                            port=account.imap_port,
-                            ssl_context=ssl_context,
-                            timeout=60 # Erhöht von 15 auf 60 Sekunden
-                        )
-                        await imap_client.wait_hello_from_server()
-                    except asyncio.TimeoutError:
-                         logger.error(f"[IDLE Task {account_id}] Connection attempt timed out after 60s.")
-                         raise aioimaplib.Abort('Connection timeout')
-                    except Exception as conn_err:
-                         logger.error(f"[IDLE Task {account_id}] Connection failed: {conn_err}")
-                         raise aioimaplib.Abort(f'Connection failed: {conn_err}')
-
-                    # Login mit dem (potenziell Fallback) Benutzernamen
-                    logger.debug(f"[IDLE Task {account_id}] Attempting login with username: '{login_username}' and password: '*****'") # Log username
-                    await imap_client.login(login_username, password)
+                    imap_client = await _open_imap_connection(account, decrypted_password, account_id)
                     
                     # Select folder (initial selection)
-                    await imap_client.select(folder_to_monitor)
-                    
-                    # Fetch initial UIDs using FETCH 1:* (UID)
-                    logger.debug(f"[IDLE Task {account_id}] Fetching initial UIDs via FETCH 1:* (UID)")
-                    initial_fetch_resp = None
-                    try:
-                         initial_fetch_resp = await imap_client.fetch('1:*', '(UID)')
-                         logger.debug(f"[IDLE Task {account_id}] Initial FETCH response: {initial_fetch_resp}")
-                         
-                         # Parse die FETCH-Antwort
-                         initial_uids = set()
-                         if initial_fetch_resp and initial_fetch_resp.result == 'OK':
-                              for line in initial_fetch_resp.lines:
-                                   if isinstance(line, bytes): line = line.decode()
-                                   match = re.search(r'UID\s+(\d+)\)', line, re.IGNORECASE)
-                                   if match:
-                                        initial_uids.add(match.group(1))
-                         known_uids = initial_uids # Setze known_uids korrekt
-                         logger.info(f"[IDLE Task {account_id}] Initial UIDs in '{folder_to_monitor}': {len(known_uids)}")
-                         # Logge ein paar UIDs zur Kontrolle
-                         if known_uids:
-                              logger.debug(f"[IDLE Task {account_id}] Sample initial UIDs: {list(known_uids)[:10]}")
-
-                    except (aioimaplib.IMAP4.error, asyncio.TimeoutError, OSError) as init_fetch_err:
-                         logger.error(f"[IDLE Task {account_id}] Error fetching initial UIDs via FETCH: {init_fetch_err}. known_uids remains empty.")
-                         known_uids = set() # Sicherstellen, dass es leer ist bei Fehler
-                    except Exception as init_parse_err:
-                         logger.error(f"[IDLE Task {account_id}] Error parsing initial FETCH response: {init_parse_err}. known_uids remains empty.", exc_info=True)
-                         known_uids = set() # Sicherstellen, dass es leer ist bei Fehler
+                    select_resp = await imap_client.select(_quote_mailbox(folder_to_monitor))
+                    select_info = _parse_select_response(getattr(select_resp, 'lines', []))
+                    message_count = select_info['exists']
+                    logger.debug(f"[IDLE Task {account_id}] SELECT '{folder_to_monitor}': {select_info}")
+
+                    if select_info['uidvalidity'] is not None and uid_validity is not None and select_info['uidvalidity'] != uid_validity:
+                        logger.warning(f"[IDLE Task {account_id}] UIDVALIDITY changed ({uid_validity} -> {select_info['uidvalidity']}). Resetting UID state and triggering sync.")
+                        last_uid = None
+                        async_task('mailmind.imap.tasks.sync_folder_on_idle_update', account_id, folder_to_monitor)
+                    uid_validity = select_info['uidvalidity']
+
+                    if last_uid is None:
+                        # Erste Verbindung: Startpunkt aus UIDNEXT (kein FETCH 1:* nötig)
+                        if select_info['uidnext']:
+                            last_uid = select_info['uidnext'] - 1
+                        else:
+                            last_uid = max((int(uid) for uid in await _fetch_uids_above(imap_client, 0)), default=0) if message_count else 0
+                        logger.info(f"[IDLE Task {account_id}] Initial highest UID in '{folder_to_monitor}': {last_uid} ({message_count} messages)")
+                    else:
+                        # Reconnect: nachholen, was während der Unterbrechung ankam
+                        missed_uids = await _fetch_uids_above(imap_client, last_uid)
+                        if missed_uids:
+                            logger.info(f"[IDLE Task {account_id}] {len(missed_uids)} new UIDs since reconnect. Triggering folder sync task.")
+                            async_task('mailmind.imap.tasks.sync_folder_on_idle_update', account_id, folder_to_monitor)
+                            last_uid = max(int(uid) for uid in missed_uids)
+
+                    if notify_folders:
+                        # NOTIFY gilt pro Verbindung und muss nach jedem Reconnect neu gesetzt werden
+                        await _notify_set(imap_client, folder_to_monitor, notify_folders, account_id)
 
                     retry_delay = 5 # Reset retry delay on successful connect
                     logger.info(f"[IDLE Task {account_id}] Connection established successfully in {time.time() - connect_start_time:.2f}s.")
@@ -254,7 +551,7 @@ async def run_idle_for_account(account_id: int, decrypted_password: Optional[str
                     raise
 
                 # --- Process Results (nach wait_server_push) ---
-                # Logge, warum wait beendet wurde
+                responses = None
                 if stop_wait_task in done:
                     logger.info(f"[IDLE Task {account_id}] Stop event received. Exiting IDLE loop.")
                     if idle_wait_task in pending: idle_wait_task.cancel() # Cancel the wait task
@@ -263,109 +560,70 @@ async def run_idle_for_account(account_id: int, decrypted_password: Optional[str
                     try:
                         responses = idle_wait_task.result()
                         if responses:
-                             logger.info(f"[IDLE Task {account_id}] Received push notifications: {responses}. Proceeding with UID check.")
+                             logger.info(f"[IDLE Task {account_id}] Received push notifications: {responses}.")
                         else:
-                             logger.debug(f"[IDLE Task {account_id}] IDLE wait timed out after {wait_timeout}s. Proceeding with UID check.")
+                             logger.debug(f"[IDLE Task {account_id}] IDLE wait timed out after {wait_timeout}s.")
                     except asyncio.CancelledError:
                          logger.debug(f"[IDLE Task {account_id}] IDLE wait task cancelled before result (likely stop event).")
                          # Nicht breaken, damit die Verbindung sauber geschlossen wird
                     except Exception as e:
-                         logger.info(f"[IDLE Task {account_id}] IDLE responses konnten nicht verarbeitet werden (Timeout/Cancel): {e}. Proceeding with UID check anyway.")
+                         logger.info(f"[IDLE Task {account_id}] IDLE responses konnten nicht verarbeitet werden (Timeout/Cancel): {e}. Proceeding with delta check anyway.")
                 else:
                      # Sollte nicht passieren, da FIRST_COMPLETED verwendet wird
-                     logger.warning(f"[IDLE Task {account_id}] asyncio.wait finished unexpectedly without idle_wait_task or stop_wait_task in done set. Proceeding with UID check.")
-
-                # --- IMMER UIDs fetchen nach Beendigung von IDLE wait --- 
-                logger.info(f"[IDLE Task {account_id}] Exited IDLE. Fetching current UIDs for comparison...")
-                uid_response = None
+                     logger.warning(f"[IDLE Task {account_id}] asyncio.wait finished unexpectedly without idle_wait_task or stop_wait_task in done set. Proceeding with delta check.")
+                if stop_wait_task in pending: stop_wait_task.cancel()
+
+                # --- Ungetaggte EXISTS/EXPUNGE/FETCH-Antworten auswerten ---
+                pushed_exists, expunged_count, flags_changed = _parse_idle_push(responses)
+                if expunged_count and message_count is not None:
+                    message_count = max(message_count - expunged_count, 0)
+                if pushed_exists is not None:
+                    message_count = pushed_exists
+                logger.debug(f"[IDLE Task {account_id}] Push parsed: EXISTS={pushed_exists}, EXPUNGE={expunged_count}, FETCH={flags_changed}, message_count={message_count}")
+
+                # --- Delta: nur UIDs oberhalb der höchsten bekannten UID holen ---
                 try:
-                    # Versuche FETCH 1:* (UID)
-                        logger.debug(f"[IDLE Task {account_id}] Attempting FETCH 1:* (UID)")
-                        fetch_response = await imap_client.fetch('1:*', '(UID)')
-                        logger.debug(f"[IDLE Task {account_id}] FETCH 1:* (UID) response: {fetch_response}")
-                        
-                        # Parse die FETCH-Antwort, um UIDs zu extrahieren
-                        # Format: * N FETCH (UID XXXX)
-                        new_uids_after_idle = set()
-                        if fetch_response and fetch_response.result == 'OK':
-                            for line in fetch_response.lines:
-                                if isinstance(line, bytes): line = line.decode()
-                                # Einfache und robuste Suche nach "UID XXXX)"
-                                match = re.search(r'UID\s+(\d+)\)', line, re.IGNORECASE)
-                                if match:
-                                    new_uids_after_idle.add(match.group(1))
-                        
-                        # Logge das Ergebnis
-                        logger.debug(f"[IDLE Task {account_id}] Parsed UIDs from FETCH: {new_uids_after_idle}")
-                        logger.info(f"[IDLE Task {account_id}] UIDs after IDLE (from FETCH 1:*): {len(new_uids_after_idle)}")
-                        
-                        # Fallback, wenn Parsing fehlschlägt (sollte nicht passieren)
-                        if not new_uids_after_idle and fetch_response and fetch_response.result != 'OK':
-                             logger.warning(f"[IDLE Task {account_id}] Could not fetch UIDs after IDLE activity via FETCH 1:* (UID): {fetch_response.result}")
-                             new_uids_after_idle = set()
-                        elif not new_uids_after_idle and fetch_response and fetch_response.result == 'OK':
-                             logger.warning(f"[IDLE Task {account_id}] FETCH 1:* (UID) was OK but parsing yielded no UIDs. Lines: {fetch_response.lines}")
-                             new_uids_after_idle = set()
-
+                    added_uids = await _fetch_uids_above(imap_client, last_uid or 0)
                 except (aioimaplib.IMAP4.error, asyncio.TimeoutError, OSError) as fetch_err:
-                    logger.error(f"[IDLE Task {account_id}] Connection error fetching UIDs after IDLE: {fetch_err}. Will retry loop.", exc_info=False)
-                    # Trigger outer retry loop for connection issues
-                    raise aioimaplib.Abort("UID fetch connection error") # Trigger outer retry
-                except Exception as e:
-                    logger.error(f"[IDLE Task {account_id}] Unexpected error fetching UIDs after IDLE: {e}. Will retry loop.", exc_info=True)
-                    # Trigger outer retry loop for unexpected issues
-                    raise aioimaplib.Abort("UID fetch unexpected error") # Trigger outer retry
-
-
-                # --- Compare UIDs and start tasks (wenn fetch erfolgreich war) ---
-                if new_uids_after_idle is not None: # Nur wenn Fetch erfolgreich
-                    # --- Logge den Vergleich --- 
-                    logger.debug(f"[IDLE Task {account_id}] Comparing UIDs. Known: {known_uids}")
-                    added_uids = new_uids_after_idle - known_uids
-                    logger.debug(f"[IDLE Task {account_id}] Calculated added_uids: {added_uids}")
-                    removed_uids = known_uids - new_uids_after_idle
-                    logger.debug(f"[IDLE Task {account_id}] Calculated removed_uids: {removed_uids}")
-                    # --- ENDE LOG ---
-
-                    if added_uids:
-                        logger.info(f"[IDLE Task {account_id}] Detected {len(added_uids)} new UIDs: {list(added_uids)[:10]}... Triggering full folder sync task.")
-                        async_task('mailmind.imap.tasks.sync_folder_on_idle_update', account_id, folder_to_monitor)
-                        old_known_count = len(known_uids)
-                        known_uids.update(added_uids)
-                        logger.debug(f"[IDLE Task {account_id}] Updated known_uids. Old count: {old_known_count}, New count: {len(known_uids)}")
-
+                    logger.error(f"[IDLE Task {account_id}] Connection error fetching new UIDs after IDLE: {fetch_err}. Will retry loop.", exc_info=False)
+                    raise aioimaplib.Abort("UID delta fetch connection error") # Trigger outer retry
+
+                needs_sync = bool(added_uids) or expunged_count > 0 or flags_changed
+                if added_uids:
+                    logger.info(f"[IDLE Task {account_id}] Detected {len(added_uids)} new UIDs: {sorted(added_uids, key=int)[:10]}...")
+                    last_uid = max(int(uid) for uid in added_uids)
+                if expunged_count:
+                    logger.info(f"[IDLE Task {account_id}] Server reported {expunged_count} EXPUNGE(s).")
+                if needs_sync:
+                    # Der Sync-Task arbeitet inkrementell (neue UIDs, CHANGEDSINCE, VANISHED/MESSAGES-Vergleich)
+                    async_task('mailmind.imap.tasks.sync_folder_on_idle_update', account_id, folder_to_monitor)
+
+                # Über NOTIFY gemeldete Änderungen in anderen Ordnern
+                for changed_folder in _parse_status_pushes(responses):
+                    if changed_folder != folder_to_monitor:
+                        logger.info(f"[IDLE Task {account_id}] NOTIFY reported changes in '{changed_folder}'. Triggering folder sync task.")
+                        async_task('mailmind.imap.tasks.sync_folder_on_idle_update', account_id, changed_folder)
+
+                # --- Gelegentlicher vollständiger Abgleich (statt nach jedem Wake-up) ---
+                if time.time() - last_reconcile_at >= IDLE_RECONCILE_INTERVAL:
+                    logger.info(f"[IDLE Task {account_id}] Running UID reconciliation pass for '{folder_to_monitor}'...")
+                    try:
+                        server_uids = await _fetch_all_uids(imap_client)
+                    except (aioimaplib.IMAP4.error, asyncio.TimeoutError, OSError) as fetch_err:
+                        logger.error(f"[IDLE Task {account_id}] Connection error during reconciliation: {fetch_err}. Will retry loop.", exc_info=False)
+                        raise aioimaplib.Abort("UID reconciliation connection error")
+                    from mailmind.core.models import Email
+                    local_uids = set(await database_sync_to_async(
+                        lambda: list(Email.objects.filter(account_id=account_id, folder_name=folder_to_monitor, is_deleted_on_server=False, uid__isnull=False).values_list('uid', flat=True))
+                    )())
+                    removed_uids = local_uids - server_uids
                     if removed_uids:
-                        logger.info(f"[IDLE Task {account_id}] Detected {len(removed_uids)} removed UIDs: {list(removed_uids)[:10]}... Marking as deleted in DB.")
-                        async def mark_emails_deleted_and_notify(account_id, folder_name, removed_uids):
-                            from mailmind.core.models import Email, EmailAccount
-                            from django.db.models import Q
-                            from channels.layers import get_channel_layer
-                            from asgiref.sync import async_to_sync
-                            try:
-                                # ORM-Operationen asynchron
-                                account_obj = await database_sync_to_async(EmailAccount.objects.get)(id=account_id)
-                                emails_to_update = Email.objects.filter(account=account_obj, folder_name=folder_name, uid__in=removed_uids, is_deleted_on_server=False)
-                                updated_count = await database_sync_to_async(emails_to_update.update)(is_deleted_on_server=True)
-                                logger.info(f"[IDLE Task {account_id}] Marked {updated_count} emails as deleted in DB (folder: {folder_name}).")
-                                # WebSocket-Event anstoßen
-                                try:
-                                    user_id = await database_sync_to_async(lambda acc: acc.user.id)(account_obj)
-                                    group_name = f'user_{user_id}_events'
-                                    message = {
-                                        'type': 'email.refresh',
-                                        'payload': {'folder': folder_name}
-                                    }
-                                    await database_sync_to_async(async_to_sync(get_channel_layer().group_send))(group_name, message)
-                                    logger.info(f"[IDLE Task {account_id}] WebSocket-Event 'email.refresh' an Gruppe {group_name} gesendet (wegen Löschung).")
-                                except Exception as ws_err:
-                                    logger.error(f"[IDLE Task {account_id}] WebSocket-Event 'email.refresh' fehlgeschlagen: {ws_err}", exc_info=True)
-                            except Exception as del_err:
-                                logger.error(f"[IDLE Task {account_id}] Fehler beim Markieren gelöschter UIDs: {del_err}", exc_info=True)
-                        await mark_emails_deleted_and_notify(account_id, folder_to_monitor, removed_uids)
-                    # else: # Optional: Log, wenn keine neuen UIDs gefunden wurden
-                    #    logger.debug(f"[IDLE Task {account_id}] No new UIDs detected after comparison.")
-                # else: # Fetch der UIDs ist fehlgeschlagen (Fehler wurde oben geloggt)
-                #    logger.warning(f"[IDLE Task {account_id}] Could not compare UIDs because fetching failed.")
+                        logger.info(f"[IDLE Task {account_id}] Reconciliation found {len(removed_uids)} removed UIDs: {list(removed_uids)[:10]}...")
+                        await _mark_emails_deleted_and_notify(account_id, folder_to_monitor, removed_uids)
+                    if server_uids - local_uids and not needs_sync:
+                        async_task('mailmind.imap.tasks.sync_folder_on_idle_update', account_id, folder_to_monitor)
+                    message_count = len(server_uids)
+                    last_reconcile_at = time.time()
 
                 logger.debug(f"[IDLE Task {account_id}] Pausing briefly before next IDLE cycle...")
                 await asyncio.sleep(1) # Kurze Pause vor dem nächsten IDLE
@@ -429,16 +687,137 @@ async def run_idle_for_account(account_id: int, decrypted_password: Optional[str
             await imap_client.close() # close() handles checks internally
             logger.info(f"[IDLE Task {account_id}] Connection closed.")
 
-    logger.info(f"[IDLE Task {account_id}] Task finished.")
-    # Entferne Task aus dem globalen Dictionary, wenn er beendet wird
-    if account_id in running_idle_tasks:
-        del running_idle_tasks[account_id]
+    logger.info(f"[IDLE Task {account_id}] Task for folder '{folder_to_monitor}' finished.")
+
+# --- Account-spezifischer IDLE Scheduler ---
+async def run_idle_for_account(account_id: int, decrypted_password: Optional[str]):
+    """Überwacht mehrere Ordner eines Kontos mit begrenzter Anzahl an Verbindungen.
+
+    Unterstützt der Server NOTIFY (RFC 5465), reicht eine IDLE-Verbindung auf INBOX, die Änderungen
+    aller überwachten Ordner meldet. Sonst erhalten die IMAP_IDLE_CONNECTIONS_PER_ACCOUNT wichtigsten
+    bzw. zuletzt aktiven Ordner eine IDLE-Verbindung und die übrigen werden über eine Steuerverbindung
+    per STATUS abgefragt.
+    """
+    from mailmind.core.models import EmailAccount # Import hier, da in async context
+
+    logger.info(f"[IDLE Task {account_id}] Starting folder scheduler for account {account_id}")
+    control_client = None
+    retry_delay = 5
+    idle_tasks: Dict[str, asyncio.Task] = {}
+    folders: List[str] = []
+    use_notify = False
+    status_cache: Dict[str, Dict[str, Optional[int]]] = {}
+    last_activity: Dict[str, float] = {}
+    folders_listed_at = 0.0
+
+    try:
+        while not _manager_stop_event.is_set():
+            try:
+                # 1. Steuerverbindung (LIST/STATUS) aufbauen
+                if control_client is None:
+                    account = await database_sync_to_async(EmailAccount.objects.get)(id=account_id, is_active=True)
+                    control_client = await _open_imap_connection(account, decrypted_password, account_id)
+                    folders_listed_at = 0.0
+
+                # 2. Ordnerliste gelegentlich aktualisieren
+                if time.time() - folders_listed_at >= IDLE_RECONCILE_INTERVAL:
+                    previous_folders = folders
+                    folders = await _list_watchable_folders(control_client, account_id)
+                    use_notify = IDLE_USE_NOTIFY and await _supports_notify(control_client, account_id)
+                    if not status_cache:
+                        status_cache = await _load_folder_baselines(account_id)
+                    folders_listed_at = time.time()
+                    logger.info(f"[IDLE Task {account_id}] Watching {len(folders)} folders ({'NOTIFY' if use_notify else f'IDLE budget {IDLE_CONNECTIONS_PER_ACCOUNT} + STATUS polling'}).")
+                    if use_notify and previous_folders and previous_folders != folders:
+                        # NOTIFY SET mit neuer Ordnerliste erfordert eine neue IDLE-Verbindung
+                        await _stop_idle_tasks(idle_tasks, list(idle_tasks))
+
+                # 3. IDLE-Verbindungen zuteilen (NOTIFY: eine; sonst Budget mit Rotation)
+                if use_notify:
+                    desired = folders[:1]
+                    poll_interval = IDLE_RECONCILE_INTERVAL # Nur Sicherheitsabgleich, NOTIFY meldet Änderungen
+                else:
+                    desired = _select_idle_folders(folders, IDLE_CONNECTIONS_PER_ACCOUNT, last_activity)
+                    poll_interval = IDLE_STATUS_POLL_INTERVAL
+                rotated_away = []
+                for folder_name, task in list(idle_tasks.items()):
+                    if task.done():
+                        if not task.cancelled() and task.exception():
+                            logger.error(f"[IDLE Task {account_id}] IDLE task for '{folder_name}' finished with error: {task.exception()}")
+                        del idle_tasks[folder_name]
+                    elif folder_name not in desired:
+                        logger.info(f"[IDLE Task {account_id}] Rotating IDLE connection away from '{folder_name}'.")
+                        rotated_away.append(folder_name)
+                # Alte Verbindungen erst schließen, damit das Verbindungsbudget nicht überschritten wird
+                await _stop_idle_tasks(idle_tasks, rotated_away)
+                for folder_name in rotated_away:
+                    # Während IDLE wurde der STATUS-Stand nicht gepflegt: beim nächsten Poll neu vom Server holen
+                    status_cache.pop(folder_name, None)
+                for folder_name in desired:
+                    if folder_name not in idle_tasks:
+                        notify_folders = folders if use_notify else None
+                        idle_tasks[folder_name] = asyncio.create_task(
+                            run_idle_for_folder(account_id, decrypted_password, folder_name, notify_folders)
+                        )
+
+                # 4. Übrige Ordner per STATUS abfragen
+                for folder_name in folders:
+                    if folder_name in idle_tasks:
+                        continue
+                    if await _poll_folder_status(control_client, account_id, folder_name, status_cache):
+                        logger.info(f"[IDLE Task {account_id}] STATUS change detected in '{folder_name}'. Triggering folder sync task.")
+                        last_activity[folder_name] = time.time()
+                        async_task('mailmind.imap.tasks.sync_folder_on_idle_update', account_id, folder_name)
+
+                retry_delay = 5
+                try:
+                    await asyncio.wait_for(_manager_stop_event.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            except EmailAccount.DoesNotExist:
+                logger.warning(f"[IDLE Task {account_id}] Account {account_id} not found or inactive. Stopping scheduler.")
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[IDLE Task {account_id}] Scheduler error: {e}. Retrying in {retry_delay}s...", exc_info=True)
+                if control_client:
+                    try:
+                        await control_client.close()
+                    except Exception:
+                        pass
+                control_client = None
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 300)
+
+    except asyncio.CancelledError:
+        logger.info(f"[IDLE Task {account_id}] Scheduler cancelled.")
+    finally:
+        await _stop_idle_tasks(idle_tasks, list(idle_tasks))
+        if control_client:
+            try:
+                if control_client.is_logged_in(): await control_client.logout()
+            except Exception as logout_err:
+                logger.error(f"[IDLE Task {account_id}] Error during control connection logout: {logout_err}")
+            finally:
+                await control_client.close()
+        logger.info(f"[IDLE Task {account_id}] Scheduler finished.")
+        # Entferne Task aus dem globalen Dictionary, wenn er beendet wird
+        if account_id in running_idle_tasks:
+            del running_idle_tasks[account_id]
 
 # --- Manager Task ---
-async def manage_idle_connections():
-    """Verwaltet die IDLE-Tasks für alle aktiven Konten."""
+async def manage_idle_connections(shard_coordinator=None):
+    """Verwaltet die IDLE-Tasks für alle aktiven Konten.
+
+    Mit einem IdleShardCoordinator (Worker-Modus, siehe idle_sharding.py) werden nur die Konten
+    des eigenen Shards überwacht, für die dieser Worker den Lease hält.
+    """
     from mailmind.core.models import EmailAccount # Import hier
     logger.info("[IDLE Manager] Starting connection management loop...")
+    last_lease_renewal = time.time()
+    held_account_ids = set()
     while not _manager_stop_event.is_set():
         try:
             # Hole aktive Konten-Objekte statt nur IDs, um Passwörter zu holen
@@ -449,6 +828,17 @@ async def manage_idle_connections():
             active_account_ids = set(acc.id for acc in active_accounts_list)
             current_task_ids = set(running_idle_tasks.keys())
 
+            if shard_coordinator:
+                # Nur Konten des eigenen Shards, für die wir den Lease halten (Rebalancing bei Worker-Änderungen)
+                workers = await asyncio.to_thread(shard_coordinator.heartbeat)
+                assigned_ids = shard_coordinator.assigned_accounts(active_account_ids, workers)
+                active_account_ids = await asyncio.to_thread(shard_coordinator.claim, assigned_ids)
+                held_account_ids = set(active_account_ids)
+                last_lease_renewal = time.time()
+                if len(active_account_ids) < len(assigned_ids):
+                    logger.info(f"[IDLE Manager] {len(assigned_ids) - len(active_account_ids)} assigned accounts are still leased by another worker. Retrying next cycle.")
+                logger.debug(f"[IDLE Manager] Shard of {shard_coordinator.worker_id}: {len(assigned_ids)} of {len(active_accounts_list)} accounts ({len(workers)} workers).")
+
             # Erstelle ein Dict ID -> Account-Objekt für einfachen Zugriff
             active_accounts_dict = {acc.id: acc for acc in active_accounts_list}
 
@@ -514,24 +904,39 @@ async def manage_idle_connections():
                          task = asyncio.create_task(run_idle_for_account(acc_id, decrypted_password))
                          running_idle_tasks[acc_id] = task
 
-            # Stoppe Tasks für inaktive/gelöschte Konten
+            # Stoppe Tasks für inaktive/gelöschte (bzw. an andere Worker abgegebene) Konten
+            stopped_tasks = {}
             for acc_id in current_task_ids:
                 if acc_id not in active_account_ids:
-                    logger.info(f"[IDLE Manager] Account {acc_id} is no longer active. Stopping IDLE task...")
+                    logger.info(f"[IDLE Manager] Account {acc_id} is no longer active or assigned. Stopping IDLE task...")
                     task = running_idle_tasks.get(acc_id)
                     if task and not task.done():
                         task.cancel()
+                        stopped_tasks[acc_id] = task
                     # Task wird sich selbst aus running_idle_tasks entfernen
+            if shard_coordinator and stopped_tasks:
+                # Lease erst nach dem Logout freigeben, damit der neue Besitzer nicht parallel IDLE startet
+                await asyncio.wait(list(stopped_tasks.values()), timeout=30)
+                await asyncio.to_thread(shard_coordinator.release, stopped_tasks.keys())
 
             logger.debug(f"[IDLE Manager] Active accounts: {len(active_account_ids)}, Running tasks: {len(running_idle_tasks)}")
-            # Warte 60 Sekunden bis zur nächsten Prüfung
-            await asyncio.sleep(60)
+            # Warte 60 Sekunden bis zur nächsten Prüfung (oder bis zum Stop-Signal)
+            try:
+                await asyncio.wait_for(_manager_stop_event.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                pass
 
         except asyncio.CancelledError:
              logger.info("[IDLE Manager] Management loop cancelled.")
              break
         except Exception as e:
             logger.error(f"[IDLE Manager] Error in management loop: {e}. Retrying in 60s...", exc_info=True)
+            if shard_coordinator and time.time() - last_lease_renewal > shard_coordinator.lease_ttl:
+                # Leases sind abgelaufen und evtl. schon von anderen Workern übernommen
+                logger.warning("[IDLE Manager] Could not renew account leases in time. Stopping all IDLE tasks of this worker.")
+                for task in list(running_idle_tasks.values()):
+                    if not task.done():
+                        task.cancel()
             await asyncio.sleep(60)
 
     # Aufräumen beim Stoppen des Managers
@@ -543,6 +948,12 @@ async def manage_idle_connections():
     # Warte auf das Beenden der Tasks (optional, mit Timeout)
     if tasks_to_stop:
         await asyncio.wait(tasks_to_stop, timeout=30)
+    if shard_coordinator:
+        try:
+            await asyncio.to_thread(shard_coordinator.release, held_account_ids)
+            await asyncio.to_thread(shard_coordinator.leave)
+        except Exception as shard_err:
+            logger.error(f"[IDLE Manager] Error releasing shard leases: {shard_err}")
     logger.info("[IDLE Manager] Stopped.")
 
 
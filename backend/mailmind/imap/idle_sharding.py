@@ -0,0 +1,130 @@
+"""
+Sharding der IDLE-Verbindungen über mehrere Worker-Prozesse/Hosts.
+
+Jeder Worker registriert sich mit einem Heartbeat in einem Redis Sorted Set. Aus den
+lebenden Workern wird ein Consistent-Hash-Ring gebildet; jeder Worker überwacht nur die
+Konten, die auf ihn abgebildet werden. Zusätzlich wird jedes Konto über einen Lease-Key
+(SET NX EX) reserviert, damit ein Konto beim Rebalancing (Worker kommt hinzu / fällt weg)
+nie von zwei Workern gleichzeitig überwacht wird: der neue Besitzer übernimmt erst, wenn
+der alte den Lease freigegeben hat oder dieser abgelaufen ist.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Iterable, List, Optional, Set
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+IDLE_REDIS_URL = getattr(settings, 'IMAP_IDLE_REDIS_URL', 'redis://redis:6379/2')
+IDLE_SHARD_VNODES = getattr(settings, 'IMAP_IDLE_SHARD_VNODES', 64) # Virtuelle Knoten pro Worker im Ring
+IDLE_WORKER_TTL = getattr(settings, 'IMAP_IDLE_WORKER_TTL', 3 * 60) # Worker ohne Heartbeat gelten danach als tot
+IDLE_LEASE_TTL = getattr(settings, 'IMAP_IDLE_LEASE_TTL', 3 * 60) # Muss > Intervall von manage_idle_connections sein
+
+WORKERS_KEY = 'mailmind:imap_idle:workers'
+LEASE_KEY_PREFIX = 'mailmind:imap_idle:lease:'
+
+# Verlängert/löscht einen Lease nur, wenn er noch diesem Worker gehört
+_RENEW_LEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _ring_hash(value: str) -> int:
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def _lease_key(account_id: int) -> str:
+    return f"{LEASE_KEY_PREFIX}{account_id}"
+
+
+class HashRing:
+    """Consistent-Hash-Ring mit virtuellen Knoten; ein neuer/entfernter Worker verschiebt nur ~1/N der Konten."""
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = IDLE_SHARD_VNODES):
+        self._ring = sorted((_ring_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(vnodes))
+        self._hashes = [ring_hash for ring_hash, _ in self._ring]
+
+    def get_node(self, key) -> Optional[str]:
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._hashes, _ring_hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+class IdleShardCoordinator:
+    """Worker-Registrierung, Shard-Zuordnung und Account-Leases für einen IDLE-Worker."""
+
+    def __init__(self, worker_id: Optional[str] = None, redis_url: str = IDLE_REDIS_URL):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_ttl = IDLE_LEASE_TTL
+        self._redis = redis.Redis.from_url(redis_url, decode_responses=True)
+        self._renew_script = self._redis.register_script(_RENEW_LEASE_LUA)
+        self._release_script = self._redis.register_script(_RELEASE_LEASE_LUA)
+
+    def heartbeat(self) -> List[str]:
+        """Registriert/erneuert diesen Worker, entfernt tote Worker und gibt die lebenden Worker zurück."""
+        now = time.time()
+        pipe = self._redis.pipeline()
+        pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+        pipe.zremrangebyscore(WORKERS_KEY, '-inf', now - IDLE_WORKER_TTL)
+        pipe.zrange(WORKERS_KEY, 0, -1)
+        workers = pipe.execute()[-1]
+        return sorted(workers)
+
+    def leave(self):
+        """Meldet den Worker ab, damit die übrigen sofort rebalancen."""
+        self._redis.zrem(WORKERS_KEY, self.worker_id)
+
+    def assigned_accounts(self, account_ids: Iterable[int], workers: List[str]) -> Set[int]:
+        """Konten, die laut Hash-Ring diesem Worker gehören."""
+        ring = HashRing(workers or [self.worker_id])
+        return {account_id for account_id in account_ids if ring.get_node(account_id) == self.worker_id}
+
+    def claim(self, account_ids: Iterable[int]) -> Set[int]:
+        """Reserviert bzw. verlängert die Leases; gibt die Konten zurück, deren Lease dieser Worker hält."""
+        account_ids = list(account_ids)
+        if not account_ids:
+            return set()
+        pipe = self._redis.pipeline()
+        for account_id in account_ids:
+            pipe.set(_lease_key(account_id), self.worker_id, nx=True, ex=IDLE_LEASE_TTL)
+        acquired = pipe.execute()
+
+        held = {account_id for account_id, ok in zip(account_ids, acquired) if ok}
+        # Nicht neu erworbene Leases: verlängern, falls sie bereits uns gehören
+        to_renew = [account_id for account_id, ok in zip(account_ids, acquired) if not ok]
+        if to_renew:
+            pipe = self._redis.pipeline()
+            for account_id in to_renew:
+                self._renew_script(keys=[_lease_key(account_id)], args=[self.worker_id, IDLE_LEASE_TTL], client=pipe)
+            for account_id, renewed in zip(to_renew, pipe.execute()):
+                if renewed:
+                    held.add(account_id)
+        return held
+
+    def release(self, account_ids: Iterable[int]):
+        """Gibt die Leases frei (nur, wenn sie noch diesem Worker gehören)."""
+        account_ids = list(account_ids)
+        if not account_ids:
+            return
+        pipe = self._redis.pipeline()
+        for account_id in account_ids:
+            self._release_script(keys=[_lease_key(account_id)], args=[self.worker_id], client=pipe)
+        pipe.execute()
+        logger.info(f"[IDLE Shard {self.worker_id}] Released {len(account_ids)} account leases.")
@@ -88,6 +88,17 @@ def _extract_conversation_id(headers_lower: dict) -> Optional[str]:
         
     return gm_thrid if gm_thrid else conv_id_fallback
 
+def map_flags_to_db(flags: Union[set, list, tuple]) -> Dict[str, bool]:
+    """Maps IMAP system flags to the boolean flag fields of the Email model."""
+    flags_set = set(flags or [])
+    return {
+        'is_read': MailMessageFlags.SEEN in flags_set,
+        'is_flagged': MailMessageFlags.FLAGGED in flags_set,
+        'is_replied': MailMessageFlags.ANSWERED in flags_set,
+        'is_deleted_on_server': MailMessageFlags.DELETED in flags_set,
+        'is_draft': MailMessageFlags.DRAFT in flags_set,
+    }
+
 def _extract_common_metadata(uid: str, folder_name: str, account_email: str, subject: str,
                              from_values: Optional[Any], date_str: Optional[str], date_obj: Optional[datetime],
                              flags: Union[set, list], headers_lower: dict, size_rfc822: Optional[int]) -> dict:
@@ -143,12 +154,12 @@ def _extract_common_metadata(uid: str, folder_name: str, account_email: str, sub
         received_at_dt = dt_to_use
 
     # --- Flags --- 
-    flags_set = set(flags)
-    is_read = MailMessageFlags.SEEN in flags_set
-    is_flagged = MailMessageFlags.FLAGGED in flags_set
-    is_replied = MailMessageFlags.ANSWERED in flags_set
-    is_deleted_on_server = MailMessageFlags.DELETED in flags_set
-    is_draft = MailMessageFlags.DRAFT in flags_set
+    flag_fields = map_flags_to_db(flags)
+    is_read = flag_fields['is_read']
+    is_flagged = flag_fields['is_flagged']
+    is_replied = flag_fields['is_replied']
+    is_deleted_on_server = flag_fields['is_deleted_on_server']
+    is_draft = flag_fields['is_draft']
 
     # --- Konversations-ID ---
     conversation_id = _extract_conversation_id(headers_lower)
@@ -6,14 +6,22 @@ import base64 # Import base64
 from django.utils import timezone
 from django.conf import settings
 from django.core.files.base import ContentFile # Import ContentFile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.utils.text import get_valid_filename
+import hashlib
 from imap_tools import MailMessage
-from mailmind.core.models import Email, Contact, Attachment, EmailAccount, User
-from .mapper import map_metadata_to_db, map_full_email_to_db, map_metadata_from_dict
+from mailmind.core.models import Email, Contact, Attachment, AttachmentBlob, EmailAccount, User, EmailFolderSyncState, attachment_upload_path, attachment_blob_upload_path
+from .mapper import map_metadata_to_db, map_full_email_to_db, map_metadata_from_dict, map_flags_to_db
 from .utils import decode_email_header, FOLDER_PRIORITIES
 from typing import List, Dict, Any, Optional, Tuple
-from datetime import datetime
+from datetime import datetime, timedelta
 from types import SimpleNamespace
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Least
+import threading
+from collections import OrderedDict
 # --- Markdown Imports --- 
 # Remove unused BeautifulSoup and re
 # from bs4 import BeautifulSoup 
@@ -113,27 +121,6 @@ def get_folder_priority(folder_name: str) -> int:
     # Fallback auf Standard-Priorität
     return FOLDER_PRIORITIES["__default__"] # Unbekannte Ordner bekommen Standard-Priorität
 
-def _get_or_create_contact(user, address_info):
-    """Hilfsfunktion zum Abrufen oder Erstellen eines Kontakts."""
-    if not address_info or not address_info.email:
-        return None
-    
-    email = address_info.email.lower().strip()
-    name = decode_email_header(address_info.name) if address_info.name else email.split('@')[0]
-    
-    contact, created = Contact.objects.get_or_create(
-        user=user,
-        email=email,
-        defaults={'name': name}
-    )
-    if created:
-        logger.debug(f"Created new contact: {name} <{email}>")
-    # Optional: Update name if different?
-    # elif contact.name != name:
-    #     contact.name = name
-    #     contact.save(update_fields=['name'])
-    return contact
-
 def _process_attachments(msg: MailMessage, email_instance: Email):
     """Processes and saves attachments from a MailMessage object."""
     saved_attachments = []
@@ -230,61 +217,251 @@ def _update_or_create_email(account: EmailAccount, uid: str, folder_name: str, d
 
     return email_instance, created
 
+# Mapping der Adresslisten aus dem Mapper-Dict auf die ManyToMany-Felder von Email
+ADDRESS_FIELDS_MAP = {
+    'to_addresses': 'to_contacts',
+    'cc_addresses': 'cc_contacts',
+    'bcc_addresses': 'bcc_contacts',
+    'reply_to_addresses': 'reply_to_contacts',
+}
+
+# Prozesslokaler LRU-Cache: (user_id, email) -> contact_id
+CONTACT_CACHE_SIZE = getattr(settings, 'IMAP_CONTACT_CACHE_SIZE', 10000)
+_contact_id_cache: "OrderedDict[Tuple[int, str], int]" = OrderedDict()
+_contact_cache_lock = threading.Lock()
+
+def _contact_cache_get(user_id: int, email: str) -> Optional[int]:
+    key = (user_id, email)
+    with _contact_cache_lock:
+        contact_id = _contact_id_cache.get(key)
+        if contact_id is not None:
+            _contact_id_cache.move_to_end(key)
+        return contact_id
+
+def _contact_cache_put(user_id: int, email: str, contact_id: int):
+    key = (user_id, email)
+    with _contact_cache_lock:
+        _contact_id_cache[key] = contact_id
+        _contact_id_cache.move_to_end(key)
+        while len(_contact_id_cache) > CONTACT_CACHE_SIZE:
+            _contact_id_cache.popitem(last=False)
+
+def clear_contact_cache():
+    """Leert den prozesslokalen Kontakt-Cache (z.B. nach gelöschten Kontakten)."""
+    with _contact_cache_lock:
+        _contact_id_cache.clear()
+
+def _normalize_address_item(addr_info_item: Any) -> Optional[SimpleNamespace]:
+    """Normalizes dict/tuple/object address representations to a SimpleNamespace(name, email)."""
+    if isinstance(addr_info_item, dict):
+        addr_info_obj = SimpleNamespace(name=addr_info_item.get('name'), email=addr_info_item.get('email'))
+    elif isinstance(addr_info_item, tuple) and len(addr_info_item) > 1:
+        # Fallback für Tuple (name, email)
+        addr_info_obj = SimpleNamespace(name=addr_info_item[0], email=addr_info_item[1])
+    elif hasattr(addr_info_item, 'email'): # Prüfe auf Objekt mit .email Attribut
+        addr_info_obj = addr_info_item
+    else:
+        logger.warning(f"Skipping unknown address format: {type(addr_info_item)} - {addr_info_item}")
+        return None
+    if not addr_info_obj.email:
+        return None
+    return addr_info_obj
+
+def resolve_contacts_bulk(user: User, address_infos: List[Any]) -> Dict[str, int]:
+    """Resolves many addresses to contact ids for a user with a constant number of queries.
+
+    Cached ids are taken from the per-process LRU cache, the rest is fetched with one
+    email__in query; missing contacts are created with bulk_create(ignore_conflicts=True)
+    and re-read.
+
+    Returns:
+        Dict mapping the normalized (lowercased) email address to the contact id.
+    """
+    names_by_email: Dict[str, str] = {}
+    for item in address_infos:
+        addr_info_obj = _normalize_address_item(item)
+        if not addr_info_obj:
+            continue
+        email = addr_info_obj.email.lower().strip()
+        if email and email not in names_by_email:
+            names_by_email[email] = decode_email_header(addr_info_obj.name) if addr_info_obj.name else email.split('@')[0]
+
+    resolved: Dict[str, int] = {}
+    for email in names_by_email:
+        contact_id = _contact_cache_get(user.id, email)
+        if contact_id is not None:
+            resolved[email] = contact_id
+
+    missing = [email for email in names_by_email if email not in resolved]
+    if missing:
+        for contact_id, email in Contact.objects.filter(user=user, email__in=missing).values_list('id', 'email'):
+            resolved[email] = contact_id
+        to_create = [email for email in missing if email not in resolved]
+        if to_create:
+            Contact.objects.bulk_create(
+                [Contact(user=user, email=email, name=names_by_email[email]) for email in to_create],
+                ignore_conflicts=True,
+            )
+            for contact_id, email in Contact.objects.filter(user=user, email__in=to_create).values_list('id', 'email'):
+                resolved[email] = contact_id
+            logger.debug(f"Bulk-created up to {len(to_create)} contacts for user {user.id}.")
+            unresolved = set(to_create) - set(resolved)
+            if unresolved:
+                # Contact.email ist global unique - Adressen, die einem anderen User gehören, werden übersprungen
+                logger.warning(f"Could not resolve {len(unresolved)} contact(s) for user {user.id} (owned by another user?): {list(unresolved)[:10]}")
+        for email in missing:
+            if email in resolved:
+                _contact_cache_put(user.id, email, resolved[email])
+
+    return resolved
+
+def update_contacts_for_emails_bulk(emails_with_data: List[Tuple[Email, dict]], user: User):
+    """Sets the to/cc/bcc/reply_to contacts for a batch of emails.
+
+    All addresses of the batch are resolved at once via resolve_contacts_bulk; the M2M
+    through-rows are replaced with one delete and one bulk_create per field.
+    As before, a field is only touched when the email carries a non-empty address list.
+    """
+    if not emails_with_data:
+        return
+
+    all_addresses = []
+    for email_instance, contact_data in emails_with_data:
+        for address_list_key in ADDRESS_FIELDS_MAP:
+            all_addresses.extend(contact_data.get(address_list_key) or [])
+    if not all_addresses:
+        return
+
+    try:
+        contact_ids = resolve_contacts_bulk(user, all_addresses)
+        with transaction.atomic(): # Eigene Transaktion für Kontakt-Updates
+            for address_list_key, m2m_field_name in ADDRESS_FIELDS_MAP.items():
+                through_model = getattr(Email, m2m_field_name).through
+                email_ids = []
+                rows = []
+                for email_instance, contact_data in emails_with_data:
+                    address_list = contact_data.get(address_list_key) or []
+                    if not address_list: # Wenn Liste leer oder nicht vorhanden, überspringen
+                        continue
+                    email_ids.append(email_instance.id)
+                    seen_contact_ids = set()
+                    for item in address_list:
+                        addr_info_obj = _normalize_address_item(item)
+                        if not addr_info_obj:
+                            continue
+                        contact_id = contact_ids.get(addr_info_obj.email.lower().strip())
+                        if contact_id and contact_id not in seen_contact_ids:
+                            seen_contact_ids.add(contact_id)
+                            rows.append(through_model(email_id=email_instance.id, contact_id=contact_id))
+                if not email_ids:
+                    continue
+                through_model.objects.filter(email_id__in=email_ids).delete()
+                through_model.objects.bulk_create(rows, ignore_conflicts=True)
+                logger.debug(f"Updated {m2m_field_name} for {len(email_ids)} emails with {len(rows)} links.")
+    except Exception as e:
+        # Veraltete Cache-Einträge (gelöschte Kontakte) verwerfen, damit der nächste Lauf neu auflöst
+        clear_contact_cache()
+        logger.error(f"Error updating contacts for {len(emails_with_data)} emails: {e}", exc_info=True)
+
 def _update_contacts_for_email(email_instance: Email, contact_data: dict, user: User):
     """Aktualisiert die ManyToMany-Kontaktfelder für eine Email-Instanz."""
     if not email_instance or not contact_data:
         return
+    update_contacts_for_emails_bulk([(email_instance, contact_data)], user)
 
-    address_fields_map = {
-        'to_addresses': 'to_contacts',
-        'cc_addresses': 'cc_contacts',
-        'bcc_addresses': 'bcc_contacts',
-        'reply_to_addresses': 'reply_to_contacts',
-    }
+ATTACHMENT_SPOOL_DIR = getattr(settings, 'IMAP_ATTACHMENT_SPOOL_DIR', 'attachments/spool')
+ATTACHMENT_DEDUP_ENABLED = getattr(settings, 'IMAP_ATTACHMENT_DEDUP', True) # Inhaltsadressierte Ablage (AttachmentBlob)
+
+def stage_attachment_payloads(db_data: Dict[str, Any], account_id: int) -> Dict[str, Any]:
+    """Writes the attachment payloads of a mapped email to the attachment storage (spool).
 
+    The bytes in each attachment dict are replaced by 'storage_key', 'size' and 'sha256', so only
+    references go through the task queue. _process_attachments_from_dict moves the spooled file
+    to its final location. Content that already has an AttachmentBlob is not spooled at all; the
+    dict then only carries 'sha256', 'size' and 'blob_exists'.
+    """
+    for att_data in db_data.get('attachments') or []:
+        payload = att_data.pop('payload', None)
+        payload_b64 = att_data.pop('payload_base64', None)
+        if payload is None and payload_b64:
+            payload = base64.b64decode(payload_b64)
+        if payload is None:
+            continue
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        att_data['size'] = len(payload)
+        att_data['sha256'] = hashlib.sha256(payload).hexdigest()
+        if ATTACHMENT_DEDUP_ENABLED and AttachmentBlob.objects.filter(sha256=att_data['sha256'], ref_count__gt=0).exists():
+            # Inhalt liegt bereits als Blob vor: nichts schreiben, nur die Referenz weitergeben
+            att_data['blob_exists'] = True
+            continue
+        safe_name = get_valid_filename(att_data.get('filename') or '') or 'attachment'
+        spool_name = f"{ATTACHMENT_SPOOL_DIR}/account_{account_id}/{uuid.uuid4().hex}_{safe_name}"
+        att_data['storage_key'] = default_storage.save(spool_name, ContentFile(payload))
+    return db_data
+
+def move_stored_file(storage_key: str, target_name: str) -> str:
+    """Moves a stored file (e.g. a spooled attachment) to target_name (rename on local storage, copy+delete otherwise)."""
     try:
-        with transaction.atomic(): # Eigene Transaktion für Kontakt-Updates
-            for address_list_key, m2m_field_name in address_fields_map.items():
-                address_list = contact_data.get(address_list_key, [])
-                if not address_list: # Wenn Liste leer oder nicht vorhanden, überspringen
-                    continue
-                
-                contact_instances = []
-                for addr_info_item in address_list: # Umbenannt von addr_info_tuple
-                    # Erstelle addr_info_obj (SimpleNamespace) konsistent,
-                    # egal ob das Item ein Tuple oder Dict ist.
-                    addr_info_obj = None
-                    if isinstance(addr_info_item, dict):
-                        addr_info_obj = SimpleNamespace(name=addr_info_item.get('name'), email=addr_info_item.get('email'))
-                    elif isinstance(addr_info_item, tuple) and len(addr_info_item) > 1:
-                         # Fallback für Tuple (name, email)
-                        addr_info_obj = SimpleNamespace(name=addr_info_item[0], email=addr_info_item[1])
-                    elif hasattr(addr_info_item, 'email'): # Prüfe auf Objekt mit .email Attribut
-                        addr_info_obj = addr_info_item # Direkt verwenden
-                    else:
-                         logger.warning(f"Skipping unknown address format in list for email {email_instance.id}: {type(addr_info_item)} - {addr_info_item}")
-                         continue # Überspringe dieses Item
-
-                    # Stelle sicher, dass wir ein Objekt haben, bevor wir es weitergeben
-                    if addr_info_obj:
-                        contact = _get_or_create_contact(user, addr_info_obj)
-                        if contact:
-                            contact_instances.append(contact)
-                    # else: Fehler wurde bereits geloggt
-                
-                # Hole das ManyToMany-Feld und setze die Kontakte
-                m2m_field = getattr(email_instance, m2m_field_name)
-                m2m_field.set(contact_instances)
-                logger.debug(f"Updated {m2m_field_name} for email {email_instance.id} with {len(contact_instances)} contacts.")
+        source_path = default_storage.path(storage_key)
+    except NotImplementedError: # Remote-Storage ohne lokale Pfade
+        source_path = None
+    if source_path:
+        final_name = default_storage.get_available_name(target_name)
+        target_path = default_storage.path(final_name)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        file_move_safe(source_path, target_path)
+        return final_name
+    with default_storage.open(storage_key, 'rb') as staged_file:
+        final_name = default_storage.save(target_name, staged_file)
+    default_storage.delete(storage_key)
+    return final_name
+
+def _discard_staged_attachment(att_data: Dict[str, Any]):
+    storage_key = att_data.get('storage_key')
+    if storage_key:
+        try:
+            default_storage.delete(storage_key)
+        except Exception as e_delete:
+            logger.warning(f"Could not delete spooled attachment '{storage_key}': {e_delete}")
 
-    except Exception as e:
-        logger.error(f"Error updating contacts for email {email_instance.id}: {e}", exc_info=True)
-        # Fehler hier nicht weitergeben, um Hauptprozess nicht zu blockieren?
-        # Oder doch? Hängt von der gewünschten Robustheit ab.
-        # raise # -> Würde die übergeordnete Transaktion (falls vorhanden) rückgängig machen
+def get_or_create_attachment_blob(sha256: str, size: int, storage_key: Optional[str] = None, payload: Optional[bytes] = None) -> Tuple[AttachmentBlob, bool]:
+    """Returns the AttachmentBlob for sha256 and takes one reference on it.
+
+    If the content is already stored, the spooled file (storage_key) is discarded and nothing is
+    written; otherwise the spooled file is moved (or the payload written) to the blob path.
+    Raises ValueError if the blob is gone and neither storage_key nor payload is given.
+    """
+    if AttachmentBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1):
+        if storage_key:
+            _discard_staged_attachment({'storage_key': storage_key})
+        return AttachmentBlob.objects.get(sha256=sha256), False
+    if not storage_key and payload is None:
+        # Beim Spoolen existierte der Blob noch, wurde aber inzwischen gelöscht (letzte Referenz entfernt)
+        raise ValueError(f"AttachmentBlob {sha256[:12]} no longer exists and no content was spooled")
+
+    blob = AttachmentBlob(sha256=sha256, size=size, ref_count=1)
+    target_name = attachment_blob_upload_path(blob, sha256)
+    if storage_key:
+        blob.file.name = move_stored_file(storage_key, target_name)
+    else:
+        blob.file.name = default_storage.save(target_name, ContentFile(payload))
+    try:
+        with transaction.atomic():
+            blob.save()
+        return blob, True
+    except IntegrityError:
+        # Parallel von einem anderen Worker angelegt: dessen Datei verwenden, eigene verwerfen
+        default_storage.delete(blob.file.name)
+        AttachmentBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        return AttachmentBlob.objects.get(sha256=sha256), False
 
 def _process_attachments_from_dict(attachments_list: List[Dict[str, Any]], email_instance: Email):
-    """Processes and saves attachments from a list of attachment dictionaries."""
+    """Processes and saves attachments from a list of attachment dictionaries.
+
+    Attachments are either references to spooled files ('storage_key', see stage_attachment_payloads)
+    or inline payloads ('payload' bytes / 'payload_base64').
+    """
     saved_attachments_count = 0
     if not attachments_list:
         # logger.debug(f"No attachments data found in dict for email {email_instance.id}") # Zu Vebose
@@ -298,16 +475,13 @@ def _process_attachments_from_dict(attachments_list: List[Dict[str, Any]], email
     logger.debug(f"Processing {len(attachments_list)} attachments from dict for email {email_instance.id}")
     for att_data in attachments_list:
         try:
-            filename = att_data.get('filename', 'unknown_attachment')
-            payload_b64 = att_data.get('payload_base64')
+            filename = att_data.get('filename') or 'unknown_attachment'
+            storage_key = att_data.get('storage_key')
             content_type = att_data.get('content_type', 'application/octet-stream')
             content_id = att_data.get('content_id')
             content_disposition = att_data.get('content_disposition')
             size = att_data.get('size')
 
-            # Logge den abgerufenen Wert und Typ von payload_base64 (korrigierter Schlüssel im Log)
-            logger.debug(f"UID {email_instance.uid}: Inside loop for '{filename}'. Value from att_data.get('payload_base64'): TYPE={type(payload_b64)}, VALUE_START='{str(payload_b64)[:50]}...'")
-
             # Prüfe auf Duplikate
             is_duplicate = False
             if content_id and content_id in existing_content_ids:
@@ -318,34 +492,50 @@ def _process_attachments_from_dict(attachments_list: List[Dict[str, Any]], email
                  logger.debug(f"Skipping duplicate attachment based on filename '{filename}' (no Content-ID) for email {email_instance.id}")
 
             if is_duplicate:
+                _discard_staged_attachment(att_data)
                 continue
 
-            if not payload_b64:
-                logger.warning(f"Skipping attachment '{filename}' with missing base64 payload for email {email_instance.id}")
-                continue
-
-            # Dekodiere Base64 Payload
-            try:
-                payload_bytes = base64.b64decode(payload_b64)
-            except Exception as e_decode:
-                logger.error(f"Error decoding base64 payload for attachment '{filename}' (email {email_instance.id}): {e_decode}")
-                continue
-
-            # Erstelle ContentFile
-            # filename ist wichtig für Django, um den Pfad zu generieren!
-            attachment_file = ContentFile(payload_bytes, name=filename)
-
-            # Erstelle Attachment-Instanz und übergebe ContentFile an das FileField
-            # Django kümmert sich um das Speichern basierend auf upload_to
-            attachment_instance = Attachment.objects.create(
+            attachment_instance = Attachment(
                 email=email_instance,
                 filename=filename, # Originalfilename für Anzeige speichern
                 content_type=content_type,
-                size=size or len(payload_bytes),
+                size=size or 0,
                 content_id=content_id,
                 content_disposition=content_disposition,
-                file=attachment_file # Hier das ContentFile übergeben
             )
+            payload_bytes = None
+            if not storage_key and not att_data.get('blob_exists'):
+                payload_bytes = att_data.get('payload')
+                if payload_bytes is None and att_data.get('payload_base64'):
+                    try:
+                        payload_bytes = base64.b64decode(att_data['payload_base64'])
+                    except Exception as e_decode:
+                        logger.error(f"Error decoding base64 payload for attachment '{filename}' (email {email_instance.id}): {e_decode}")
+                        continue
+                if not payload_bytes:
+                    logger.warning(f"Skipping attachment '{filename}' with missing payload for email {email_instance.id}")
+                    continue
+                attachment_instance.size = size or len(payload_bytes)
+
+            sha256 = att_data.get('sha256')
+            if ATTACHMENT_DEDUP_ENABLED and (sha256 or payload_bytes is not None):
+                # Inhaltsadressiert: identische Anhänge teilen sich eine Datei (kein erneutes Schreiben/OCR/Embedding)
+                sha256 = sha256 or hashlib.sha256(payload_bytes).hexdigest()
+                blob, blob_created = get_or_create_attachment_blob(sha256, attachment_instance.size, storage_key=storage_key, payload=payload_bytes)
+                attachment_instance.blob = blob
+                attachment_instance.file.name = blob.file.name
+                if blob.analyzed_at:
+                    attachment_instance.extracted_text = blob.extracted_text
+                attachment_instance.save()
+                if not blob_created:
+                    logger.debug(f"Attachment '{filename}' for email {email_instance.id} reuses stored blob {sha256[:12]}")
+            elif storage_key:
+                # Bereits im Spool gespeichert: nur verschieben, keine Bytes über die Queue
+                attachment_instance.file.name = move_stored_file(storage_key, attachment_upload_path(attachment_instance, filename))
+                attachment_instance.save()
+            else:
+                # filename ist wichtig für Django, um den Pfad zu generieren (upload_to)
+                attachment_instance.file.save(filename, ContentFile(payload_bytes), save=True)
             saved_attachments_count += 1
             logger.info(f"Saved attachment '{filename}' ({attachment_instance.id}, path: {attachment_instance.file.name}) for email {email_instance.id}")
             
@@ -359,6 +549,76 @@ def _process_attachments_from_dict(attachments_list: List[Dict[str, Any]], email
     
     return saved_attachments_count
 
+def purge_attachment_spool(max_age_seconds: int = 24 * 60 * 60) -> int:
+    """Deletes spooled attachment files older than max_age_seconds (left over from failed save tasks)."""
+    purged_count = 0
+    cutoff = timezone.now() - timedelta(seconds=max_age_seconds)
+
+    def _walk(directory: str):
+        nonlocal purged_count
+        try:
+            subdirectories, files = default_storage.listdir(directory)
+        except FileNotFoundError:
+            return
+        for file_name in files:
+            name = f"{directory}/{file_name}"
+            try:
+                if default_storage.get_modified_time(name) < cutoff:
+                    default_storage.delete(name)
+                    purged_count += 1
+            except Exception as e_purge:
+                logger.warning(f"Could not purge spooled attachment '{name}': {e_purge}")
+        for subdirectory in subdirectories:
+            _walk(f"{directory}/{subdirectory}")
+
+    _walk(ATTACHMENT_SPOOL_DIR)
+    if purged_count:
+        logger.info(f"Purged {purged_count} stale spooled attachment files from '{ATTACHMENT_SPOOL_DIR}'.")
+    return purged_count
+
+# Felder, die im Bulk-Pfad direkt aus dem Mapper-Dict übernommen werden (keine Relationen/PK/Zeitstempel)
+_BULK_EXCLUDED_FIELDS = {'id', 'account', 'created_at', 'updated_at', 'search_vector'} # search_vector pflegt der Trigger
+
+def _email_fields_for_bulk() -> List[str]:
+    """Returns the concrete Email field names that can be written via bulk_create/bulk_update."""
+    return [
+        f.name for f in Email._meta.concrete_fields
+        if f.name not in _BULK_EXCLUDED_FIELDS and not f.is_relation
+    ]
+
+def _queue_markdown_generation(email_instance: Email, db_data: dict, created: bool):
+    """Queues markdown generation for an email if body_html was part of the saved data."""
+    if 'body_html' in db_data and db_data['body_html'] is not None:
+        try:
+            logger.info(f"Triggering markdown generation for email {email_instance.id}: body_html present (len={len(db_data['body_html']) if db_data['body_html'] else 0}) [AFTER TRANSACTION]")
+            async_task('mailmind.imap.tasks.generate_markdown_for_email_task', email_instance.id)
+            logger.info(f"Queued markdown generation task for email {email_instance.id} ({'created' if created else 'updated'}) [AFTER TRANSACTION]")
+        except Exception as q_err:
+            logger.error(f"Failed to queue markdown generation task for email {email_instance.id}: {q_err}", exc_info=True)
+    else:
+        logger.info(f"No body_html for email {email_instance.id} (UID: {email_instance.uid}, folder: {email_instance.folder_name}). Markdown generation not triggered. body_html in db_data: {'body_html' in db_data}, value: {db_data.get('body_html')}")
+
+def _broadcast_new_email(email_instance: Email):
+    """Sends an 'email.new' WebSocket event for the given email to the owning user."""
+    try:
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+        from mailmind.core.serializers import EmailDetailSerializer
+        user_id = email_instance.account.user_id
+        channel_layer = get_channel_layer()
+        group_name = f'user_{user_id}_events'
+        serializer = EmailDetailSerializer(email_instance)
+        email_data = serializer.data
+        logger.info(f"[store.py] Versuche WebSocket-Broadcast: user_id={user_id}, group={group_name}, email_id={email_instance.id}, data_keys={list(email_data.keys())}")
+        message = {
+            'type': 'email.new',
+            'email_data': email_data
+        }
+        async_to_sync(channel_layer.group_send)(group_name, message)
+        logger.info(f"[store.py] WebSocket-Broadcast: Neue E-Mail {email_instance.id} an Gruppe {group_name} gesendet.")
+    except Exception as ws_err:
+        logger.error(f"[store.py] WebSocket-Broadcast für neue E-Mail {email_instance.id} fehlgeschlagen: {ws_err}", exc_info=True)
+
 def save_email_content_from_dict(content_dict: dict, account: EmailAccount):
     """Creates or updates an Email record using uid/folder_name and updates its content fields.
        Also processes attachments and triggers markdown generation.
@@ -409,34 +669,9 @@ def save_email_content_from_dict(content_dict: dict, account: EmailAccount):
             if attachments_list:
                 _process_attachments_from_dict(attachments_list, email_instance)
         # --- Markdown-Task jetzt außerhalb der Transaktion triggern ---
-        if 'body_html' in db_data and db_data['body_html'] is not None:
-            try:
-                logger.info(f"Triggering markdown generation for email {email_instance.id}: body_html present (len={len(db_data['body_html']) if db_data['body_html'] else 0}) [AFTER TRANSACTION]")
-                async_task('mailmind.imap.tasks.generate_markdown_for_email_task', email_instance.id)
-                logger.info(f"Queued markdown generation task for email {email_instance.id} ({'created' if created else 'updated'}) [AFTER TRANSACTION]")
-            except Exception as q_err:
-                logger.error(f"Failed to queue markdown generation task for email {email_instance.id}: {q_err}", exc_info=True)
-        else:
-            logger.info(f"No body_html for email {email_instance.id} (UID: {uid}, folder: {folder_name}). Markdown generation not triggered. body_html in db_data: {'body_html' in db_data}, value: {db_data.get('body_html')}")
+        _queue_markdown_generation(email_instance, db_data, created)
         # --- WebSocket-Broadcast für neue E-Mails ---
-        try:
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            from mailmind.core.serializers import EmailDetailSerializer
-            user_id = email_instance.account.user.id
-            channel_layer = get_channel_layer()
-            group_name = f'user_{user_id}_events'
-            serializer = EmailDetailSerializer(email_instance)
-            email_data = serializer.data
-            logger.info(f"[store.py] Versuche WebSocket-Broadcast: user_id={user_id}, group={group_name}, email_id={email_instance.id}, data_keys={list(email_data.keys())}")
-            message = {
-                'type': 'email.new',
-                'email_data': email_data
-            }
-            async_to_sync(channel_layer.group_send)(group_name, message)
-            logger.info(f"[store.py] WebSocket-Broadcast: Neue E-Mail {email_instance.id} an Gruppe {group_name} gesendet.")
-        except Exception as ws_err:
-            logger.error(f"[store.py] WebSocket-Broadcast für neue E-Mail {email_instance.id} fehlgeschlagen: {ws_err}", exc_info=True)
+        _broadcast_new_email(email_instance)
         # End of the with transaction.atomic() block
 
     except Email.MultipleObjectsReturned:
@@ -445,6 +680,118 @@ def save_email_content_from_dict(content_dict: dict, account: EmailAccount):
     except Exception as e:
         logger.error(f"Error saving/updating content for email with UID '{uid}' in folder '{folder_name}': {e}", exc_info=True)
 
+def save_email_contents_bulk(content_dicts: List[dict], account: EmailAccount) -> Tuple[List[Email], List[Dict[str, Any]]]:
+    """Creates or updates a whole batch of Email records with a constant number of queries.
+
+    Existing rows are resolved in one query keyed on (account, folder_name, uid); new rows are
+    inserted with bulk_create and existing ones updated with bulk_update inside one transaction.
+    If the bulk write fails, the batch falls back to per-item saves in savepoints so a single
+    broken email does not abort the rest. Contacts are resolved for the whole batch at once.
+
+    Returns:
+        A tuple (saved_instances, failures). failures contains one dict per failed item
+        with 'uid', 'folder_name' and 'error'.
+    """
+    failures: List[Dict[str, Any]] = []
+    if not content_dicts:
+        return [], failures
+
+    bulk_fields = _email_fields_for_bulk()
+
+    # 1. Validieren und nach (folder_name, uid) deduplizieren (letzter Eintrag gewinnt)
+    items_by_key: Dict[Tuple[str, str], dict] = {}
+    for content_dict in content_dicts:
+        uid = content_dict.get('uid')
+        folder_name = content_dict.get('folder_name')
+        if not uid or not folder_name:
+            logger.error(f"Skipping bulk save: uid ({uid}) or folder_name ({folder_name}) missing for MsgID {content_dict.get('message_id', '')}.")
+            failures.append({'uid': uid, 'folder_name': folder_name, 'error': 'missing uid or folder_name'})
+            continue
+        items_by_key[(folder_name, str(uid))] = content_dict
+
+    if not items_by_key:
+        return [], failures
+
+    # 2. Bestehende Zeilen für den gesamten Batch mit einer Query auflösen
+    folder_names = {key[0] for key in items_by_key}
+    uids = {key[1] for key in items_by_key}
+    existing_by_key = {
+        (email.folder_name, email.uid): email
+        for email in Email.objects.filter(account=account, folder_name__in=folder_names, uid__in=uids)
+        if (email.folder_name, email.uid) in items_by_key
+    }
+
+    # 3. Instanzen vorbereiten
+    now = timezone.now()
+    to_create: List[Tuple[Tuple[str, str], Email]] = []
+    to_update: List[Tuple[Tuple[str, str], Email]] = []
+    update_fields = set()
+    for key, content_dict in items_by_key.items():
+        try:
+            field_values = {f: content_dict[f] for f in bulk_fields if f in content_dict}
+            field_values['folder_name'], field_values['uid'] = key
+            instance = existing_by_key.get(key)
+            if instance is None:
+                instance = Email(account=account, **field_values)
+                to_create.append((key, instance))
+            else:
+                for field, value in field_values.items():
+                    setattr(instance, field, value)
+                instance.updated_at = now # bulk_update setzt auto_now nicht selbst
+                update_fields.update(field_values.keys())
+                to_update.append((key, instance))
+        except Exception as e:
+            logger.error(f"Error preparing email UID {key[1]} in folder '{key[0]}' for bulk save: {e}", exc_info=True)
+            failures.append({'uid': key[1], 'folder_name': key[0], 'error': str(e)})
+    update_fields.add('updated_at')
+
+    # 4. Schreiben: erst als Bulk, bei Fehlern pro Item in Savepoints
+    saved: List[Tuple[Tuple[str, str], Email, bool]] = []
+    try:
+        with transaction.atomic():
+            if to_create:
+                Email.objects.bulk_create([instance for _, instance in to_create])
+            if to_update:
+                Email.objects.bulk_update([instance for _, instance in to_update], fields=sorted(update_fields))
+        saved = [(key, instance, True) for key, instance in to_create] + [(key, instance, False) for key, instance in to_update]
+        logger.info(f"Bulk saved emails for account {account.id}: created {len(to_create)}, updated {len(to_update)}.")
+    except Exception as e_bulk:
+        logger.warning(f"Bulk write failed for account {account.id} ({e_bulk}). Falling back to per-item saves.")
+        for key, instance in to_create:
+            instance.pk = None
+        with transaction.atomic():
+            for key, instance, created in [(k, i, True) for k, i in to_create] + [(k, i, False) for k, i in to_update]:
+                try:
+                    with transaction.atomic():
+                        if created:
+                            instance.save(force_insert=True)
+                        else:
+                            instance.save(update_fields=sorted(update_fields))
+                    saved.append((key, instance, created))
+                except Exception as e_item:
+                    logger.error(f"Error saving email UID {key[1]} in folder '{key[0]}' for account {account.id}: {e_item}", exc_info=True)
+                    failures.append({'uid': key[1], 'folder_name': key[0], 'error': str(e_item)})
+
+    # 5. Anhänge pro E-Mail (benötigen die PKs aus Schritt 4)
+    for key, instance, created in saved:
+        attachments_list = items_by_key[key].get('attachments', [])
+        if attachments_list:
+            try:
+                with transaction.atomic():
+                    _process_attachments_from_dict(attachments_list, instance)
+            except Exception as e_att:
+                logger.error(f"Error processing attachments for email {instance.id} (UID {key[1]}): {e_att}", exc_info=True)
+
+    # 6. Kontakte für den gesamten Batch auflösen und verknüpfen
+    update_contacts_for_emails_bulk([(instance, items_by_key[key]) for key, instance, _ in saved], account.user)
+
+    # 7. Nebenwirkungen außerhalb der Transaktion
+    for key, instance, created in saved:
+        _queue_markdown_generation(instance, items_by_key[key], created)
+        _broadcast_new_email(instance)
+
+    return [instance for _, instance, _ in saved], failures
+
 def save_or_update_email_from_dict(content_dict: dict, account: EmailAccount, folder_name: str):
     """Primary function to save email data from a dictionary (likely from mapper).
        DEPRECATED: Text extraction is now handled in save_email_content_from_dict.
@@ -515,4 +862,87 @@ def save_or_update_email_from_dict(content_dict: dict, account: EmailAccount, fo
         logger.error(f"Error in save_or_update_email_from_dict for UID {uid} (MsgID: {message_id}): {e}", exc_info=True)
         return None, False # Fehler signalisieren
 
-    return email_instance, created
\ No newline at end of file
+    return email_instance, created
+
+# --- Inkrementeller Sync: Ordner-Status, Flag-Änderungen, gelöschte Nachrichten ---
+
+UID_UPDATE_CHUNK_SIZE = 1000 # Maximale Anzahl UIDs pro IN-Query
+
+def get_folder_sync_state(account: EmailAccount, folder_name: str) -> EmailFolderSyncState:
+    """Returns the persisted sync state for a folder, creating an empty one if needed."""
+    state, created = EmailFolderSyncState.objects.get_or_create(account=account, folder_name=folder_name)
+    if created:
+        logger.debug(f"Created empty sync state for account {account.id}, folder '{folder_name}'.")
+    return state
+
+def record_failed_saves(account: EmailAccount, failures: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Marks the smallest UID per folder whose content could not be saved.
+
+    sync_folder_incremental advances highest_uid when the fetch succeeded, before the content is
+    persisted; EmailFolderSyncState.retry_from_uid makes the next sync fetch from this UID again.
+    Returns {folder_name: smallest failed UID}.
+    """
+    lowest_by_folder = {}
+    for failure in failures:
+        try:
+            uid = int(failure.get('uid'))
+        except (TypeError, ValueError):
+            continue
+        folder_name = failure.get('folder_name')
+        if folder_name and (folder_name not in lowest_by_folder or uid < lowest_by_folder[folder_name]):
+            lowest_by_folder[folder_name] = uid
+    for folder_name, uid in lowest_by_folder.items():
+        state = get_folder_sync_state(account, folder_name)
+        # Atomar, da mehrere Save-Tasks desselben Ordners parallel laufen können
+        EmailFolderSyncState.objects.filter(pk=state.pk).update(
+            retry_from_uid=Least(Coalesce(F('retry_from_uid'), Value(uid)), Value(uid))
+        )
+        logger.warning(f"Saving failed from UID {uid} in '{folder_name}' (account {account.id}); next sync refetches from there.")
+    return lowest_by_folder
+
+def apply_flag_changes(account: EmailAccount, folder_name: str, flags_by_uid: Dict[str, List[str]]) -> int:
+    """Updates the flag fields of existing emails from a {uid: [flags]} mapping.
+    Returns the number of updated emails."""
+    if not flags_by_uid:
+        return 0
+    flag_field_names = ['flags', 'is_read', 'is_flagged', 'is_replied', 'is_deleted_on_server', 'is_draft', 'updated_at']
+    now = timezone.now()
+    uids = list(flags_by_uid.keys())
+    updated_count = 0
+    for i in range(0, len(uids), UID_UPDATE_CHUNK_SIZE):
+        chunk = uids[i:i + UID_UPDATE_CHUNK_SIZE]
+        to_update = []
+        for email_instance in Email.objects.filter(account=account, folder_name=folder_name, uid__in=chunk).only('id', 'uid', *flag_field_names):
+            flags = flags_by_uid.get(email_instance.uid, [])
+            email_instance.flags = flags
+            for field, value in map_flags_to_db(flags).items():
+                setattr(email_instance, field, value)
+            email_instance.updated_at = now
+            to_update.append(email_instance)
+        if to_update:
+            Email.objects.bulk_update(to_update, fields=flag_field_names)
+            updated_count += len(to_update)
+    logger.info(f"Applied flag changes to {updated_count} emails in folder '{folder_name}' (account {account.id}).")
+    return updated_count
+
+def mark_emails_deleted_on_server(account: EmailAccount, folder_name: str, uids: List[str]) -> int:
+    """Marks the given UIDs of a folder as deleted on the server. Returns the number of changed rows."""
+    marked_count = 0
+    uids = list(uids)
+    for i in range(0, len(uids), UID_UPDATE_CHUNK_SIZE):
+        chunk = uids[i:i + UID_UPDATE_CHUNK_SIZE]
+        marked_count += Email.objects.filter(
+            account=account, folder_name=folder_name, uid__in=chunk, is_deleted_on_server=False
+        ).update(is_deleted_on_server=True, updated_at=timezone.now())
+    if marked_count:
+        logger.info(f"[IMAP Sync] Marked {marked_count} emails in '{folder_name}' as deleted on server (account {account.id}).")
+    return marked_count
+
+def mark_missing_emails_deleted(account: EmailAccount, folder_name: str, server_uids: set) -> int:
+    """Marks all local emails of a folder whose UID is no longer on the server as deleted."""
+    local_uids = Email.objects.filter(
+        account=account, folder_name=folder_name, is_deleted_on_server=False
+    ).values_list('uid', flat=True)
+    missing_uids = [uid for uid in local_uids if uid not in server_uids]
+    return mark_emails_deleted_on_server(account, folder_name, missing_uids)
+
@@ -4,12 +4,16 @@ import socket
 import imaplib
 from django.utils import timezone
 from django_q.tasks import async_task, Task
-from mailmind.core.models import EmailAccount, Email
+from mailmind.core.models import EmailAccount, Email, EmailFolderSyncState
 from .connection import get_imap_connection
-from .fetch import fetch_uids_full, fetch_single_full_email
-from .store import save_or_update_email_from_dict, save_email_content_from_dict
+from .fetch import fetch_uids_full, fetch_single_full_email, get_folder_status, fetch_new_uids, fetch_flag_changes
+from .store import (
+    save_or_update_email_from_dict, save_email_content_from_dict, save_email_contents_bulk,
+    get_folder_sync_state, apply_flag_changes, mark_emails_deleted_on_server, mark_missing_emails_deleted,
+    record_failed_saves,
+)
 from imap_tools import MailboxFolderSelectError, MailboxFetchError, MailboxLoginError
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from django.db import transaction
 from .utils import FOLDER_PRIORITIES
 import html2text
@@ -25,16 +29,104 @@ FOLDER_UPDATE_TIMEOUT = 30 * 60 # 30 Minuten
 IDLE_FETCH_RETRIES = 3
 IDLE_FETCH_DELAY = 7 # Sekunden (Erhöht)
 
+def sync_folder_incremental(mailbox, account: EmailAccount, folder_name: str) -> Tuple[int, int]:
+    """
+    Synchronizes a folder based on its persisted sync state (UIDVALIDITY, highest UID, HIGHESTMODSEQ).
+
+    - UIDVALIDITY unknown or changed: full resync of all UIDs.
+    - Otherwise: only UID n+1:* is fetched, flag changes are read via CHANGEDSINCE (CONDSTORE)
+      and expunges via VANISHED (QRESYNC) or, without QRESYNC, via a UID-only comparison
+      when the MESSAGES count shows that messages were removed.
+
+    The highest UID is only advanced if fetching reported no errors, so failed
+    fetches are retried on the next sync. Content is saved later by save_batch_content_task;
+    UIDs it could not save are recorded in retry_from_uid (record_failed_saves), and the next
+    sync fetches again from the smallest of them.
+
+    Returns:
+        A tuple (total_processed, total_errors) as reported by fetch_uids_full.
+    """
+    state = get_folder_sync_state(account, folder_name)
+    status = get_folder_status(mailbox, folder_name)
+    uid_validity = status.get('UIDVALIDITY')
+    uid_next = status.get('UIDNEXT')
+    highest_modseq = status.get('HIGHESTMODSEQ')
+    message_count = status.get('MESSAGES')
+
+    mailbox.folder.set(folder_name)
+    total_processed, total_errors = 0, 0
+    now = timezone.now()
+
+    # Marker der Save-Tasks übernehmen und vor dem Fetch zurücksetzen (Zeilensperre gegen parallele record_failed_saves)
+    with transaction.atomic():
+        retry_from_uid = EmailFolderSyncState.objects.select_for_update().filter(pk=state.pk).values_list('retry_from_uid', flat=True).first()
+        if retry_from_uid is not None:
+            EmailFolderSyncState.objects.filter(pk=state.pk).update(retry_from_uid=None)
+
+    if state.uid_validity is None or uid_validity is None or state.uid_validity != uid_validity:
+        if state.uid_validity is not None:
+            logger.warning(f"UIDVALIDITY changed for '{folder_name}' account {account.id} ({state.uid_validity} -> {uid_validity}). Running full resync.")
+        else:
+            logger.info(f"No sync state for '{folder_name}' account {account.id}. Running full sync.")
+        server_uids = mailbox.uids(criteria='ALL', charset='UTF-8')
+        logger.info(f"Fetched {len(server_uids)} UIDs from '{folder_name}' for full sync.")
+        if server_uids:
+            total_processed, total_errors = fetch_uids_full(mailbox, server_uids, account, folder_name)
+        mark_missing_emails_deleted(account, folder_name, set(server_uids))
+        new_highest_uid = max((int(uid) for uid in server_uids), default=0)
+        state.last_full_sync_at = now
+    else:
+        fetch_above_uid = state.highest_uid
+        if retry_from_uid is not None and retry_from_uid - 1 < fetch_above_uid:
+            logger.info(f"'{folder_name}': saving failed from UID {retry_from_uid}, refetching from there.")
+            fetch_above_uid = max(retry_from_uid - 1, 0)
+        new_uids = []
+        if uid_next is None or uid_next - 1 > fetch_above_uid:
+            new_uids = fetch_new_uids(mailbox, fetch_above_uid)
+        logger.info(f"Incremental sync '{folder_name}': {len(new_uids)} new UIDs above {fetch_above_uid}.")
+        if new_uids:
+            total_processed, total_errors = fetch_uids_full(mailbox, new_uids, account, folder_name)
+        new_highest_uid = max([state.highest_uid] + [int(uid) for uid in new_uids])
+
+        vanished_uids = []
+        if state.highest_modseq and highest_modseq and highest_modseq > state.highest_modseq:
+            flags_by_uid, vanished_uids = fetch_flag_changes(mailbox, state.highest_modseq)
+            apply_flag_changes(account, folder_name, flags_by_uid)
+            if vanished_uids:
+                mark_emails_deleted_on_server(account, folder_name, vanished_uids)
+
+        expected_count = (state.message_count or 0) + len([uid for uid in new_uids if int(uid) > state.highest_uid])
+        if not getattr(mailbox, 'qresync_enabled', False) and message_count is not None \
+                and state.message_count is not None and message_count < expected_count:
+            logger.info(f"'{folder_name}': MESSAGES {message_count} < expected {expected_count}, checking for expunged UIDs.")
+            server_uids = set(mailbox.uids(criteria='ALL', charset='UTF-8'))
+            mark_missing_emails_deleted(account, folder_name, server_uids)
+
+    if total_errors == 0:
+        state.highest_uid = new_highest_uid
+    else:
+        logger.warning(f"Not advancing highest UID for '{folder_name}' (stays {state.highest_uid}) due to {total_errors} errors.")
+        if retry_from_uid is not None:
+            # Erneuter Versuch nicht sicher gelungen: Marker wiederherstellen
+            record_failed_saves(account, [{'uid': retry_from_uid, 'folder_name': folder_name}])
+    state.uid_validity = uid_validity
+    state.highest_modseq = highest_modseq
+    state.message_count = message_count
+    state.last_synced_at = now
+    # Ohne retry_from_uid: den setzen die Save-Tasks parallel (siehe record_failed_saves)
+    state.save(update_fields=['highest_uid', 'uid_validity', 'highest_modseq', 'message_count', 'last_full_sync_at', 'last_synced_at'])
+    return total_processed, total_errors
+
 @transaction.atomic
 def process_folder_metadata_task(account_id: int, folder_name: str):
     """
-    Task to fetch all UIDs for a folder and then fetch their full content.
+    Task to synchronize a folder: full fetch on first sync or UIDVALIDITY change,
+    otherwise only new UIDs and flag changes (see sync_folder_incremental).
     This is the main task for initial/full folder synchronization.
     """
     start_time = time.time()
     logger.info(f"--- Starting INITIAL sync for folder '{folder_name}' account {account_id} ---")
     account = None
-    all_uids = []
     total_processed = 0
     total_errors = 0
 
@@ -43,19 +135,7 @@ def process_folder_metadata_task(account_id: int, folder_name: str):
         logger.debug(f"Fetched account {account.email} for task.")
 
         with get_imap_connection(account) as mailbox:
-            logger.debug(f"Selecting folder '{folder_name}'...")
-            mailbox.folder.set(folder_name)
-            logger.debug(f"Folder '{folder_name}' selected successfully.")
-
-            fetch_uids_start = time.time()
-            all_uids = mailbox.uids(criteria='ALL', charset='UTF-8')
-            fetch_uids_duration = time.time() - fetch_uids_start
-            logger.info(f"Fetched {len(all_uids)} UIDs from '{folder_name}' in {fetch_uids_duration:.2f}s.")
-
-            if all_uids:
-                total_processed, total_errors = fetch_uids_full(mailbox, all_uids, account, folder_name)
-            else:
-                logger.info(f"No emails found in folder '{folder_name}'. Skipping full fetch.")
+            total_processed, total_errors = sync_folder_incremental(mailbox, account, folder_name)
 
         if total_errors > 0:
              logger.warning(f"Folder sync '{folder_name}' completed with {total_errors} errors.")
@@ -313,7 +393,12 @@ def generate_markdown_for_email_task(email_id: int):
 
 # Task to save content for a batch of emails
 def save_batch_content_task(batch_data: List[Dict[str, Any]], account_id: int):
-    """Saves the content (body, attachments) for a batch of emails."""
+    """Saves the content (body, attachments) for a batch of emails.
+
+    Uses save_email_contents_bulk, so the whole batch costs one lookup query plus
+    bulk_create/bulk_update instead of one update_or_create per email.
+    Failures of individual emails are logged and counted without aborting the batch.
+    """
     logger.info(f"!!! Task save_batch_content_task RECEIVED for account {account_id}, batch size: {len(batch_data)} !!!")
     start_time = time.time()
     processed_count = 0
@@ -322,22 +407,25 @@ def save_batch_content_task(batch_data: List[Dict[str, Any]], account_id: int):
     try:
         account = EmailAccount.objects.get(id=account_id)
         logger.info(f"Starting save_batch_content_task for account {account_id}, batch size: {len(batch_data)}")
-        for email_content_dict in batch_data:
-            try:
-                # Ruft jetzt die modifizierte Funktion in store.py auf, die update_or_create verwendet
-                save_email_content_from_dict(email_content_dict, account)
-                processed_count += 1
-            except Exception as e:
-                # Fehlermeldung sollte jetzt von save_email_content_from_dict kommen
-                # Hier nur noch zählen oder allgemeinen Fehler loggen?
-                logger.error(f"Error processing one email in save_batch_content_task for account {account_id}: {e}", exc_info=True)
-                error_count += 1
+        saved_instances, failures = save_email_contents_bulk(batch_data, account)
+        processed_count = len(saved_instances)
+        error_count = len(failures)
+        for failure in failures:
+            logger.error(f"Error processing email UID {failure['uid']} (folder '{failure['folder_name']}') in save_batch_content_task for account {account_id}: {failure['error']}")
+        if failures:
+            record_failed_saves(account, failures)
     except EmailAccount.DoesNotExist:
         logger.error(f"Account {account_id} not found for save_batch_content_task.")
         error_count = len(batch_data) # Alle als Fehler zählen
     except Exception as e:
         logger.error(f"Unexpected error in save_batch_content_task for account {account_id}: {e}", exc_info=True)
-        error_count = len(batch_data) # Alle als Fehler zählen
+        error_count = len(batch_data) - processed_count # Verbleibende als Fehler zählen
+        if account is not None:
+            try:
+                # Unklar, was gespeichert wurde: den ganzen Batch erneut holen lassen (Upsert ist idempotent)
+                record_failed_saves(account, batch_data)
+            except Exception as e_record:
+                logger.error(f"Could not record failed saves for account {account_id}: {e_record}", exc_info=True)
     finally:
         duration = time.time() - start_time
         logger.info(f"Finished save_batch_content_task for account {account_id}. Processed: {processed_count}, Errors: {error_count}. Duration: {duration:.2f}s")
@@ -345,13 +433,10 @@ def save_batch_content_task(batch_data: List[Dict[str, Any]], account_id: int):
 # --- NEUE TASK für IDLE Update --- 
 @transaction.atomic # Verwende Transaktion für Konsistenz
 def sync_folder_on_idle_update(account_id: int, folder_name: str):
-    """Task triggered by IDLE manager to fetch ALL missing emails in a folder."""
+    """Task triggered by IDLE manager to fetch new emails and flag/expunge changes in a folder."""
     start_time = time.time()
     logger.info(f"--- Starting IDLE SYNC for folder '{folder_name}' account {account_id} ---")
     account = None
-    server_uids = set()
-    local_uids = set()
-    missing_uids = set()
     total_processed = 0
     total_errors = 0
 
@@ -360,42 +445,9 @@ def sync_folder_on_idle_update(account_id: int, folder_name: str):
         logger.debug(f"IDLE SYNC: Fetched account {account.email} for task.")
 
         with get_imap_connection(account) as mailbox:
-            logger.debug(f"IDLE SYNC: Selecting folder '{folder_name}'...")
-            mailbox.folder.set(folder_name)
-            logger.debug(f"IDLE SYNC: Folder '{folder_name}' selected successfully.")
-
-            # 1. Fetch all UIDs from server
-            fetch_server_uids_start = time.time()
-            server_uids_list = mailbox.uids(criteria='ALL', charset='UTF-8')
-            server_uids = set(server_uids_list)
-            fetch_server_uids_duration = time.time() - fetch_server_uids_start
-            logger.info(f"IDLE SYNC: Fetched {len(server_uids)} UIDs from server folder '{folder_name}' in {fetch_server_uids_duration:.2f}s.")
-
-            # 2. Fetch all UIDs from local DB
-            fetch_local_uids_start = time.time()
-            local_uids = set(Email.objects.filter(account_id=account_id, folder_name=folder_name).values_list('uid', flat=True))
-            fetch_local_uids_duration = time.time() - fetch_local_uids_start
-            logger.info(f"IDLE SYNC: Fetched {len(local_uids)} UIDs from local DB for folder '{folder_name}' in {fetch_local_uids_duration:.2f}s.")
-
-            # 3. Calculate missing UIDs
-            missing_uids = server_uids - local_uids
-            logger.info(f"IDLE SYNC: Calculated {len(missing_uids)} missing UIDs for folder '{folder_name}'.")
-            if missing_uids:
-                 logger.debug(f"IDLE SYNC: Missing UIDs: {list(missing_uids)[:20]}...") # Log first 20
-                 # 4. Fetch full content for missing UIDs using the existing function
-                 total_processed, total_errors = fetch_uids_full(mailbox, list(missing_uids), account, folder_name)
-                 logger.info(f"IDLE SYNC: fetch_uids_full processed {total_processed} missing emails with {total_errors} errors.")
-            else:
-                logger.info(f"IDLE SYNC: No missing UIDs found in folder '{folder_name}'. Nothing to fetch.")
-                total_processed = 0
-                total_errors = 0
-
-            # Nach dem Vergleich der UIDs:
-            for local_email in Email.objects.filter(account_id=account_id, folder_name=folder_name):
-                if local_email.uid not in server_uids:
-                    local_email.is_deleted_on_server = True
-                    local_email.save(update_fields=["is_deleted_on_server"])
-                    logger.info(f"[IMAP Sync] UID {local_email.uid} nicht mehr auf Server in {folder_name}: lokal als gelöscht markiert.")
+            # Inkrementell: nur neue UIDs, Flag-Änderungen und gelöschte Nachrichten
+            total_processed, total_errors = sync_folder_incremental(mailbox, account, folder_name)
+            logger.info(f"IDLE SYNC: Incremental sync processed {total_processed} emails with {total_errors} errors.")
 
         # Nach Abschluss des IDLE-Syncs: WebSocket-Event anstoßen
         try:
@@ -2,7 +2,7 @@ import argparse
 from django.core.management.base import BaseCommand, CommandError
 from mailmind.core.models import Email
 # Import direkt aus embedding_tasks, da __init__ nicht mehr alle Tasks exportiert
-from mailmind.ai.embedding_tasks import generate_embeddings_for_email
+from mailmind.ai.embedding_tasks import generate_embeddings_for_email, EMBEDDING_TASK_BATCH_SIZE
 from django_q.tasks import async_task
 import logging
 
@@ -27,6 +27,12 @@ class Command(BaseCommand):
             action='store_true',
             help='Reprocess all emails, generating new embeddings and AI suggestions, overwriting existing ones.',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=EMBEDDING_TASK_BATCH_SIZE,
+            help=f'Number of emails per embedding task for --all/--reprocess (default: {EMBEDDING_TASK_BATCH_SIZE}).',
+        )
 
     def handle(self, *args, **options):
         email_id = options['email_id']
@@ -38,35 +44,41 @@ class Command(BaseCommand):
         if not email_id and not process_all and not reprocess:
             raise CommandError('Must specify either --email-id, --all, or --reprocess.')
 
-        emails_to_process = []
         if email_id:
             try:
-                email = Email.objects.prefetch_related('attachments').get(pk=email_id)
-                emails_to_process.append(email)
+                email = Email.objects.get(pk=email_id)
                 self.stdout.write(self.style.NOTICE(f'Found email with ID {email_id}.'))
             except Email.DoesNotExist:
                 raise CommandError(f'Email with ID "{email_id}" does not exist.')
-        elif process_all:
-            emails_to_process = Email.objects.filter(ai_processed=False).prefetch_related('attachments')
+            logger.info(f"Scheduling embedding generation task for email ID {email.id}")
+            async_task('mailmind.ai.embedding_tasks.generate_embeddings_for_email', email.id)
+            self.stdout.write(self.style.SUCCESS(f'Successfully queued email {email.id} for AI processing.'))
+            return
+
+        if process_all:
+            emails_to_process = Email.objects.filter(ai_processed=False)
             count = emails_to_process.count()
             self.stdout.write(self.style.NOTICE(f'Found {count} emails not yet AI-processed.'))
-        elif reprocess:
-            emails_to_process = Email.objects.all().prefetch_related('attachments')
+        else:
+            emails_to_process = Email.objects.all()
             count = emails_to_process.count()
             self.stdout.write(self.style.WARNING(f'Queueing reprocessing for all {count} emails.'))
 
-        if not emails_to_process:
+        if not count:
             self.stdout.write(self.style.SUCCESS('No emails found to process based on criteria.'))
             return
 
+        # Ein Task pro Batch, damit das Embedding-Modell echte Batches kodiert
+        batch_size = max(1, options['batch_size'])
+        email_ids = list(emails_to_process.order_by('id').values_list('id', flat=True))
         queued_count = 0
-        for email in emails_to_process:
-            self.stdout.write(f'Queueing AI processing for email ID: {email.id} (Subject: "{email.subject[:50]}...")')
+        for start in range(0, len(email_ids), batch_size):
+            batch_ids = email_ids[start:start + batch_size]
             try:
-                logger.info(f"Scheduling embedding generation task for email ID {email.id}")
-                async_task('mailmind.ai.embedding_tasks.generate_embeddings_for_email', email.id)
-                queued_count += 1
+                logger.info(f"Scheduling batch embedding task for {len(batch_ids)} emails (IDs {batch_ids[0]}..{batch_ids[-1]})")
+                async_task('mailmind.ai.embedding_tasks.generate_embeddings_for_emails', batch_ids)
+                queued_count += len(batch_ids)
             except Exception as task_error:
-                logger.error(f"Error scheduling task for email ID {email.id}: {task_error}")
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully queued {queued_count} email(s) for AI processing.')) 
\ No newline at end of file
+                logger.error(f"Error scheduling batch embedding task for email IDs {batch_ids[0]}..{batch_ids[-1]}: {task_error}")
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully queued {queued_count} email(s) for AI processing in batches of {batch_size}.'))
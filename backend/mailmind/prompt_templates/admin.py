@@ -3,8 +3,8 @@ from .models import PromptTemplate
 
 @admin.register(PromptTemplate)
 class PromptTemplateAdmin(admin.ModelAdmin):
-    list_display = ('name', 'provider', 'model_name', 'updated_at')
-    list_filter = ('provider',)
+    list_display = ('name', 'provider', 'model_name', 'response_cache_enabled', 'updated_at')
+    list_filter = ('provider', 'response_cache_enabled')
     search_fields = ('name', 'description', 'template', 'model_name')
     readonly_fields = ('created_at', 'updated_at')
     fieldsets = (
@@ -14,6 +14,9 @@ class PromptTemplateAdmin(admin.ModelAdmin):
         ('AI Configuration', {
             'fields': ('provider', 'model_name')
         }),
+        ('Response Cache', {
+            'fields': ('response_cache_enabled', 'response_cache_ttl', 'semantic_cache_threshold')
+        }),
         ('Template', {
             'fields': ('template',)
         }),
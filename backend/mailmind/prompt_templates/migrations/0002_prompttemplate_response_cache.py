@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prompt_templates", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prompttemplate",
+            name="response_cache_enabled",
+            field=models.BooleanField(
+                default=False,
+                help_text="Reuse AI responses for identical prompts (same provider, model and rendered prompt).",
+                verbose_name="Cache Responses",
+            ),
+        ),
+        migrations.AddField(
+            model_name="prompttemplate",
+            name="response_cache_ttl",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Lifetime of cached responses in seconds. Empty = AI_RESPONSE_CACHE_TTL.",
+                null=True,
+                verbose_name="Response Cache TTL (s)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="prompttemplate",
+            name="semantic_cache_threshold",
+            field=models.FloatField(
+                blank=True,
+                help_text="Optional cosine similarity (e.g. 0.97) above which a near-identical input reuses a cached response. Empty = exact matches only.",
+                null=True,
+                verbose_name="Semantic Cache Threshold",
+            ),
+        ),
+    ]
@@ -38,6 +38,24 @@ class PromptTemplate(models.Model):
         max_length=100, 
         help_text=_("Specific model name from the provider (e.g., 'gpt-4-turbo', 'gemini-1.5-pro-latest', 'llama3-70b-8192').")
     )
+    # Antwort-Cache (mailmind/ai/response_cache.py), standardmäßig aus
+    response_cache_enabled = models.BooleanField(
+        _("Cache Responses"),
+        default=False,
+        help_text=_("Reuse AI responses for identical prompts (same provider, model and rendered prompt).")
+    )
+    response_cache_ttl = models.PositiveIntegerField(
+        _("Response Cache TTL (s)"),
+        null=True,
+        blank=True,
+        help_text=_("Lifetime of cached responses in seconds. Empty = AI_RESPONSE_CACHE_TTL.")
+    )
+    semantic_cache_threshold = models.FloatField(
+        _("Semantic Cache Threshold"),
+        null=True,
+        blank=True,
+        help_text=_("Optional cosine similarity (e.g. 0.97) above which a near-identical input reuses a cached response. Empty = exact matches only.")
+    )
     # Allow null for fixtures, remove auto fields
     created_at = models.DateTimeField(_("Created At"), null=True, blank=True)
     updated_at = models.DateTimeField(_("Updated At"), null=True, blank=True)
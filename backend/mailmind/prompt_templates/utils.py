@@ -22,9 +22,13 @@ async def get_prompt_details(name: str) -> dict | None:
         template = await sync_to_async(PromptTemplate.objects.get)(name=name)
         
         prompt_details = {
+            'name': template.name,
             'prompt': template.prompt,
             'provider': template.provider,
-            'model_name': template.model_name
+            'model_name': template.model_name,
+            'response_cache_enabled': template.response_cache_enabled,
+            'response_cache_ttl': template.response_cache_ttl,
+            'semantic_cache_threshold': template.semantic_cache_threshold,
         }
         # Cache for specified timeout (e.g., 1 hour)
         cache.set(cache_key, prompt_details, timeout=settings.PROMPT_CACHE_TIMEOUT if hasattr(settings, 'PROMPT_CACHE_TIMEOUT') else 3600)
@@ -56,10 +60,14 @@ def get_prompt_details_sync(name: str) -> dict | None:
         template = PromptTemplate.objects.get(name=name)
         
         prompt_details = {
+            'name': template.name,
             # Verwende den tatsächlichen Feldnamen aus dem Modell
             'prompt': template.prompt, 
             'provider': template.provider,
-            'model_name': template.model_name
+            'model_name': template.model_name,
+            'response_cache_enabled': template.response_cache_enabled,
+            'response_cache_ttl': template.response_cache_ttl,
+            'semantic_cache_threshold': template.semantic_cache_threshold,
         }
         # Cache synchron setzen
         cache.set(cache_key, prompt_details, timeout=settings.PROMPT_CACHE_TIMEOUT if hasattr(settings, 'PROMPT_CACHE_TIMEOUT') else 3600)